@@ -3,6 +3,8 @@ import open3d as o3d
 import cv2
 import os
 
+from backprojection import depth_to_points
+
 # -----------------------------
 # 1. Paths to input files
 # -----------------------------
@@ -29,17 +31,9 @@ fx, fy, cx, cy = 1906.29, 1906.29, 1099.99, 619.98  # Adjust as necessary
 # -----------------------------
 # 4. Generate Point Cloud
 # -----------------------------
-points, colors = [], []
-h, w = depth_map.shape[:2]
-
-for v in range(h):
-    for u in range(w):
-        Z = depth_map[v, u]  # Depth value
-        if Z > 0:  # Only consider valid depth points
-            X = (u - cx) * Z / fx
-            Y = (v - cy) * Z / fy
-            points.append([X, Y, Z])
-            colors.append(rgb_image[v, u] / 255.0)  # Normalize color values
+# Only pixels with a valid depth (Z > 0) are kept
+points, colors = depth_to_points(depth_map, rgb_image, fx, fy, cx, cy)
+colors = colors / 255.0  # Normalize color values
 
 # Convert to Open3D format
 pcd = o3d.geometry.PointCloud()
@@ -0,0 +1,93 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+class BackProjector:
+    """
+    Pinhole back-projection for one camera setup.
+
+    The normalized ray components (u - cx) / fx and (v - cy) / fy only depend
+    on the intrinsics and the image resolution, so they are computed once as
+    float32 arrays of shape (H, W). Back-projecting a frame is then a masked
+    multiply by the depth values.
+    """
+
+    def __init__(self, fx, fy, cx, cy, width, height):
+        """
+        :param fx, fy, cx, cy: Camera intrinsics in pixels.
+        :param width, height: Image resolution the rays are built for.
+        """
+        self.fx = fx
+        self.fy = fy
+        self.cx = cx
+        self.cy = cy
+        self.width = width
+        self.height = height
+
+        # Build the 1D ray components in float64 and round once to float32
+        ray_x = ((np.arange(width) - cx) / fx).astype(np.float32)
+        ray_y = ((np.arange(height) - cy) / fy).astype(np.float32)
+
+        self.ray_x = np.ascontiguousarray(np.broadcast_to(ray_x[np.newaxis, :], (height, width)))
+        self.ray_y = np.ascontiguousarray(np.broadcast_to(ray_y[:, np.newaxis], (height, width)))
+
+    @property
+    def key(self):
+        return (self.fx, self.fy, self.cx, self.cy, self.width, self.height)
+
+    def backproject(self, depth_img, mask_bool):
+        """
+        Back-projects the masked pixels of a depth image.
+
+        :param depth_img: (H, W) depth image.
+        :param mask_bool: (H, W) boolean mask of the pixels to keep.
+        :return: (N, 3) float32 array of XYZ points, in mask (row-major) order.
+        """
+        if depth_img.shape != (self.height, self.width):
+            raise ValueError(
+                f"Depth image has shape {depth_img.shape}, but the back-projector "
+                f"was built for {(self.height, self.width)}"
+            )
+
+        z_values = depth_img[mask_bool].astype(np.float32)
+        x_values = self.ray_x[mask_bool] * z_values
+        y_values = self.ray_y[mask_bool] * z_values
+
+        return np.column_stack((x_values, y_values, z_values))
+
+
+@lru_cache(maxsize=8)
+def get_backprojector(fx, fy, cx, cy, width, height):
+    """
+    Returns the shared BackProjector for (fx, fy, cx, cy, width, height),
+    building it on first use.
+    """
+    return BackProjector(fx, fy, cx, cy, width, height)
+
+
+def depth_to_points(depth_img, color_img, fx, fy, cx, cy, mask=None):
+    """
+    Vectorized depth (+ mask) -> point cloud conversion.
+
+    Only pixels with a valid depth (Z > 0) and, if a mask is given, a
+    non-zero mask value are kept.
+
+    :param depth_img: (H, W) depth image.
+    :param color_img: (H, W, 3) color image; channels are returned as-is.
+    :param fx, fy, cx, cy: Camera intrinsics in pixels.
+    :param mask: Optional (H, W) mask; pixels where it is 0 are dropped.
+    :return: Tuple (points, colors): (N, 3) float32 XYZ and (N, 3) colors
+             with the dtype of 'color_img'.
+    """
+    height, width = depth_img.shape[:2]
+
+    valid = depth_img > 0
+    if mask is not None:
+        valid &= mask > 0
+
+    projector = get_backprojector(fx, fy, cx, cy, width, height)
+    points = projector.backproject(depth_img, valid)
+    colors = color_img[valid]
+
+    return points, colors
@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+
+import cv2
+import numpy as np
+
+from backprojection import depth_to_points
+from depth_volume import estimate_volume
+from outlier_filter import grid_outlier_mask, window_for_neighbors
+from point_density import point_cloud_densities
+from stage_timing import peak_rss_mb
+from tiled_cloud import build_tiled_cloud, ply_point_chunks
+from voxel_count import count_occupied_voxels
+
+# Camera used in the field (same as pointcloud.py)
+FX, FY, CX, CY = 1906.29, 1906.29, 1099.99, 619.98
+WIDTH, HEIGHT = 2208, 1242
+
+
+def git_commit():
+    """
+    Commit hash of the working tree, or None outside a git checkout.
+    """
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def synthetic_frame(rng, width=WIDTH, height=HEIGHT, num_kernels=40, mask_fraction=0.3):
+    """
+    Generates a depth/RGB/mask triple that looks like a tray of peanuts:
+    a flat tray ~800 mm from the camera with ellipsoidal bumps on it, depth
+    noise, a few invalid (0) pixels and a mask covering the bumps.
+
+    :param rng: numpy Generator (seeded, so runs are reproducible).
+    :param mask_fraction: Approximate fraction of the frame covered by the mask.
+    :return: Tuple (depth uint16 (H, W), rgb uint8 (H, W, 3), mask uint8 (H, W)).
+    """
+    depth = np.full((height, width), 800.0, dtype=np.float32)
+    mask = np.zeros((height, width), dtype=np.uint8)
+
+    # Kernel radius so that num_kernels discs cover roughly mask_fraction
+    radius = int(np.sqrt(mask_fraction * width * height / (num_kernels * np.pi)))
+    yy, xx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    disc = (xx ** 2 + yy ** 2) <= radius ** 2
+    bump = np.where(disc, 30.0 * np.sqrt(np.clip(1.0 - (xx ** 2 + yy ** 2) / radius ** 2, 0, 1)), 0.0)
+
+    for _ in range(num_kernels):
+        v = rng.integers(radius, height - radius)
+        u = rng.integers(radius, width - radius)
+        window = (slice(v - radius, v + radius + 1), slice(u - radius, u + radius + 1))
+        depth[window] = np.minimum(depth[window], 800.0 - bump)
+        mask[window][disc] = 255
+
+    depth += rng.normal(0.0, 1.0, size=depth.shape).astype(np.float32)
+    depth[rng.random(depth.shape) < 0.005] = 0
+    rgb = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+
+    return np.clip(depth, 0, 65535).astype(np.uint16), rgb, mask
+
+
+# -----------------------------------------------------------------------------
+# Stages. Each takes the frame context dict, stores what later stages need in
+# it, and returns the number of points it processed.
+# -----------------------------------------------------------------------------
+def stage_backprojection(ctx):
+    ctx["points"], ctx["colors"] = depth_to_points(
+        ctx["depth"], ctx["rgb"], FX, FY, CX, CY, mask=ctx["mask"]
+    )
+    return len(ctx["points"])
+
+
+def stage_outlier_removal(ctx):
+    # Open3D is only needed by this stage and the density one
+    import open3d as o3d
+
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(ctx["points"])
+    pcd_clean, _ = pcd.remove_statistical_outlier(nb_neighbors=ctx["nb_neighbors"], std_ratio=0.5)
+    ctx["clean_points"] = np.asarray(pcd_clean.points)
+    return len(ctx["points"])
+
+
+def stage_grid_outlier_removal(ctx):
+    valid = (ctx["mask"] > 0) & (ctx["depth"] > 0)
+    inliers = grid_outlier_mask(
+        ctx["depth"], valid, FX, FY, CX, CY,
+        window=window_for_neighbors(ctx["nb_neighbors"]), std_ratio=0.5
+    )
+    ctx["grid_points"], _ = depth_to_points(ctx["depth"], ctx["rgb"], FX, FY, CX, CY, mask=inliers)
+    return int(valid.sum())
+
+
+def stage_tiled_cloud(ctx):
+    # Small bands, so that most pixels sit near a band edge
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ply_path = os.path.join(tmp_dir, "tiled.ply")
+        tiled = build_tiled_cloud(ctx["depth"], ctx["rgb"], ctx["mask"], ply_path, FX, FY, CX, CY,
+                                  band_rows=64, nb_neighbors=ctx["nb_neighbors"])
+        chunks = list(ply_point_chunks(ply_path, tiled["num_points"]))
+    ctx["tiled_points"] = np.concatenate(chunks) if chunks else np.zeros((0, 3), dtype=np.float32)
+    return int(((ctx["mask"] > 0) & (ctx["depth"] > 0)).sum())
+
+
+def check_tiled_cloud(ctx):
+    """
+    The banded cloud must have exactly the points of the whole-frame grid
+    filter (see tiled_cloud.py); raises if the two paths have drifted apart.
+    """
+    if "tiled_points" not in ctx or "grid_points" not in ctx:
+        return
+    if not np.array_equal(ctx["tiled_points"], ctx["grid_points"]):
+        raise RuntimeError(
+            f"Tiled cloud differs from the whole-frame grid filter "
+            f"({len(ctx['tiled_points'])} vs {len(ctx['grid_points'])} points)"
+        )
+
+
+def stage_instance_masks(ctx):
+    # Imported here so the other stages run without pycocotools
+    from masking_voxelize import rasterize_instances
+
+    # One polygon annotation per kernel outline of the synthetic mask
+    contours, _ = cv2.findContours(ctx["mask"], cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    ctx["annotations"] = [
+        {"id": idx + 1, "image_id": 1, "category_id": 1, "iscrowd": 0,
+         "segmentation": [contour.reshape(-1).astype(np.float64).tolist()]}
+        for idx, contour in enumerate(contours) if len(contour) >= 3
+    ]
+    ctx["labels"], _ = rasterize_instances(ctx["annotations"], *ctx["mask"].shape)
+    return len(ctx["annotations"])
+
+
+def check_instance_masks(ctx):
+    """
+    The bounding-box rasterisation of rasterize_instances() must give the
+    labels of the full-frame coco.annToMask() loop; raises otherwise.
+    """
+    if "labels" not in ctx:
+        return
+    from pycocotools.coco import COCO
+
+    height, width = ctx["mask"].shape
+    coco = COCO()
+    coco.dataset = {"images": [{"id": 1, "height": height, "width": width}],
+                    "annotations": ctx["annotations"], "categories": [{"id": 1}]}
+    coco.createIndex()
+    expected = np.zeros((height, width), dtype=np.uint16)
+    for label, ann in enumerate(ctx["annotations"], start=1):
+        expected[coco.annToMask(ann) > 0] = label
+    if not np.array_equal(ctx["labels"], expected):
+        raise RuntimeError(
+            f"Instance labels differ from the annToMask loop on "
+            f"{np.count_nonzero(ctx['labels'] != expected)} pixels"
+        )
+
+
+def stage_voxel_count(ctx):
+    points = ctx.get("clean_points", ctx["points"])
+    ctx["num_voxels"] = count_occupied_voxels(points, 10.0)
+    return len(points)
+
+
+def stage_density(ctx):
+    import open3d as o3d
+
+    # Same normalisation and parameters as save_ply.py
+    points = ctx.get("clean_points", ctx["points"])
+    scale = 1.0 / np.max(points.max(axis=0) - points.min(axis=0))
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(points * scale)
+    point_cloud_densities(pcd, 0.35, voxel_size=0.02)
+    return len(points)
+
+
+def stage_depth_volume(ctx):
+    estimate = estimate_volume(ctx["depth"], ctx["mask"], FX, FY, CX, CY)
+    return estimate["num_pixels"]
+
+
+STAGES = [
+    ("backprojection", stage_backprojection),
+    ("outlier_removal", stage_outlier_removal),
+    ("grid_outlier_removal", stage_grid_outlier_removal),
+    ("tiled_cloud", stage_tiled_cloud),
+    ("instance_masks", stage_instance_masks),
+    ("voxel_count", stage_voxel_count),
+    ("density", stage_density),
+    ("depth_volume", stage_depth_volume),
+]
+
+
+def run_benchmark(num_frames=3, width=WIDTH, height=HEIGHT, mask_fraction=0.3,
+                  nb_neighbors=350, stages=None, seed=0):
+    """
+    Times every stage on 'num_frames' synthetic frames.
+
+    :param stages: Optional list of stage names to run (default: all).
+    :return: Results dict (JSON-serialisable).
+    """
+    rng = np.random.default_rng(seed)
+    selected = [(name, func) for name, func in STAGES if stages is None or name in stages]
+
+    timings = {name: [] for name, _ in selected}
+    counts = {name: [] for name, _ in selected}
+    rss = {}
+
+    for frame_idx in range(num_frames):
+        depth, rgb, mask = synthetic_frame(rng, width, height, mask_fraction=mask_fraction)
+        ctx = {"depth": depth, "rgb": rgb, "mask": mask, "nb_neighbors": nb_neighbors}
+
+        # Every other stage needs the points, so build them (untimed) if
+        # back-projection itself is not benchmarked
+        if "backprojection" not in timings:
+            stage_backprojection(ctx)
+
+        for name, func in selected:
+            start = time.perf_counter()
+            num_points = func(ctx)
+            timings[name].append(time.perf_counter() - start)
+            counts[name].append(num_points)
+            rss[name] = peak_rss_mb()
+        check_tiled_cloud(ctx)
+        check_instance_masks(ctx)
+
+        print(f"[INFO] Frame {frame_idx + 1}/{num_frames}: " + ", ".join(
+            f"{name} {timings[name][-1]:.3f} s" for name, _ in selected))
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        # None if no selected stage loaded Open3D
+        "open3d": getattr(sys.modules.get("open3d"), "__version__", None),
+        "params": {
+            "num_frames": num_frames,
+            "width": width,
+            "height": height,
+            "mask_fraction": mask_fraction,
+            "nb_neighbors": nb_neighbors,
+            "seed": seed,
+        },
+        "stages": {},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    for name, _ in selected:
+        seconds = np.asarray(timings[name])
+        points = np.asarray(counts[name])
+        results["stages"][name] = {
+            "mean_s": float(seconds.mean()),
+            "min_s": float(seconds.min()),
+            "max_s": float(seconds.max()),
+            "points_per_frame": float(points.mean()),
+            "points_per_s": float(points.sum() / seconds.sum()) if seconds.sum() > 0 else None,
+            "frames_per_s": float(len(seconds) / seconds.sum()) if seconds.sum() > 0 else None,
+            "peak_rss_mb_after": rss[name],
+        }
+
+    return results
+
+
+def compare_results(results, baseline):
+    """
+    Prints the per-stage time of 'results' relative to an earlier run.
+
+    :param baseline: Results dict loaded from an earlier --output JSON.
+    """
+    print(f"\n=== Compared to {baseline.get('commit') or 'baseline'} ===")
+    for name, stats in results["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if old is None:
+            print(f"{name:>16}: not in baseline")
+            continue
+        ratio = stats["mean_s"] / old["mean_s"] if old["mean_s"] > 0 else float("inf")
+        print(f"{name:>16}: {old['mean_s']:.3f} s -> {stats['mean_s']:.3f} s ({ratio:.2f}x time)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the depth-to-volume hot paths on synthetic frames.")
+    parser.add_argument("--frames", type=int, default=3)
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--mask-fraction", type=float, default=0.3)
+    parser.add_argument("--nb-neighbors", type=int, default=350)
+    parser.add_argument("--stages", nargs="+", default=None,
+                        choices=[name for name, _ in STAGES])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the results as JSON here.")
+    parser.add_argument("--compare", default=None, help="Results JSON of an earlier run to compare against.")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        num_frames=args.frames,
+        width=args.width,
+        height=args.height,
+        mask_fraction=args.mask_fraction,
+        nb_neighbors=args.nb_neighbors,
+        stages=args.stages,
+        seed=args.seed
+    )
+
+    print("\n=== Results ===")
+    for name, stats in results["stages"].items():
+        print(f"{name:>16}: {stats['mean_s']:.3f} s/frame, "
+              f"{stats['points_per_s'] or 0:,.0f} points/s, "
+              f"{stats['frames_per_s'] or 0:.2f} frames/s")
+    if results["peak_rss_mb"] is not None:
+        print(f"Peak RSS: {results['peak_rss_mb']:.1f} MB")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare_results(results, json.load(f))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[INFO] Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import os
+import glob
+import argparse
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from backprojection import get_backprojector
+
+# -----------------------------------------------------------------------------
+# Volume straight from the masked depth map, without building a point cloud.
+#
+# A pixel sees a frustum whose cross-section at depth z has the area
+# z^2 / (fx * fy). The material under a masked pixel fills that frustum from
+# the measured surface Z down to the tray (reference) depth Z_ref, so its
+# volume is
+#
+#     integral_Z^Z_ref  z^2 / (fx * fy) dz  =  (Z_ref^3 - Z^3) / (3 * fx * fy)
+#
+# which is ~ Z^2 / (fx * fy) * (Z_ref - Z) for small heights. The frame's
+# volume is the sum over the masked pixels.
+# -----------------------------------------------------------------------------
+
+
+def fit_reference_plane(depth_img, support, fx, fy, cx, cy, stride=4, iterations=3):
+    """
+    Fits the tray plane to the 'support' pixels (e.g. everything outside the
+    mask) of a depth image.
+
+    A 3D plane n . P = d seen by a pinhole camera has 1 / Z linear in the
+    normalized ray (rx, ry), so the fit is a linear least-squares fit of
+    1 / Z = a * rx + b * ry + c. Pixels far from the plane (kernels that
+    the mask missed, edges) are trimmed over a few iterations.
+
+    :param depth_img: (H, W) depth image.
+    :param support: (H, W) boolean array of the pixels that show the tray.
+    :param fx, fy, cx, cy: Camera intrinsics in pixels.
+    :param stride: Use every stride-th row/column (the plane has 3 unknowns).
+    :param iterations: Number of trimming iterations.
+    :return: (3,) array (a, b, c) of the inverse-depth plane.
+    """
+    height, width = depth_img.shape
+    projector = get_backprojector(fx, fy, cx, cy, width, height)
+
+    sub = (slice(None, None, stride), slice(None, None, stride))
+    keep = support[sub] & (depth_img[sub] > 0)
+    if np.count_nonzero(keep) < 3:
+        raise ValueError("Not enough tray pixels to fit the reference plane")
+
+    design = np.column_stack((
+        projector.ray_x[sub][keep].astype(np.float64),
+        projector.ray_y[sub][keep].astype(np.float64),
+        np.ones(np.count_nonzero(keep))
+    ))
+    inv_depth = 1.0 / depth_img[sub][keep].astype(np.float64)
+
+    inliers = np.ones(len(inv_depth), dtype=bool)
+    for _ in range(iterations):
+        coeffs, *_ = np.linalg.lstsq(design[inliers], inv_depth[inliers], rcond=None)
+        residuals = np.abs(design @ coeffs - inv_depth)
+        mad = np.median(residuals[inliers])
+        if mad == 0:
+            break
+        inliers = residuals <= 3.0 * 1.4826 * mad
+
+    return coeffs
+
+
+def reference_depth(reference, projector, pixels):
+    """
+    Tray depth at the given pixels.
+
+    :param reference: Scalar depth, (H, W) depth image, or (a, b, c) inverse-depth
+                      plane from fit_reference_plane().
+    :param projector: BackProjector of the frame.
+    :param pixels: (H, W) boolean array of the pixels to evaluate.
+    :return: 1D float64 array of reference depths.
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    if reference.ndim == 0:
+        return np.full(np.count_nonzero(pixels), float(reference))
+    if reference.shape == pixels.shape:
+        return reference[pixels]
+    if reference.shape == (3,):
+        a, b, c = reference
+        inv_depth = a * projector.ray_x[pixels] + b * projector.ray_y[pixels] + c
+        return 1.0 / inv_depth
+    raise ValueError(f"Unsupported reference of shape {reference.shape}")
+
+
+def estimate_volume(depth_img, mask, fx, fy, cx, cy, reference=None, cubic_units_per_ml=1000.0):
+    """
+    Volume of the masked material in one depth frame.
+
+    :param depth_img: (H, W) depth image.
+    :param mask: (H, W) mask; non-zero pixels are material.
+    :param fx, fy, cx, cy: Camera intrinsics in pixels.
+    :param reference: Tray depth: a scalar, an (H, W) depth image of the empty
+                      tray, or an (a, b, c) plane from fit_reference_plane().
+                      If None, the plane is fitted to the unmasked pixels.
+    :param cubic_units_per_ml: Depth units cubed per ml (1000 for mm).
+    :return: Dict with 'volume_ml', 'num_pixels' and 'reference' (the one used).
+    """
+    height, width = depth_img.shape
+    projector = get_backprojector(fx, fy, cx, cy, width, height)
+
+    mask_bool = mask > 0
+    if reference is None:
+        reference = fit_reference_plane(depth_img, ~mask_bool, fx, fy, cx, cy)
+
+    pixels = mask_bool & (depth_img > 0)
+    z = depth_img[pixels].astype(np.float64)
+    z_ref = reference_depth(reference, projector, pixels)
+
+    # Frustum column from the surface down to the tray; nothing below the tray
+    column = (z_ref ** 3 - z ** 3) / (3.0 * fx * fy)
+    volume = np.clip(column, 0.0, None).sum() / cubic_units_per_ml
+
+    return {"volume_ml": float(volume), "num_pixels": int(np.count_nonzero(pixels)), "reference": reference}
+
+
+def estimate_volumes(depth_dir, mask_dir, fx, fy, cx, cy, reference=None, output_csv=None):
+    """
+    Depth-map volume of every '<name>.png' depth image with a '<name>_mask.png'.
+
+    :param reference: As in estimate_volume(); None fits the tray per frame.
+    :param output_csv: If provided, we will save the results as a CSV here.
+    :return: DataFrame with 'Image', 'Masked Pixels' and 'Depth Volume (ml)'.
+    """
+    results = []
+    for depth_path in sorted(glob.glob(os.path.join(depth_dir, "*.png"))):
+        base_name = os.path.splitext(os.path.basename(depth_path))[0]
+        mask_path = os.path.join(mask_dir, base_name + "_mask.png")
+        if not os.path.exists(mask_path):
+            print(f"[WARNING] No matching mask found for {depth_path}")
+            continue
+
+        depth_img = cv2.imread(depth_path, cv2.IMREAD_ANYDEPTH)
+        mask_img  = cv2.imread(mask_path,  cv2.IMREAD_GRAYSCALE)
+        if depth_img is None or mask_img is None:
+            print(f"[WARNING] Failed to read one or more files for {base_name}")
+            continue
+
+        try:
+            estimate = estimate_volume(depth_img, mask_img, fx, fy, cx, cy, reference=reference)
+        except ValueError as error:
+            # e.g. too few unmasked tray pixels to fit the plane
+            print(f"[WARNING] {base_name}: {error}; skipping")
+            continue
+        results.append({
+            "Image": base_name,
+            "Masked Pixels": estimate["num_pixels"],
+            "Depth Volume (ml)": estimate["volume_ml"]
+        })
+        print(f"[INFO] Image {base_name} -> {estimate['volume_ml']:.3f} ml")
+
+    out_df = pd.DataFrame(results, columns=["Image", "Masked Pixels", "Depth Volume (ml)"])
+    if output_csv:
+        out_df.to_csv(output_csv, index=False)
+        print(f"[INFO] Results saved to {output_csv}")
+    return out_df
+
+
+def main():
+    # Change these paths as needed
+    depth_dir  = r"A:\22May\depth"
+    mask_dir   = r"A:\22May\mask"
+    output_csv = r"A:\22May\depth_volumes.csv"
+
+    parser = argparse.ArgumentParser(description="Per-image volume straight from masked depth maps.")
+    parser.add_argument("--depth-dir", default=depth_dir)
+    parser.add_argument("--mask-dir", default=mask_dir)
+    parser.add_argument("--output-csv", default=output_csv)
+    parser.add_argument("--tray-depth", type=float, default=None,
+                        help="Fixed tray depth (depth units); by default a plane is fitted per frame.")
+    args = parser.parse_args()
+
+    # Camera intrinsics (same as pointcloud.py)
+    fx, fy, cx, cy = 1906.29, 1906.29, 1099.99, 619.98
+
+    estimate_volumes(
+        args.depth_dir,
+        args.mask_dir,
+        fx, fy, cx, cy,
+        reference=args.tray_depth,
+        output_csv=args.output_csv
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import os
+import json
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+# -----------------------------------------------------------------------------
+# Overlapped frame I/O: image decoding runs ahead of the compute on reader
+# threads, and output files are written behind it on a writer thread.
+# cv2.imread/imwrite and the file writes release the GIL, so on slow (e.g.
+# network) drives the disk time hides behind the compute of other frames.
+# -----------------------------------------------------------------------------
+
+_END = object()
+
+
+def read_frame(depth_path, rgb_path, mask_path):
+    """
+    Decodes one depth/RGB/mask triple.
+
+    :return: Tuple (depth (H, W), rgb (H, W, 3) BGR, mask (H, W)); an entry
+             is None if that file could not be read.
+    """
+    depth_img = cv2.imread(depth_path, cv2.IMREAD_ANYDEPTH)
+    rgb_img   = cv2.imread(rgb_path,  cv2.IMREAD_COLOR)      # shape: (H, W, 3)
+    mask_img  = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)  # shape: (H, W)
+    return depth_img, rgb_img, mask_img
+
+
+def label_paths(mask_dir, base_name):
+    """
+    Paths of the instance-label PNG of a frame and of its JSON sidecar
+    (label -> annotation id).
+    """
+    stem = os.path.join(mask_dir, base_name + "_labels")
+    return stem + ".png", stem + ".json"
+
+
+def save_labels(labels, label_to_ann, label_path, sidecar_path):
+    """
+    Writes a 16-bit label PNG and its JSON sidecar.
+    """
+    cv2.imwrite(label_path, labels)
+    with open(sidecar_path, "w") as f:
+        json.dump({"labels": {str(label): ann_id for label, ann_id in label_to_ann.items()}}, f)
+
+
+def load_labels(label_path, sidecar_path=None):
+    """
+    Reads an instance-label mask written by save_labels().
+
+    :return: Tuple (labels (H, W) uint16 or None, dict {label: annotation id}).
+    """
+    if sidecar_path is None:
+        sidecar_path = os.path.splitext(label_path)[0] + ".json"
+    labels = cv2.imread(label_path, cv2.IMREAD_UNCHANGED)
+    with open(sidecar_path, "r") as f:
+        label_to_ann = {int(label): ann_id for label, ann_id in json.load(f)["labels"].items()}
+    return labels, label_to_ann
+
+
+def prefetched(items, load, ahead=4):
+    """
+    Yields (item, load(item)) in the order of 'items', while the next 'ahead'
+    items are already being loaded on background threads. The look-ahead is
+    refilled before an item is handed out, so while the consumer works on
+    it up to 'ahead' more are loaded: at most ahead + 1 loaded items are in
+    memory at any time.
+
+    Exceptions raised by 'load' are re-raised when their item is reached.
+    """
+    items = iter(items)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=max(ahead, 1)) as executor:
+        try:
+            for item in items:
+                pending.append((item, executor.submit(load, item)))
+                if len(pending) >= ahead:
+                    break
+
+            while pending:
+                item, future = pending.popleft()
+                # Keep the look-ahead full before handing this item out
+                next_item = next(items, _END)
+                if next_item is not _END:
+                    pending.append((next_item, executor.submit(load, next_item)))
+                yield item, future.result()
+        finally:
+            # The consumer stopped early: drop the loads that have not started
+            for _, future in pending:
+                future.cancel()
+
+
+class BackgroundWriter:
+    """
+    Runs write jobs on a background thread so the caller can move on to the
+    next frame. At most 'max_pending' jobs are queued; submit() blocks beyond
+    that, which bounds the memory held by frames waiting to be written.
+
+        with BackgroundWriter() as writer:
+            future = writer.submit(o3d.io.write_point_cloud, path, pcd)
+    """
+
+    def __init__(self, max_pending=4, workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queues func(*args, **kwargs) and returns its Future.
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def close(self):
+        """
+        Waits for every queued write to finish.
+        """
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
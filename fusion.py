@@ -0,0 +1,305 @@
+import os
+import re
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from pointcloud_cache import load_point_arrays, write_ply_arrays
+from sparse_voxels import SparseVoxelSet
+
+# -----------------------------------------------------------------------------
+# Multi-view fusion: several clouds of the same sample (e.g. '12_a_cloud.ply',
+# '12_b_cloud.ply', ... written by pointcloud.py) are registered to one
+# reference view and merged, so the fused cloud also covers what a single
+# view cannot see.
+#
+# Registration only uses voxel-downsampled copies: FPFH features + RANSAC
+# for the coarse alignment, then point-to-plane ICP to refine it. The
+# reference of a sample is downsampled and described once, in a worker
+# process, and sent as plain arrays to the workers that register its other
+# views, so the views of a sample are aligned in parallel. A pair that
+# fails (e.g. an empty view) is left out like a low-fitness one. The
+# full-resolution points are then transformed and written as
+# '<sample>_cloud.ply', which peanut_voxelize.voxelize_and_compute_volumes
+# reads like any other cloud.
+# -----------------------------------------------------------------------------
+DEFAULT_VIEW_PATTERN = r"^(?P<sample>.+)_(?P<view>[^_]+)_cloud\.ply$"
+
+
+def group_views(ply_dir, pattern=DEFAULT_VIEW_PATTERN):
+    """
+    Groups the PLYs of a folder by sample.
+
+    :param pattern: Regular expression with a 'sample' group, matched
+                    against the file names; files that do not match are skipped.
+    :return: Dict {sample: sorted list of PLY paths}, samples sorted.
+    """
+    regex = re.compile(pattern)
+    groups = {}
+    for ply_path in sorted(glob.glob(os.path.join(ply_dir, "*.ply"))):
+        match = regex.match(os.path.basename(ply_path))
+        if match:
+            groups.setdefault(match.group("sample"), []).append(ply_path)
+    return dict(sorted(groups.items()))
+
+
+def preprocess(points, voxel_size):
+    """
+    Downsampled copy of a cloud with normals and FPFH features.
+
+    :return: Tuple (open3d PointCloud, FPFH Feature).
+    """
+    import open3d as o3d
+
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(np.asarray(points, dtype=np.float64))
+    down = pcd.voxel_down_sample(voxel_size)
+    if len(down.points) < 3:
+        raise ValueError(f"Too few points to register ({len(down.points)} after downsampling)")
+    down.estimate_normals(o3d.geometry.KDTreeSearchParamHybrid(radius=2.0 * voxel_size, max_nn=30))
+    fpfh = o3d.pipelines.registration.compute_fpfh_feature(
+        down, o3d.geometry.KDTreeSearchParamHybrid(radius=5.0 * voxel_size, max_nn=100)
+    )
+    return down, fpfh
+
+
+def preprocess_ply(ply_path, voxel_size):
+    """
+    preprocess() of a saved cloud as plain arrays, which (unlike the Open3D
+    objects) can be sent between processes. Top-level for the process pool.
+
+    :return: Tuple (points, normals, features): (M, 3), (M, 3) and (33, M) float64.
+    """
+    down, fpfh = preprocess(load_point_arrays(ply_path)[0], voxel_size)
+    return np.asarray(down.points), np.asarray(down.normals), np.asarray(fpfh.data)
+
+
+def from_arrays(points, normals, features):
+    """
+    Inverse of preprocess_ply(): (open3d PointCloud, FPFH Feature).
+    """
+    import open3d as o3d
+
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(points)
+    pcd.normals = o3d.utility.Vector3dVector(normals)
+    fpfh = o3d.pipelines.registration.Feature()
+    fpfh.data = features
+    return pcd, fpfh
+
+
+def register_pair(source_path, target_path, voxel_size, target_arrays=None, ransac_iterations=100000, seed=0):
+    """
+    Rigid transform that maps the source cloud onto the target cloud. This
+    is a top-level function so it can be sent to a process pool.
+
+    :param voxel_size: Downsampling voxel size of the registration (point units);
+                       the feature radii and distance thresholds scale with it.
+    :param target_arrays: preprocess_ply() of the target, if already computed
+                          (shared by every view registered to one reference).
+    :param ransac_iterations: Maximum RANSAC iterations of the coarse alignment.
+    :param seed: Open3D random seed, so the result is reproducible.
+    :return: Dict with 'source', 'target', 'transformation' (4x4 list),
+             'fitness' and 'inlier_rmse' (of the ICP on the downsampled copies).
+    """
+    import open3d as o3d
+    registration = o3d.pipelines.registration
+
+    o3d.utility.random.seed(seed)
+    source, source_fpfh = preprocess(load_point_arrays(source_path)[0], voxel_size)
+    if target_arrays is None:
+        target_arrays = preprocess_ply(target_path, voxel_size)
+    target, target_fpfh = from_arrays(*target_arrays)
+
+    # Coarse: RANSAC on FPFH feature matches
+    distance = 1.5 * voxel_size
+    coarse = registration.registration_ransac_based_on_feature_matching(
+        source, target, source_fpfh, target_fpfh, True, distance,
+        registration.TransformationEstimationPointToPoint(False), 3,
+        [
+            registration.CorrespondenceCheckerBasedOnEdgeLength(0.9),
+            registration.CorrespondenceCheckerBasedOnDistance(distance),
+        ],
+        registration.RANSACConvergenceCriteria(ransac_iterations, 0.999)
+    )
+
+    # Fine: point-to-plane ICP from the coarse pose
+    fine = registration.registration_icp(
+        source, target, distance, coarse.transformation,
+        registration.TransformationEstimationPointToPlane(),
+        registration.ICPConvergenceCriteria(max_iteration=50)
+    )
+
+    return {
+        "source": source_path,
+        "target": target_path,
+        "transformation": np.asarray(fine.transformation).tolist(),
+        "fitness": float(fine.fitness),
+        "inlier_rmse": float(fine.inlier_rmse),
+    }
+
+
+def transform_points(points, transformation):
+    """
+    Applies a 4x4 rigid transform to (N, 3) points (float32 out).
+    """
+    transformation = np.asarray(transformation, dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64)
+    return (points @ transformation[:3, :3].T + transformation[:3, 3]).astype(np.float32)
+
+
+def fuse_views(ply_paths, registrations, fused_ply_path, min_fitness=0.3):
+    """
+    Transforms the full-resolution views into the reference frame and writes
+    them as one cloud. Views whose registration failed ('error') or whose
+    fitness is below 'min_fitness' are left out.
+
+    :param ply_paths: Views of the sample; the first is the reference.
+    :param registrations: Dict {view path: register_pair() result} of the other views.
+    :return: Tuple (fused points, fused colors or None, list of the views used).
+    """
+    point_arrays, color_arrays, used = [], [], []
+    for ply_path in ply_paths:
+        if ply_path == ply_paths[0]:
+            transformation = np.eye(4)
+        else:
+            result = registrations[ply_path]
+            if "error" in result:
+                print(f"[WARNING] Leaving out {ply_path}: registration failed ({result['error']})")
+                continue
+            if result["fitness"] < min_fitness:
+                print(f"[WARNING] Leaving out {ply_path}: registration fitness "
+                      f"{result['fitness']:.2f} < {min_fitness}")
+                continue
+            transformation = result["transformation"]
+
+        points, colors = load_point_arrays(ply_path)
+        point_arrays.append(transform_points(points, transformation))
+        color_arrays.append(colors)
+        used.append(ply_path)
+
+    points = np.concatenate(point_arrays)
+    colors = None
+    if all(colors is not None for colors in color_arrays):
+        colors = np.concatenate(color_arrays)
+    write_ply_arrays(fused_ply_path, points, colors)
+    return points, colors, used
+
+
+def fuse_folder(ply_dir, out_dir, voxel_size=2.0, pattern=DEFAULT_VIEW_PATTERN, workers=None,
+                min_fitness=0.3, occupancy_voxel_size=None):
+    """
+    Registers and fuses the views of every sample of a folder.
+
+    Writes '<out_dir>/<sample>_cloud.ply' (the fused cloud, ready for
+    peanut_voxelize.voxelize_and_compute_volumes(pointcloud_dir=out_dir))
+    and '<sample>_fusion.json' (the transforms and their fitness, or the
+    error of the views that could not be registered). With
+    'occupancy_voxel_size' the fused occupancy is also saved as
+    '<sample>_voxels.npz' (see sparse_voxels.py).
+
+    :param voxel_size: Downsampling voxel size of the registration.
+    :param workers: Number of worker processes for the registrations.
+    :return: List of per-sample dicts ('sample', 'views', 'views_used',
+             'num_points', and 'num_voxels' with occupancy_voxel_size).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    groups = group_views(ply_dir, pattern)
+
+    # Every reference is preprocessed once; as soon as one is ready, the
+    # (view -> reference) pairs of its sample go to the same pool
+    registrations = {}
+
+    def record_failure(source_path, target_path, error):
+        # One bad view (e.g. empty, so no features) must not abort the folder
+        registrations[source_path] = {"source": source_path, "target": target_path, "error": repr(error)}
+        print(f"[WARNING] Failed to register {os.path.basename(source_path)} -> "
+              f"{os.path.basename(target_path)}: {error!r}")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        references = {
+            pool.submit(preprocess_ply, ply_paths[0], voxel_size): ply_paths
+            for ply_paths in groups.values()
+            if len(ply_paths) > 1
+        }
+        pairs = {}
+        for future in as_completed(references):
+            ply_paths = references[future]
+            try:
+                target_arrays = future.result()
+            except Exception as error:
+                for ply_path in ply_paths[1:]:
+                    record_failure(ply_path, ply_paths[0], error)
+                continue
+            for ply_path in ply_paths[1:]:
+                pair = pool.submit(register_pair, ply_path, ply_paths[0], voxel_size, target_arrays)
+                pairs[pair] = (ply_path, ply_paths[0])
+
+        for future in as_completed(pairs):
+            try:
+                result = future.result()
+            except Exception as error:
+                record_failure(*pairs[future], error)
+                continue
+            registrations[result["source"]] = result
+            print(f"[INFO] Registered {os.path.basename(result['source'])} -> "
+                  f"{os.path.basename(result['target'])} (fitness {result['fitness']:.2f}, "
+                  f"RMSE {result['inlier_rmse']:.3f})")
+
+    summary = []
+    for sample, ply_paths in groups.items():
+        fused_ply_path = os.path.join(out_dir, f"{sample}_cloud.ply")
+        points, _, used = fuse_views(ply_paths, registrations, fused_ply_path, min_fitness)
+
+        with open(os.path.join(out_dir, f"{sample}_fusion.json"), "w") as f:
+            json.dump({
+                "reference": ply_paths[0],
+                "voxel_size": voxel_size,
+                "views": [registrations[ply_path] for ply_path in ply_paths[1:]],
+                "views_used": used,
+            }, f, indent=2)
+
+        row = {"sample": sample, "views": len(ply_paths), "views_used": len(used), "num_points": len(points)}
+        if occupancy_voxel_size is not None:
+            occupancy = SparseVoxelSet.from_points(points, occupancy_voxel_size)
+            occupancy.save(os.path.join(out_dir, f"{sample}_voxels.npz"))
+            row["num_voxels"] = len(occupancy)
+        summary.append(row)
+        print(f"[INFO] Fused {len(used)}/{len(ply_paths)} views of sample {sample} -> {fused_ply_path}")
+
+    return summary
+
+
+def main():
+    # Change these paths as needed
+    ply_dir = r"A:\22May\pointcloud"
+    out_dir = r"A:\22May\fused"
+
+    parser = argparse.ArgumentParser(description="Register and fuse several views of each sample.")
+    parser.add_argument("--ply-dir", default=ply_dir)
+    parser.add_argument("--out-dir", default=out_dir,
+                        help="Fused '<sample>_cloud.ply' files go here (use it as the pointcloud_dir "
+                             "of peanut_voxelize.py).")
+    parser.add_argument("--pattern", default=DEFAULT_VIEW_PATTERN,
+                        help="Regex with a 'sample' group that groups the PLY file names into samples; "
+                             "the first file of a sample is the reference view.")
+    parser.add_argument("--voxel-size", type=float, default=2.0,
+                        help="Downsampling voxel size of the registration (point units).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes for the registrations (default: all cores).")
+    parser.add_argument("--min-fitness", type=float, default=0.3,
+                        help="Leave out views whose ICP fitness is below this.")
+    parser.add_argument("--occupancy-voxel-size", type=float, default=None,
+                        help="Also save the fused occupancy as '<sample>_voxels.npz' at this voxel size.")
+    args = parser.parse_args()
+
+    fuse_folder(args.ply_dir, args.out_dir, voxel_size=args.voxel_size, pattern=args.pattern,
+                workers=args.workers, min_fitness=args.min_fitness,
+                occupancy_voxel_size=args.occupancy_voxel_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import glob
+import argparse
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from backprojection import get_backprojector
+from depth_volume import fit_reference_plane, reference_depth
+from frame_io import label_paths, load_labels
+from voxel_count import count_occupied_voxels_grouped
+
+# -----------------------------------------------------------------------------
+# Per-instance (per-pod / per-kernel) volumes from instance-label masks
+# written by "masking_voxelize.py --instances".
+#
+# A frame is back-projected once; every point carries the label of its
+# pixel, and the voxel counts and depth volumes of all instances come out of
+# one group-by over those labels, so a tray of K objects costs about the same
+# as one per-image volume.
+# -----------------------------------------------------------------------------
+
+
+def instance_table(depth_img, labels, fx, fy, cx, cy, voxel_size=10.0, volume_per_voxel_ml=None,
+                   reference=None, half_voxel_margin=True, cubic_units_per_ml=1000.0):
+    """
+    Voxel count and depth volume of every instance of one frame.
+
+    :param depth_img: (H, W) depth image.
+    :param labels: (H, W) instance-label mask (0 = background).
+    :param fx, fy, cx, cy: Camera intrinsics in pixels.
+    :param voxel_size: Edge length of a voxel (depth units); every instance
+                       is voxelized on its own grid, as a separate cloud would be.
+    :param volume_per_voxel_ml: If given, also report voxels * this value.
+    :param reference: Tray depth as in depth_volume.estimate_volume(); None
+                      fits the plane to the background pixels.
+    :param half_voxel_margin: See voxel_count.voxel_origin().
+    :param cubic_units_per_ml: Depth units cubed per ml (1000 for mm).
+    :return: Dict {label: {'num_points', 'num_voxels', 'depth_volume_ml'
+             (and 'volume_ml')}} for the labels that have valid depth.
+    """
+    height, width = depth_img.shape
+    projector = get_backprojector(fx, fy, cx, cy, width, height)
+
+    valid = (labels > 0) & (depth_img > 0)
+    points = projector.backproject(depth_img, valid)
+    point_labels = labels[valid]
+
+    ids, num_voxels, num_points = count_occupied_voxels_grouped(
+        points, point_labels, voxel_size, half_voxel_margin=half_voxel_margin
+    )
+
+    # Frustum column of every pixel down to the tray, summed per label
+    if reference is None:
+        reference = fit_reference_plane(depth_img, labels == 0, fx, fy, cx, cy)
+    z = depth_img[valid].astype(np.float64)
+    column = np.clip((reference_depth(reference, projector, valid) ** 3 - z ** 3) / (3.0 * fx * fy), 0.0, None)
+    depth_volumes = np.bincount(point_labels, weights=column)[ids] / cubic_units_per_ml
+
+    table = {}
+    for label, voxels, count, depth_volume in zip(ids, num_voxels, num_points, depth_volumes):
+        row = {"num_points": int(count), "num_voxels": int(voxels), "depth_volume_ml": float(depth_volume)}
+        if volume_per_voxel_ml is not None:
+            row["volume_ml"] = voxels * volume_per_voxel_ml
+        table[int(label)] = row
+    return table
+
+
+def instance_volumes(depth_dir, mask_dir, fx, fy, cx, cy, voxel_size=10.0, volume_per_voxel_ml=None,
+                     reference=None, output_csv=None):
+    """
+    Per-instance table of every '<name>.png' depth image with a '<name>_labels.png'.
+
+    :param output_csv: If provided, we will save the results as a CSV here.
+    :return: DataFrame with one row per instance: 'Image', 'Label',
+             'Annotation ID', 'Num Points', 'Num Voxels', 'Volume (ml)'
+             (empty unless volume_per_voxel_ml is given) and 'Depth Volume (ml)'.
+    """
+    columns = ["Image", "Label", "Annotation ID", "Num Points", "Num Voxels", "Volume (ml)", "Depth Volume (ml)"]
+    results = []
+    for depth_path in sorted(glob.glob(os.path.join(depth_dir, "*.png"))):
+        base_name = os.path.splitext(os.path.basename(depth_path))[0]
+        label_path, sidecar_path = label_paths(mask_dir, base_name)
+        if not (os.path.exists(label_path) and os.path.exists(sidecar_path)):
+            print(f"[WARNING] No matching label mask found for {depth_path}")
+            continue
+
+        depth_img = cv2.imread(depth_path, cv2.IMREAD_ANYDEPTH)
+        labels, label_to_ann = load_labels(label_path, sidecar_path)
+        if depth_img is None or labels is None:
+            print(f"[WARNING] Failed to read one or more files for {base_name}")
+            continue
+
+        try:
+            table = instance_table(depth_img, labels, fx, fy, cx, cy, voxel_size=voxel_size,
+                                   volume_per_voxel_ml=volume_per_voxel_ml, reference=reference)
+        except ValueError as error:
+            # e.g. too few background pixels to fit the tray plane
+            print(f"[WARNING] {base_name}: {error}; skipping")
+            continue
+        for label, row in table.items():
+            results.append({
+                "Image": base_name,
+                "Label": label,
+                "Annotation ID": label_to_ann.get(label),
+                "Num Points": row["num_points"],
+                "Num Voxels": row["num_voxels"],
+                "Volume (ml)": row.get("volume_ml"),
+                "Depth Volume (ml)": row["depth_volume_ml"]
+            })
+        print(f"[INFO] Image {base_name} -> {len(table)} instances")
+
+    out_df = pd.DataFrame(results, columns=columns)
+    if output_csv:
+        out_df.to_csv(output_csv, index=False)
+        print(f"[INFO] Results saved to {output_csv}")
+    return out_df
+
+
+def main():
+    # Change these paths as needed
+    depth_dir  = r"A:\22May\depth"
+    mask_dir   = r"A:\22May\mask"
+    output_csv = r"A:\22May\instance_volumes.csv"
+
+    parser = argparse.ArgumentParser(description="Per-instance voxel counts and volumes from instance-label masks.")
+    parser.add_argument("--depth-dir", default=depth_dir)
+    parser.add_argument("--mask-dir", default=mask_dir,
+                        help="Folder with the <name>_labels.png/.json of 'masking_voxelize.py --instances'.")
+    parser.add_argument("--output-csv", default=output_csv)
+    parser.add_argument("--voxel-size", type=float, default=10.0)
+    parser.add_argument("--volume-per-voxel", type=float, default=None,
+                        help="ml per voxel (e.g. from peanut_voxelize.py) for the 'Volume (ml)' column.")
+    parser.add_argument("--tray-depth", type=float, default=None,
+                        help="Fixed tray depth (depth units); by default a plane is fitted per frame.")
+    args = parser.parse_args()
+
+    # Camera intrinsics (same as pointcloud.py)
+    fx, fy, cx, cy = 1906.29, 1906.29, 1099.99, 619.98
+
+    instance_volumes(
+        args.depth_dir,
+        args.mask_dir,
+        fx, fy, cx, cy,
+        voxel_size=args.voxel_size,
+        volume_per_voxel_ml=args.volume_per_voxel,
+        reference=args.tray_depth,
+        output_csv=args.output_csv
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,289 @@
 import os
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import cv2
 import numpy as np
+from pycocotools import mask as mask_utils
 from pycocotools.coco import COCO
 
+from frame_io import label_paths, save_labels
+from result_cache import ResultCache
+from stage_timing import StageTimer, profiled
+
+def annotation_rles(ann, height, width):
+    """
+    RLE(s) of one COCO annotation, whatever its segmentation format
+    (polygons, uncompressed RLE or compressed RLE).
+    """
+    segm = ann["segmentation"]
+    if isinstance(segm, list):
+        # Polygons: one RLE per polygon
+        return mask_utils.frPyObjects(segm, height, width)
+    if isinstance(segm["counts"], list):
+        # Uncompressed RLE
+        return [mask_utils.frPyObjects(segm, height, width)]
+    # Compressed RLE
+    return [segm]
+
+def rasterize_annotations(anns, height, width, mask=None):
+    """
+    Rasterises all annotations of an image in one batched call: every
+    polygon/RLE is converted to RLE, the RLEs are merged (union) in RLE space
+    and decoded once, then written into 'mask' in place as 0/255.
+
+    Gives the same pixels as OR-ing coco.annToMask(ann) over 'anns', without a
+    full-frame array per annotation.
+
+    :param anns: List of COCO annotation dicts of one image.
+    :param height, width: Image size.
+    :param mask: Optional (H, W) uint8 array to write into (reused between
+                 images); a new one is allocated otherwise.
+    :return: The (H, W) uint8 mask with 255 on annotated pixels.
+    """
+    if mask is None:
+        mask = np.zeros((height, width), dtype=np.uint8)
+
+    rles = [rle for ann in anns for rle in annotation_rles(ann, height, width)]
+    if not rles:
+        mask[:] = 0
+        return mask
+
+    merged = mask_utils.merge(rles, intersect=0)
+    np.multiply(mask_utils.decode(merged), 255, out=mask)
+    return mask
+
+def annotation_box_mask(ann, height, width):
+    """
+    Mask of one annotation cropped to its bounding box.
+
+    Polygons are shifted to the box origin and rasterised on a box-sized
+    canvas (pycocotools rasterises at integer-shift-invariant positions, so
+    the pixels are those of the full-frame mask); RLEs are decoded full-frame
+    and cropped.
+
+    :return: Tuple (box, mask): the (row, column) slices of the box in the
+             image and its uint8 0/1 mask, or None if the annotation is empty.
+    """
+    segm = ann["segmentation"]
+    if isinstance(segm, list):
+        polys = [np.asarray(poly, dtype=np.float64) for poly in segm if len(poly) >= 6]
+        if not polys:
+            return None
+        xs = np.concatenate([poly[0::2] for poly in polys])
+        ys = np.concatenate([poly[1::2] for poly in polys])
+        # One spare pixel on the far side; the image border clips like the full frame
+        x0, y0 = max(int(np.floor(xs.min())), 0), max(int(np.floor(ys.min())), 0)
+        x1, y1 = min(int(np.ceil(xs.max())) + 2, width), min(int(np.ceil(ys.max())) + 2, height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        shifted = []
+        for poly in polys:
+            poly = poly.copy()
+            poly[0::2] -= x0
+            poly[1::2] -= y0
+            shifted.append(poly.tolist())
+        rle = mask_utils.merge(mask_utils.frPyObjects(shifted, y1 - y0, x1 - x0), intersect=0)
+        return (slice(y0, y1), slice(x0, x1)), mask_utils.decode(rle)
+
+    rle = mask_utils.merge(annotation_rles(ann, height, width), intersect=0)
+    x, y, w, h = (int(v) for v in mask_utils.toBbox(rle))
+    if w == 0 or h == 0:
+        return None
+    box = (slice(y, y + h + 1), slice(x, x + w + 1))
+    return box, mask_utils.decode(rle)[box]
+
+def rasterize_instances(anns, height, width):
+    """
+    Instance-label mask of one image: every annotated pixel holds the label
+    (1..K, in the order of 'anns') of its annotation, 0 is background. Where
+    annotations overlap, the later one wins. The union of the labels is the
+    same pixel set as rasterize_annotations().
+
+    :param anns: List of COCO annotation dicts of one image (at most 65535).
+    :param height, width: Image size.
+    :return: Tuple (labels, label_to_ann): (H, W) uint16 array and a dict
+             {label: COCO annotation id}.
+    """
+    if len(anns) > np.iinfo(np.uint16).max:
+        raise ValueError(f"{len(anns)} annotations do not fit in a uint16 label mask")
+
+    labels = np.zeros((height, width), dtype=np.uint16)
+    label_to_ann = {}
+    for label, ann in enumerate(anns, start=1):
+        # Polygons are rasterised at bounding-box size, not full frame
+        cropped = annotation_box_mask(ann, height, width)
+        if cropped is None:
+            continue
+        box, ann_mask = cropped
+        if not ann_mask.any():
+            continue
+        labels[box][ann_mask > 0] = label
+        label_to_ann[label] = ann["id"]
+
+    return labels, label_to_ann
+
+def build_mask(coco, img_id):
+    """
+    Rasterises every annotation of one COCO image into a single binary mask.
+
+    :param coco: pycocotools COCO object.
+    :param img_id: COCO image id.
+    :return: Tuple (file_name, mask) where mask is an (H, W) uint8 array with
+             255 on annotated pixels and 0 elsewhere.
+    """
+    # Load the image metadata (file name, width, height, etc.)
+    img_info = coco.loadImgs(img_id)[0]
+    file_name = img_info["file_name"]
+    width     = img_info["width"]
+    height    = img_info["height"]
+
+    # Get all annotations for this image
+    ann_ids = coco.getAnnIds(imgIds=img_id)
+    anns = coco.loadAnns(ann_ids)
+
+    # We'll store mask pixels as 0 or 255 for visualization
+    mask = rasterize_annotations(anns, height, width)
+
+    return file_name, mask
+
+def write_mask(mask_path, mask, trace=False):
+    """
+    Writes a mask PNG.
+
+    :return: List of stage records (empty unless 'trace' is set).
+    """
+    timer = StageTimer(enabled=trace)
+    with timer.stage(os.path.basename(mask_path), "write_png"):
+        cv2.imwrite(mask_path, mask)
+    return timer.records
+
+def save_mask(anns, height, width, mask_path, trace=False):
+    """
+    Rasterises one image's annotations and writes the mask PNG.
+
+    This is a top-level function so it can be sent to a process pool.
+
+    :return: List of stage records (empty unless 'trace' is set).
+    """
+    timer = StageTimer(enabled=trace)
+    with timer.stage(os.path.basename(mask_path), "rasterize", points=len(anns)):
+        mask = rasterize_annotations(anns, height, width)
+    timer.extend(write_mask(mask_path, mask, trace))
+    return timer.records
+
+def save_instance_mask(anns, height, width, label_path, sidecar_path, trace=False):
+    """
+    Instance-mode counterpart of save_mask (also a process-pool target).
+
+    :return: List of stage records (empty unless 'trace' is set).
+    """
+    timer = StageTimer(enabled=trace)
+    with timer.stage(os.path.basename(label_path), "rasterize", points=len(anns)):
+        labels, label_to_ann = rasterize_instances(anns, height, width)
+    with timer.stage(os.path.basename(label_path), "write_png"):
+        save_labels(labels, label_to_ann, label_path, sidecar_path)
+    return timer.records
+
 def main():
     # Adjust these paths
     annotation_file = r"A:\22May\blackbox_annotation\annotation.json"  #"A:\9march\validation_data_all_annotations\annotations.json"
     images_dir      = r"A:\22May\RGB\blackbox.png"   #"A:\9march\validation_data_all_RGB"  # If needed
     mask_output_dir = r"A:\22May\mask"  #"A:\9march\masks"
 
+    parser = argparse.ArgumentParser(description="Rasterise COCO annotations into binary mask PNGs.")
+    parser.add_argument("--annotations", default=annotation_file)
+    parser.add_argument("--mask-dir", default=mask_output_dir)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes (1 = serial, with background PNG writes).")
+    parser.add_argument("--instances", action="store_true",
+                        help="Write instance-label masks (<name>_labels.png, uint16, with a "
+                             "<name>_labels.json sidecar of label -> annotation id) instead of binary ones.")
+    parser.add_argument("--trace", default=None,
+                        help="Record per-stage timings and write them here (.csv or .json).")
+    parser.add_argument("--profile", default=None, help="Write cProfile stats of the main process here.")
+    args = parser.parse_args()
+
+    # Stage records; 'points' of the rasterize stage is the number of annotations
+    timer = StageTimer(enabled=args.trace is not None)
+
     # Create a folder for the masks if it doesn't exist
-    os.makedirs(mask_output_dir, exist_ok=True)
+    os.makedirs(args.mask_dir, exist_ok=True)
 
     # Initialize COCO
-    coco = COCO(annotation_file)
+    coco = COCO(args.annotations)
+
+    # Masks are keyed on the image's own metadata and annotations, so a new
+    # annotation export only regenerates the images whose annotations changed
+    cache = ResultCache(os.path.join(args.mask_dir, ".mask_cache.json"))
 
     # Get all the image IDs
     img_ids = coco.getImgIds()
 
-    for img_id in img_ids:
-        # Load the image metadata (file name, width, height, etc.)
-        img_info = coco.loadImgs(img_id)[0]
-        file_name = img_info["file_name"]
-        width     = img_info["width"]
-        height    = img_info["height"]
+    # Serial mode rasterises in this process and hands the PNG encoding to a
+    # writer thread; with --workers each process rasterises and writes its own
+    if args.workers > 1:
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+    else:
+        executor = ThreadPoolExecutor(max_workers=2)
 
-        # You could also load the actual RGB image here if needed:
-        # image_path = os.path.join(images_dir, file_name)
-        # rgb_img    = cv2.imread(image_path)
+    # Bounded number of masks in flight, so memory does not grow with the export
+    max_pending = 2 * max(args.workers, 2)
+    pending = deque()
 
-        # Get all annotations for this image
-        ann_ids = coco.getAnnIds(imgIds=img_id)
-        anns = coco.loadAnns(ann_ids)
+    def finish(entry):
+        # Record a mask once its PNG is on disk
+        future, file_name, mask_name, key, mask_path = entry
+        timer.extend(future.result())
+        cache.store(mask_name, key, mask_path)
+        print(f"Saved mask for '{file_name}' -> {mask_path}")
 
-        # Create an empty mask (same size as the image)
-        # We'll store mask pixels as 0 or 255 for visualization
-        mask = np.zeros((height, width), dtype=np.uint8)
+    with executor, profiled(args.profile):
+        for img_id in img_ids:
+            img_info = coco.loadImgs(img_id)[0]
+            file_name = img_info["file_name"]
+            base_name = os.path.splitext(file_name)[0]
+            mask_name = base_name + "_mask.png"
+            mask_path = os.path.join(args.mask_dir, mask_name)
+            if args.instances:
+                mask_path, sidecar_path = label_paths(args.mask_dir, base_name)
+                mask_name = os.path.basename(mask_path)
 
-        # For each annotation, convert to a binary mask
-        for ann in anns:
-            ann_mask = coco.annToMask(ann)  # 0/1 array
-            mask[ann_mask == 1] = 255      # combine into a single mask
+            anns = coco.loadAnns(coco.getAnnIds(imgIds=img_id))
+            key = cache.key(params={"image": img_info, "annotations": anns})
+            outputs = [mask_path, sidecar_path] if args.instances else [mask_path]
+            if cache.lookup(mask_name, key, outputs) is not None:
+                continue
 
-        # Save the mask as a PNG
-        base_name = os.path.splitext(file_name)[0]
-        mask_name = base_name + "_mask.png"
-        mask_path = os.path.join(mask_output_dir, mask_name)
-        cv2.imwrite(mask_path, mask)
+            # You could also load the actual RGB image here if needed:
+            # image_path = os.path.join(images_dir, file_name)
+            # rgb_img    = cv2.imread(image_path)
 
-        print(f"Saved mask for '{file_name}' -> {mask_path}")
+            if args.instances:
+                # Labels are written by the pool (serial mode: by the writer thread)
+                future = executor.submit(save_instance_mask, anns, img_info["height"], img_info["width"],
+                                         mask_path, sidecar_path, timer.enabled)
+            elif args.workers > 1:
+                future = executor.submit(save_mask, anns, img_info["height"], img_info["width"],
+                                         mask_path, timer.enabled)
+            else:
+                with timer.stage(mask_name, "rasterize", points=len(anns)):
+                    mask = rasterize_annotations(anns, img_info["height"], img_info["width"])
+                future = executor.submit(write_mask, mask_path, mask, timer.enabled)
+            pending.append((future, file_name, mask_name, key, mask_path))
+
+            if len(pending) >= max_pending:
+                finish(pending.popleft())
+
+        while pending:
+            finish(pending.popleft())
+
+    cache.save()
+
+    if args.trace:
+        timer.print_summary()
+        timer.write_trace(args.trace)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,114 @@
+import cv2
+import numpy as np
+
+from backprojection import get_backprojector
+
+
+def window_for_neighbors(nb_neighbors):
+    """
+    Odd pixel-window size whose area is about 'nb_neighbors' pixels, so the
+    grid filter looks at roughly as many neighbours as the statistical one.
+    """
+    window = int(np.ceil(np.sqrt(nb_neighbors + 1)))
+    return window if window % 2 == 1 else window + 1
+
+
+def neighbor_distances(xyz, points_weight, neighbor_weight, window):
+    """
+    RMS 3D distance of every pixel to the weighted pixels of its window.
+
+    :param xyz: List of three (H, W) float64 coordinate images (X, Y, Z).
+    :param points_weight: (H, W) bool, pixels to compute a distance for.
+    :param neighbor_weight: (H, W) float64, 1 for pixels that count as neighbours.
+    :param window: Odd neighbourhood size in pixels.
+    :return: Distances of the 'points_weight' pixels (inf without neighbours).
+    """
+    def box(img):
+        return cv2.boxFilter(img, cv2.CV_64F, (window, window),
+                             normalize=False, borderType=cv2.BORDER_CONSTANT)
+
+    sq_norm = xyz[0] ** 2 + xyz[1] ** 2 + xyz[2] ** 2
+
+    count = box(neighbor_weight)
+    sum_sq_dist = count * sq_norm + box(sq_norm * neighbor_weight)
+    for axis in range(3):
+        sum_sq_dist -= 2.0 * xyz[axis] * box(xyz[axis] * neighbor_weight)
+
+    # A pixel that is its own neighbour adds nothing to the sum
+    num_neighbors = (count - neighbor_weight)[points_weight]
+    sum_sq_dist = sum_sq_dist[points_weight]
+
+    distances = np.full(num_neighbors.shape, np.inf)
+    has_neighbors = num_neighbors > 0.5
+    distances[has_neighbors] = np.sqrt(np.maximum(
+        sum_sq_dist[has_neighbors] / num_neighbors[has_neighbors], 0.0
+    ))
+    return distances
+
+
+def sor_threshold(distances, std_ratio):
+    """
+    mean + std_ratio * std of the finite distances (None if there are none).
+    """
+    finite = distances[np.isfinite(distances)]
+    if len(finite) == 0:
+        return None
+    return finite.mean() + std_ratio * finite.std()
+
+
+def grid_outlier_mask(depth_img, valid, fx, fy, cx, cy, window=19, std_ratio=0.5):
+    """
+    Statistical outlier removal on the organised depth image.
+
+    Because the cloud comes from a depth image, the neighbours of a point are
+    the valid pixels in the window x window block around it. For every valid
+    pixel the RMS 3D distance to those neighbours is computed with box
+    filters, which cost the same whatever the window size:
+
+        sum_j |p_i - p_j|^2 = n |p_i|^2 - 2 p_i . sum_j p_j + sum_j |p_j|^2
+
+    As in remove_statistical_outlier, a point is an outlier when its distance
+    is above mean + std_ratio * std over all points. A k-NN search never picks
+    far-away points as neighbours, but a pixel window does, so a first pass
+    finds the gross outliers and the second pass measures every point against
+    the remaining neighbours only.
+
+    :param depth_img: (H, W) depth image.
+    :param valid: (H, W) boolean array of the pixels that belong to the cloud
+                  (mask > 0 and Z > 0).
+    :param fx, fy, cx, cy: Camera intrinsics in pixels.
+    :param window: Odd neighbourhood size in pixels (see window_for_neighbors).
+    :param std_ratio: Standard-deviation threshold.
+    :return: (H, W) boolean array of the inlier pixels (a subset of 'valid').
+    """
+    height, width = depth_img.shape
+    projector = get_backprojector(fx, fy, cx, cy, width, height)
+
+    inliers = np.zeros_like(valid, dtype=bool)
+    if not valid.any():
+        return inliers
+
+    z = np.where(valid, depth_img, 0).astype(np.float64)
+    xyz = [projector.ray_x * z, projector.ray_y * z, z]
+
+    # Centre the coordinates first to keep the sums well conditioned
+    weight = valid.astype(np.float64)
+    for axis in range(3):
+        xyz[axis] -= xyz[axis][valid].mean()
+        xyz[axis] *= weight
+
+    # Pass 1: gross outliers, measured against all valid neighbours
+    distances = neighbor_distances(xyz, valid, weight, window)
+    threshold = sor_threshold(distances, std_ratio)
+    if threshold is None:
+        return inliers
+    weight[valid] = distances <= threshold
+
+    # Pass 2: every point against the pass-1 inliers only
+    distances = neighbor_distances(xyz, valid, weight, window)
+    threshold = sor_threshold(distances, std_ratio)
+    if threshold is None:
+        return inliers
+
+    inliers[valid] = distances <= threshold
+    return inliers
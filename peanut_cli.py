@@ -0,0 +1,51 @@
+import sys
+import argparse
+import importlib
+
+# -----------------------------------------------------------------------------
+# One entry point for the pipeline scripts:
+#
+#     python peanut_cli.py <command> [options of that script]
+#
+# Only the module of the chosen command is imported, so e.g. 'voxelize' and
+# 'depth-volume' never load Open3D, matplotlib or pycocotools. The remaining
+# arguments are handed to the script's own main().
+# -----------------------------------------------------------------------------
+COMMANDS = {
+    "masks":        ("masking_voxelize",  "Rasterise COCO annotations into mask PNGs."),
+    "clouds":       ("pointcloud",        "Build masked point clouds from depth/RGB/mask triples."),
+    "tiled":        ("tiled_cloud",       "Cloud of one very large depth map, built in row bands with bounded memory."),
+    "fuse":         ("fusion",            "Register and fuse several views of each sample into one cloud."),
+    "pipeline":     ("pipeline",          "Annotations -> masks -> clouds -> voxel counts in one pass."),
+    "voxelize":     ("peanut_voxelize",   "Voxel counts and volume per voxel of every point cloud (headless)."),
+    "calibrate":    ("voxel_calibration", "Fit / apply voxel-count -> volume calibrations (headless)."),
+    "voxels":       ("sparse_voxels",     "Build, save and compare sparse voxel sets of scans (headless)."),
+    "depth-volume": ("depth_volume",      "Volume straight from masked depth maps (headless)."),
+    "instances":    ("instance_volumes",  "Per-instance voxel counts and volumes from instance-label masks (headless)."),
+    "qa":           ("qa_render",         "Headless QA images (depth/density heatmaps) of point clouds."),
+    "benchmark":    ("benchmark",         "Benchmark the hot paths on synthetic frames."),
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    parser = argparse.ArgumentParser(
+        prog="peanut_cli.py",
+        description="Peanut volume pipeline. Run '<command> -h' for the options of a command."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for name, (_, help_text) in COMMANDS.items():
+        # Options are parsed by the command itself, so -h is passed on as well
+        subparsers.add_parser(name, help=help_text, add_help=False)
+
+    args = parser.parse_args(argv[:1])
+    module_name = COMMANDS[args.command][0]
+
+    module = importlib.import_module(module_name)
+    sys.argv = [f"{parser.prog} {args.command}"] + list(argv[1:])
+    return module.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,126 @@
 import os
-import open3d as o3d
+import argparse
+import numpy as np
 import pandas as pd
 
+from pointcloud_cache import load_point_arrays
+from result_cache import ResultCache
+from stage_timing import StageTimer, profiled
+from voxel_count import count_occupied_voxels_batch, sweep_voxel_sizes
+
+def cached_voxel_counts(ply_path, voxel_sizes, cache=None, timer=None):
+    """
+    Occupied-voxel counts of one point cloud for each voxel size.
+
+    Voxels are indexed from the cloud's min bound, exactly as in
+    VoxelGrid.create_from_point_cloud_within_bounds(pcd, voxel_size,
+    min_bound, max_bound), but without building the grid. Counts found in
+    'cache' for the same cloud contents and voxel size are reused, and the
+    cloud is only loaded if some size is missing.
+
+    :param ply_path: Path of the .ply point cloud.
+    :param voxel_sizes: List of voxel sizes.
+    :param cache: Optional ResultCache.
+    :param timer: Optional StageTimer for the 'load' and 'voxel_count' stages.
+    :return: Dict {voxel_size: num_voxels}.
+    """
+    if timer is None:
+        timer = StageTimer(enabled=False)
+    frame = os.path.basename(ply_path)
+
+    counts = {}
+    keys = {}
+    for voxel_size in voxel_sizes:
+        if cache is not None:
+            keys[voxel_size] = cache.key([ply_path], {"voxel_size": voxel_size})
+            num_voxels = cache.lookup(f"{os.path.basename(ply_path)}|{voxel_size}", keys[voxel_size])
+            if num_voxels is not None:
+                counts[voxel_size] = num_voxels
+
+    missing = [voxel_size for voxel_size in voxel_sizes if voxel_size not in counts]
+    if missing:
+        # Load the point cloud (memory-mapped from the binary cache if present)
+        with timer.stage(frame, "load") as record:
+            points, _ = load_point_arrays(ply_path)
+            record["points"] = len(points)
+        with timer.stage(frame, "voxel_count", points=len(points) * len(missing)):
+            swept = sweep_voxel_sizes(points, missing)
+        for voxel_size, num_voxels in swept.items():
+            counts[voxel_size] = num_voxels
+            if cache is not None:
+                cache.store(f"{os.path.basename(ply_path)}|{voxel_size}", keys[voxel_size], num_voxels)
+
+    return {voxel_size: counts[voxel_size] for voxel_size in voxel_sizes}
+
+def batched_voxel_counts(ply_paths, voxel_size, batch_size=64, cache=None, timer=None):
+    """
+    Occupied-voxel counts of many point clouds, 'batch_size' clouds at a
+    time: each batch is concatenated with a frame-id column and counted in
+    one sort/unique pass (see voxel_count.count_occupied_voxels_batch).
+    Same counts as cached_voxel_counts(), one cloud at a time.
+
+    :param ply_paths: Dict {image number: ply_path}.
+    :param voxel_size: Voxel size (same units as the point clouds).
+    :param batch_size: Number of clouds per batch (bounds the memory used).
+    :param cache: Optional ResultCache, shared with cached_voxel_counts().
+    :param timer: Optional StageTimer for the 'load' and 'voxel_count' stages.
+    :return: DataFrame with 'Image Number' and 'Num Voxels', one row per
+             entry of 'ply_paths' (in its order), ready to merge.
+    """
+    if timer is None:
+        timer = StageTimer(enabled=False)
+
+    counts = {}
+    keys = {}
+    missing = []
+    for image_num, ply_path in ply_paths.items():
+        if cache is not None:
+            keys[image_num] = cache.key([ply_path], {"voxel_size": voxel_size})
+            num_voxels = cache.lookup(f"{os.path.basename(ply_path)}|{voxel_size}", keys[image_num])
+            if num_voxels is not None:
+                counts[image_num] = num_voxels
+                continue
+        missing.append(image_num)
+
+    for batch_start in range(0, len(missing), batch_size):
+        batch = missing[batch_start:batch_start + batch_size]
+
+        point_arrays = []
+        for image_num in batch:
+            # Memory-mapped from the binary cache if present
+            with timer.stage(os.path.basename(ply_paths[image_num]), "load") as record:
+                points, _ = load_point_arrays(ply_paths[image_num])
+                record["points"] = len(points)
+            point_arrays.append(points)
+
+        num_points = sum(len(points) for points in point_arrays)
+        with timer.stage(f"batch {batch_start // batch_size}", "voxel_count", points=num_points):
+            batch_counts = count_occupied_voxels_batch(point_arrays, voxel_size)
+
+        for image_num, num_voxels in zip(batch, batch_counts.tolist()):
+            counts[image_num] = num_voxels
+            if cache is not None:
+                cache.store(f"{os.path.basename(ply_paths[image_num])}|{voxel_size}", keys[image_num], num_voxels)
+
+    return pd.DataFrame({
+        "Image Number": list(ply_paths),
+        "Num Voxels": [counts[image_num] for image_num in ply_paths],
+    })
+
 def voxelize_and_compute_volumes(
     pointcloud_dir,
     excel_file,
     output_csv=None,
-    voxel_size=10.0
+    voxel_size=10.0,
+    use_cache=True,
+    timer=None,
+    batch_size=64
 ):
     """
     1. Reads volume info from 'excel_file' (two columns: 'Image Number' and 'Volume (ml)').
-    2. For each row, attempts to load the corresponding .ply point cloud from 'pointcloud_dir'.
-    3. Voxelizes the point cloud at 'voxel_size' (in the same units as the point cloud).
+    2. For each row, finds the corresponding .ply point cloud in 'pointcloud_dir'.
+    3. Voxelizes the point clouds at 'voxel_size' (in the same units as the point cloud),
+       'batch_size' clouds per vectorised pass.
     4. Computes:
         - num_voxels = number of occupied voxels
         - avg_vol_per_voxel = manual_volume / num_voxels
@@ -21,80 +130,118 @@ def voxelize_and_compute_volumes(
     :param excel_file: Path to your Excel file (with columns: "Image Number", "Volume (ml)").
     :param output_csv: If provided, we will save the results as a CSV here.
     :param voxel_size: The voxel size you want to experiment with (e.g. 10.0, etc.).
+    :param use_cache: Reuse voxel counts of unchanged clouds from earlier runs
+                      (recorded in '<pointcloud_dir>/.voxel_cache.json').
+    :param timer: Optional StageTimer recording the per-cloud stages.
+    :param batch_size: Number of clouds counted together (see batched_voxel_counts).
+    :return: DataFrame with one row per Excel row that has a point cloud.
     """
     # 1) Read the Excel
     df = pd.read_excel(excel_file)
 
-    results = []
+    cache = ResultCache(os.path.join(pointcloud_dir, ".voxel_cache.json")) if use_cache else None
+
+    # 2) Find the .ply file of each image
+    # For example, if your PLY is named "1_cloud.ply" for Image Number 1
+    # Adjust if your naming differs
+    ply_paths = {}
+    for image_num in df["Image Number"]:
+        ply_path = os.path.join(pointcloud_dir, f"{image_num}_cloud.ply")
+        if not os.path.exists(ply_path):
+            print(f"[WARNING] PLY file not found for image {image_num} -> {ply_path}")
+            continue
+        ply_paths[image_num] = ply_path
+
+    # 3) Voxelize the point clouds and count how many voxels are occupied
+    counts = batched_voxel_counts(ply_paths, voxel_size, batch_size, cache, timer)
+
+    if cache is not None:
+        cache.save()
+
+    # 4) One merge with the Excel rows; empty clouds get 0 ml/voxel
+    out_df = df[["Image Number", "Volume (ml)"]].rename(columns={"Volume (ml)": "Manual Volume (ml)"})
+    out_df = out_df.merge(counts, on="Image Number", how="inner")
+    num_voxels = out_df["Num Voxels"].to_numpy()
+    out_df["Avg Volume per Voxel (ml/voxel)"] = np.divide(
+        out_df["Manual Volume (ml)"].to_numpy(dtype=np.float64), num_voxels,
+        out=np.zeros(len(out_df)), where=num_voxels > 0
+    )
+
+    for image_num, num, avg_vol_per_voxel in zip(
+        out_df["Image Number"], num_voxels, out_df["Avg Volume per Voxel (ml/voxel)"]
+    ):
+        if num == 0:
+            print(f"[WARNING] Empty point cloud for {image_num}")
+        else:
+            print(f"[INFO] Image {image_num} -> #Voxels: {num}, "
+                  f"Avg Vol/Voxel: {avg_vol_per_voxel:.3f} ml")
+
+    # 5) Optionally save to CSV
+    if output_csv:
+        out_df.to_csv(output_csv, index=False)
+        print(f"[INFO] Results saved to {output_csv}")
+    else:
+        # Or just print them
+        print("\n=== Results ===")
+        for r in out_df.to_dict("records"):
+            print(r)
+    return out_df
+
+def voxel_size_sweep(
+    pointcloud_dir,
+    excel_file,
+    voxel_sizes,
+    output_csv=None,
+    use_cache=True,
+    timer=None
+):
+    """
+    Calibration helper: like 'voxelize_and_compute_volumes', but evaluates a
+    whole list of voxel sizes while loading each point cloud only once.
 
-    # 2) Loop over each row in the Excel
+    :param pointcloud_dir: Directory containing *.ply point cloud files.
+    :param excel_file: Path to your Excel file (with columns: "Image Number", "Volume (ml)").
+    :param voxel_sizes: List of voxel sizes to evaluate (e.g. [5.0, 7.5, 10.0]).
+    :param output_csv: If provided, we will save the results as a CSV here.
+    :param use_cache: Reuse voxel counts of unchanged clouds from earlier runs.
+    :param timer: Optional StageTimer recording the per-cloud stages.
+    :return: DataFrame with one row per (image, voxel size).
+    """
+    df = pd.read_excel(excel_file)
+
+    cache = ResultCache(os.path.join(pointcloud_dir, ".voxel_cache.json")) if use_cache else None
+
+    results = []
     for idx, row in df.iterrows():
         image_num = row["Image Number"]
         manual_volume_ml = row["Volume (ml)"]
 
-        # Build the .ply file name
-        # For example, if your PLY is named "1_cloud.ply" for Image Number 1
-        # Adjust if your naming differs
-        ply_filename = f"{image_num}_cloud.ply"
-        ply_path = os.path.join(pointcloud_dir, ply_filename)
-
+        ply_path = os.path.join(pointcloud_dir, f"{image_num}_cloud.ply")
         if not os.path.exists(ply_path):
             print(f"[WARNING] PLY file not found for image {image_num} -> {ply_path}")
             continue
 
-        # Load the point cloud
-        pcd = o3d.io.read_point_cloud(ply_path)
+        counts = cached_voxel_counts(ply_path, voxel_sizes, cache, timer)
 
-        if len(pcd.points) == 0:
-            print(f"[WARNING] Empty point cloud for {image_num}")
+        for voxel_size, num_voxels in counts.items():
             results.append({
                 "Image Number": image_num,
+                "Voxel Size": voxel_size,
                 "Manual Volume (ml)": manual_volume_ml,
-                "Num Voxels": 0,
-                "Avg Volume per Voxel (ml/voxel)": 0.0
+                "Num Voxels": num_voxels,
+                "Avg Volume per Voxel (ml/voxel)": manual_volume_ml / num_voxels if num_voxels else 0.0
             })
-            continue
 
-        # 3) Voxelize the point cloud
-        # We'll create a voxel grid from min_bound to max_bound of the cloud
-        bbox_min = pcd.get_min_bound()
-        bbox_max = pcd.get_max_bound()
-        voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud_within_bounds(
-            pcd,
-            voxel_size=voxel_size,
-            min_bound=bbox_min,
-            max_bound=bbox_max
-        )
+        print(f"[INFO] Image {image_num} -> #Voxels per size: {counts}")
 
-        # 4) Count how many voxels are occupied
-        num_voxels = len(voxel_grid.get_voxels())
-
-        if num_voxels == 0:
-            avg_vol_per_voxel = 0.0
-        else:
-            avg_vol_per_voxel = manual_volume_ml / num_voxels
+    if cache is not None:
+        cache.save()
 
-        # Accumulate the results
-        results.append({
-            "Image Number": image_num,
-            "Manual Volume (ml)": manual_volume_ml,
-            "Num Voxels": num_voxels,
-            "Avg Volume per Voxel (ml/voxel)": avg_vol_per_voxel
-        })
-
-        print(f"[INFO] Image {image_num} -> #Voxels: {num_voxels}, "
-              f"Avg Vol/Voxel: {avg_vol_per_voxel:.3f} ml")
-
-    # 5) Optionally save to CSV
+    out_df = pd.DataFrame(results)
     if output_csv:
-        out_df = pd.DataFrame(results)
         out_df.to_csv(output_csv, index=False)
         print(f"[INFO] Results saved to {output_csv}")
-    else:
-        # Or just print them
-        print("\n=== Results ===")
-        for r in results:
-            print(r)
+    return out_df
 
 def main():
     # Change these paths as needed
@@ -107,12 +254,29 @@ def main():
     # If it's in meters and you want 0.01 m cubes => voxel_size=0.01, etc.
     voxel_size = 10.0
 
-    voxelize_and_compute_volumes(
-        pointcloud_dir=pointcloud_dir,
-        excel_file=excel_file,
-        output_csv=output_csv,
-        voxel_size=voxel_size
-    )
+    parser = argparse.ArgumentParser(description="Voxel counts and volume per voxel of every point cloud.")
+    parser.add_argument("--trace", default=None,
+                        help="Record per-stage timings and write them here (.csv or .json).")
+    parser.add_argument("--profile", default=None, help="Write cProfile stats here.")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="Number of point clouds counted in one vectorised pass.")
+    args = parser.parse_args()
+
+    timer = StageTimer(enabled=args.trace is not None)
+
+    with profiled(args.profile):
+        voxelize_and_compute_volumes(
+            pointcloud_dir=pointcloud_dir,
+            excel_file=excel_file,
+            output_csv=output_csv,
+            voxel_size=voxel_size,
+            timer=timer,
+            batch_size=args.batch_size
+        )
+
+    if args.trace:
+        timer.print_summary()
+        timer.write_trace(args.trace)
 
 if __name__ == "__main__":
     main()
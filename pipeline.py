@@ -0,0 +1,214 @@
+import os
+import csv
+import argparse
+
+import cv2
+from pycocotools.coco import COCO
+
+from masking_voxelize import build_mask
+from pointcloud import build_point_cloud
+from voxel_count import count_occupied_voxels
+
+# -----------------------------------------------------------------------------
+# In-memory pipeline: COCO annotations -> masks -> point clouds -> voxel counts
+#
+# Every stage is a generator that consumes the previous one, so only one frame
+# is in memory at a time and nothing has to round-trip through PNG/PLY files.
+# Writing the intermediate masks and clouds is optional.
+# -----------------------------------------------------------------------------
+
+
+def iter_masks(coco, mask_dir=None):
+    """
+    Stage 1: rasterises the COCO annotations of every image.
+
+    :param coco: pycocotools COCO object.
+    :param mask_dir: If given, also write '<base_name>_mask.png' there.
+    :return: Generator of dicts with 'base_name' and 'mask'.
+    """
+    for img_id in coco.getImgIds():
+        file_name, mask = build_mask(coco, img_id)
+        base_name = os.path.splitext(file_name)[0]
+
+        if mask_dir:
+            cv2.imwrite(os.path.join(mask_dir, base_name + "_mask.png"), mask)
+
+        yield {"base_name": base_name, "mask": mask}
+
+
+def iter_frames(masks, rgb_dir, depth_dir):
+    """
+    Stage 2: attaches the RGB and depth images to every mask.
+
+    Frames whose RGB or depth image is missing or unreadable are skipped.
+
+    :return: Generator of dicts with 'base_name', 'mask', 'rgb' and 'depth'.
+    """
+    for frame in masks:
+        base_name = frame["base_name"]
+        rgb_path   = os.path.join(rgb_dir,   base_name + ".png")
+        depth_path = os.path.join(depth_dir, base_name + ".png")
+
+        if not os.path.exists(rgb_path) or not os.path.exists(depth_path):
+            print(f"[WARNING] No matching RGB/depth found for {base_name}")
+            continue
+
+        frame["depth"] = cv2.imread(depth_path, cv2.IMREAD_ANYDEPTH)
+        frame["rgb"]   = cv2.imread(rgb_path,   cv2.IMREAD_COLOR)
+
+        if frame["depth"] is None or frame["rgb"] is None:
+            print(f"[WARNING] Failed to read one or more files for {base_name}")
+            continue
+
+        yield frame
+
+
+def iter_clouds(frames, fx, fy, cx, cy, nb_neighbors=350, std_ratio=0.5, outlier_method="statistical",
+                cloud_dir=None, binary_cache=False):
+    """
+    Stage 3: back-projection and outlier removal.
+
+    The images are dropped from the frame once the cloud is built.
+
+    :param outlier_method: "statistical" or "grid" (see pointcloud.build_point_cloud).
+    :param cloud_dir: If given, also write '<base_name>_cloud.ply' there.
+    :param binary_cache: With 'cloud_dir', also write the binary .pcc cache.
+    :return: Generator of dicts with 'base_name' and 'points' ((N, 3) float32 array).
+    """
+    for frame in frames:
+        cloud = build_point_cloud(
+            frame["depth"], frame["rgb"], frame["mask"],
+            fx, fy, cx, cy,
+            nb_neighbors=nb_neighbors,
+            std_ratio=std_ratio,
+            outlier_method=outlier_method
+        )
+
+        if cloud_dir:
+            ply_path = os.path.join(cloud_dir, frame["base_name"] + "_cloud.ply")
+            cloud.save(ply_path, binary_cache=binary_cache)
+
+        yield {"base_name": frame["base_name"], "points": cloud.points}
+
+
+def iter_volumes(clouds, voxel_size, volume_per_voxel_ml=None):
+    """
+    Stage 4: occupied-voxel counting (same grid as peanut_voxelize.py).
+
+    :param voxel_size: Voxel size, in the units of the point cloud.
+    :param volume_per_voxel_ml: Optional calibrated ml per voxel; when given,
+                                a volume estimate is added to every row.
+    :return: Generator of result rows (dicts).
+    """
+    for cloud in clouds:
+        num_voxels = count_occupied_voxels(cloud["points"], voxel_size)
+
+        row = {
+            "Image": cloud["base_name"],
+            "Num Points": len(cloud["points"]),
+            "Num Voxels": num_voxels,
+        }
+        if volume_per_voxel_ml is not None:
+            row["Volume (ml)"] = num_voxels * volume_per_voxel_ml
+
+        yield row
+
+
+def run_pipeline(
+    annotation_file,
+    rgb_dir,
+    depth_dir,
+    output_csv,
+    fx,
+    fy,
+    cx,
+    cy,
+    voxel_size=10.0,
+    nb_neighbors=350,
+    std_ratio=0.5,
+    outlier_method="statistical",
+    volume_per_voxel_ml=None,
+    mask_dir=None,
+    cloud_dir=None,
+    binary_cache=False
+):
+    """
+    Runs the full chain from the COCO annotation file plus the RGB/depth
+    folders to the volume CSV. Rows are written as soon as each frame is done.
+
+    :param mask_dir: If given, intermediate masks are written there.
+    :param cloud_dir: If given, intermediate PLYs are written there.
+    :return: Number of frames written to 'output_csv'.
+    """
+    for out in (mask_dir, cloud_dir):
+        if out:
+            os.makedirs(out, exist_ok=True)
+
+    coco = COCO(annotation_file)
+
+    masks   = iter_masks(coco, mask_dir=mask_dir)
+    frames  = iter_frames(masks, rgb_dir, depth_dir)
+    clouds  = iter_clouds(frames, fx, fy, cx, cy, nb_neighbors, std_ratio, outlier_method,
+                          cloud_dir=cloud_dir, binary_cache=binary_cache)
+    volumes = iter_volumes(clouds, voxel_size, volume_per_voxel_ml)
+
+    fieldnames = ["Image", "Num Points", "Num Voxels"]
+    if volume_per_voxel_ml is not None:
+        fieldnames.append("Volume (ml)")
+
+    num_rows = 0
+    with open(output_csv, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in volumes:
+            writer.writerow(row)
+            f.flush()
+            num_rows += 1
+            print(f"[INFO] Image {row['Image']} -> #Voxels: {row['Num Voxels']}")
+
+    print(f"[INFO] Results for {num_rows} frames saved to {output_csv}")
+    return num_rows
+
+
+def main():
+    # Change these paths as needed
+    annotation_file = r"A:\22May\blackbox_annotation\annotation.json"
+    rgb_dir         = r"A:\22May\RGB"
+    depth_dir       = r"A:\22May\depth"
+    output_csv      = r"A:\22May\voxel_results.csv"
+
+    parser = argparse.ArgumentParser(description="COCO masks -> point clouds -> voxel counts, in memory.")
+    parser.add_argument("--annotations", default=annotation_file)
+    parser.add_argument("--rgb-dir", default=rgb_dir)
+    parser.add_argument("--depth-dir", default=depth_dir)
+    parser.add_argument("--output-csv", default=output_csv)
+    parser.add_argument("--voxel-size", type=float, default=10.0)
+    parser.add_argument("--volume-per-voxel", type=float, default=None,
+                        help="Calibrated ml per voxel; adds a 'Volume (ml)' column.")
+    parser.add_argument("--outlier", choices=["statistical", "grid"], default="statistical")
+    parser.add_argument("--mask-dir", default=None, help="Also write the masks here.")
+    parser.add_argument("--cloud-dir", default=None, help="Also write the PLYs here.")
+    parser.add_argument("--cache", action="store_true",
+                        help="With --cloud-dir, also write binary .pcc caches.")
+    args = parser.parse_args()
+
+    # Camera intrinsics (same as pointcloud.py)
+    fx, fy, cx, cy = 1906.29, 1906.29, 1099.99, 619.98
+
+    run_pipeline(
+        args.annotations,
+        args.rgb_dir,
+        args.depth_dir,
+        args.output_csv,
+        fx, fy, cx, cy,
+        voxel_size=args.voxel_size,
+        outlier_method=args.outlier,
+        volume_per_voxel_ml=args.volume_per_voxel,
+        mask_dir=args.mask_dir,
+        cloud_dir=args.cloud_dir,
+        binary_cache=args.cache
+    )
+
+
+if __name__ == "__main__":
+    main()
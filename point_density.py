@@ -0,0 +1,52 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def radius_densities(query_points, reference_points, radius, workers=-1):
+    """
+    Counts, for every query point, the reference points within 'radius'
+    and converts the counts into densities (neighbours per unit volume).
+
+    All queries are answered in one batched KD-tree call that runs on
+    'workers' threads, so there is no per-point Python loop.
+
+    :param query_points: (N, 3) array of points to compute densities for.
+    :param reference_points: (M, 3) array of points to count (e.g. a
+                             voxel-downsampled copy of the cloud).
+    :param radius: Search radius (in the same units as the points).
+    :param workers: Number of threads for the queries (-1 = all cores).
+    :return: (N,) float64 array of densities.
+    """
+    query_points = np.asarray(query_points, dtype=np.float64)
+    reference_points = np.asarray(reference_points, dtype=np.float64)
+
+    volume_of_sphere = (4.0 / 3.0) * np.pi * (radius ** 3)
+
+    if len(query_points) == 0 or len(reference_points) == 0:
+        return np.zeros(len(query_points), dtype=np.float64)
+
+    tree = cKDTree(reference_points)
+    counts = tree.query_ball_point(query_points, r=radius, return_length=True, workers=workers)
+
+    return counts / volume_of_sphere
+
+
+def point_cloud_densities(pcd, radius, voxel_size=None, workers=-1):
+    """
+    Density of every point of an Open3D point cloud.
+
+    :param pcd: open3d.geometry.PointCloud to compute densities for.
+    :param radius: Search radius (in the same units as the cloud).
+    :param voxel_size: If given, neighbours are counted in a copy of the
+                       cloud downsampled with 'pcd.voxel_down_sample(voxel_size)'.
+    :param workers: Number of threads for the queries (-1 = all cores).
+    :return: (N,) float64 array of densities, one per point of 'pcd'.
+    """
+    reference = pcd.voxel_down_sample(voxel_size) if voxel_size else pcd
+
+    return radius_densities(
+        np.asarray(pcd.points),
+        np.asarray(reference.points),
+        radius,
+        workers=workers
+    )
@@ -0,0 +1,96 @@
+import numpy as np
+
+from backprojection import depth_to_points
+from pointcloud_cache import cache_path_for, load_point_arrays, write_cache, write_ply_arrays
+
+
+class PointSet:
+    """
+    A point cloud held as compact NumPy arrays: (N, 3) float32 XYZ and
+    (N, 3) uint8 RGB colors (or None). That is 15 bytes per point, against
+    48 for the float64 points and colors of an open3d.geometry.PointCloud.
+
+    Open3D objects are only built where an Open3D algorithm needs them
+    (to_open3d()); filtering, saving and voxel counting work on the arrays.
+    """
+
+    __slots__ = ("points", "colors")
+
+    def __init__(self, points, colors=None):
+        self.points = np.ascontiguousarray(points, dtype=np.float32).reshape(-1, 3)
+        self.colors = None
+        if colors is not None:
+            colors = np.asarray(colors)
+            if colors.dtype != np.uint8:
+                raise ValueError(f"Expected uint8 colors, got {colors.dtype}")
+            colors = np.ascontiguousarray(colors).reshape(-1, 3)
+            if len(colors) != len(self.points):
+                raise ValueError(f"Got {len(self.points)} points but {len(colors)} colors")
+            self.colors = colors
+
+    @classmethod
+    def from_depth(cls, depth_img, bgr_img, fx, fy, cx, cy, mask=None):
+        """
+        Back-projects the valid (Z > 0, mask > 0) pixels of a frame.
+
+        :param bgr_img: (H, W, 3) BGR image as returned by cv2.imread; the
+                        colors are stored as RGB.
+        """
+        points, colors_bgr = depth_to_points(depth_img, bgr_img, fx, fy, cx, cy, mask=mask)
+        return cls(points, colors_bgr[:, ::-1])
+
+    @classmethod
+    def from_open3d(cls, pcd):
+        """
+        Copies an open3d.geometry.PointCloud (colors in [0, 1] are rounded to uint8).
+        """
+        colors = None
+        if pcd.has_colors():
+            colors = np.clip(np.round(np.asarray(pcd.colors) * 255.0), 0, 255).astype(np.uint8)
+        return cls(np.asarray(pcd.points), colors)
+
+    @classmethod
+    def load(cls, ply_path):
+        """
+        Loads a PLY (or its fresh binary cache) without going through Open3D
+        when possible; see pointcloud_cache.load_point_arrays.
+        """
+        points, colors = load_point_arrays(ply_path)
+        return cls(points, colors)
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def nbytes(self):
+        return self.points.nbytes + (self.colors.nbytes if self.colors is not None else 0)
+
+    def select(self, index):
+        """
+        Subset of the points, by boolean mask or index array (order is kept).
+        """
+        colors = self.colors[index] if self.colors is not None else None
+        return PointSet(self.points[index], colors)
+
+    def to_open3d(self, colors=True):
+        """
+        open3d.geometry.PointCloud of the points (and colors, unless
+        colors=False, e.g. for a filter that only looks at positions).
+        """
+        import open3d as o3d
+
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(self.points)
+        if colors and self.colors is not None:
+            pcd.colors = o3d.utility.Vector3dVector(self.colors.astype(np.float32) / 255.0)
+        return pcd
+
+    def save(self, ply_path, binary_cache=False):
+        """
+        Writes the PLY (same content as o3d.io.write_point_cloud of
+        to_open3d(), with float32 coordinates) and optionally the binary
+        .pcc cache next to it.
+        """
+        write_ply_arrays(ply_path, self.points, self.colors)
+        if binary_cache:
+            write_cache(cache_path_for(ply_path), self.points, self.colors)
@@ -1,39 +1,43 @@
 import os
 import glob
-import cv2
+import time
+import argparse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
 import numpy as np
-import open3d as o3d
 
-def main():
-    # -------------------------------------------------------------------------
-    # Change these to match your actual directories
-    # -------------------------------------------------------------------------
-    rgb_dir   = r"A:\22May\RGB"          # folder with your RGB images "A:\9march\validation_data_all_RGB"
-    depth_dir = r"A:\22May\depth"        # folder with your depth images  "A:\9march\depth_images"
-    mask_dir  = r"A:\22May\mask"    # folder with masks generated in Step 1  "A:\9march\masks"
-    out_dir   = r"A:\22May\pointcloud"              # where to save the output PLY files  "A:\9march\pointclouds"
+from frame_io import BackgroundWriter, prefetched, read_frame
+from outlier_filter import grid_outlier_mask, window_for_neighbors
+from point_set import PointSet
+from pointcloud_cache import cache_path_for, write_cache, write_ply_arrays
+from qa_render import qa_path_for, render_qa
+from result_cache import ResultCache
+from stage_timing import StageTimer, profiled
+from tiled_cloud import build_tiled_cloud
+from tray_plane import cached_tray_plane, remove_tray_pixels
 
-    # Make sure output directory exists
-    os.makedirs(out_dir, exist_ok=True)
 
-    # -------------------------------------------------------------------------
-    # Camera intrinsics for the Left Camera (ignore distortion and depth scale)
-    #     fx = 1912.58
-    #     fy = 1912.58
-    #     cx = 1106.29
-    #     cy =  605.90
-    # -------------------------------------------------------------------------
-    fx = 1906.29        # fx: 1906.29, fy: 1906.29, cx: 1099.99, cy: 619.98
-    fy = 1906.29
-    cx = 1099.99
-    cy =  619.98
+def find_frames(rgb_dir, depth_dir, mask_dir, warn=True):
+    """
+    Pairs every depth image in 'depth_dir' with its RGB image and mask.
+
+    Frames without a matching RGB image or mask are reported and skipped.
 
+    :param rgb_dir: Folder with the RGB images (<name>.png).
+    :param depth_dir: Folder with the depth images (<name>.png).
+    :param mask_dir: Folder with the masks generated in Step 1 (<name>_mask.png).
+    :param warn: Report the incomplete frames (off while watching, where the
+                 missing files are usually still on their way).
+    :return: Sorted list of (base_name, depth_path, rgb_path, mask_path) tuples.
+    """
     # -------------------------------------------------------------------------
     # Gather depth files. We assume .png extension for depth images.
     # Adjust extension if necessary.
     # -------------------------------------------------------------------------
     depth_files = sorted(glob.glob(os.path.join(depth_dir, "*.png")))
 
+    frames = []
     for depth_path in depth_files:
         base_name = os.path.splitext(os.path.basename(depth_path))[0]
 
@@ -43,86 +47,758 @@ def main():
 
         # Validate that the files exist
         if not os.path.exists(rgb_path):
-            print(f"[WARNING] No matching RGB found for {depth_path}")
+            if warn:
+                print(f"[WARNING] No matching RGB found for {depth_path}")
             continue
         if not os.path.exists(mask_path):
-            print(f"[WARNING] No matching mask found for {depth_path}")
+            if warn:
+                print(f"[WARNING] No matching mask found for {depth_path}")
             continue
 
-        # ---------------------------------------------------------------------
-        # Load images
-        # ---------------------------------------------------------------------
-        depth_img = cv2.imread(depth_path, cv2.IMREAD_ANYDEPTH)
-        rgb_img   = cv2.imread(rgb_path,  cv2.IMREAD_COLOR)      # shape: (H, W, 3)
-        mask_img  = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)  # shape: (H, W)
+        frames.append((base_name, depth_path, rgb_path, mask_path))
+
+    return frames
 
-        if depth_img is None or rgb_img is None or mask_img is None:
-            print(f"[WARNING] Failed to read one or more files for {base_name}")
-            continue
 
-        # ---------------------------------------------------------------------
-        # Build the 3D point cloud (masked)
-        # ---------------------------------------------------------------------
-        mask_bool = (mask_img > 0)
-        height, width = depth_img.shape
-        u_coords, v_coords = np.meshgrid(np.arange(width), np.arange(height))
-
-        # Keep only masked pixels
-        u_coords = u_coords[mask_bool]
-        v_coords = v_coords[mask_bool]
-
-        z_values = depth_img[mask_bool].astype(np.float32)
-
-        # Convert color BGR -> RGB if desired
-        colors_bgr = rgb_img[mask_bool]        # shape: (N, 3)
-        colors_rgb = colors_bgr[:, ::-1]       # reverse B <-> R
-
-        # Pinhole projection -> 3D
-        x_values = (u_coords - cx) * z_values / fx
-        y_values = (v_coords - cy) * z_values / fy
-
-        xyz_points = np.column_stack((x_values, y_values, z_values))
-
-        # Create Open3D point cloud
-        pcd = o3d.geometry.PointCloud()
-        pcd.points = o3d.utility.Vector3dVector(xyz_points)
-        pcd.colors = o3d.utility.Vector3dVector(colors_rgb.astype(np.float32) / 255.0)
-
-        # ---------------------------------------------------------------------
-        # (Optional) Noise/Outlier Removal
-        # ---------------------------------------------------------------------
-        # Using Statistical Outlier Removal with default parameters:
-        #  - nb_neighbors: how many neighbors are considered in analyzing each point
-        #  - std_ratio: the threshold based on standard deviation of average distances
-        # The function returns two outputs:
-        #   pcd_clean, inlier_indices = pcd.remove_statistical_outlier(nb_neighbors, std_ratio)
-        # By default, pcd_clean is the subset of points that are inliers
-        # (i.e., not outliers).
-        # ---------------------------------------------------------------------
-        nb_neighbors = 350
-        std_ratio    = 0.5
-        pcd_clean, inlier_indices = pcd.remove_statistical_outlier(
+def build_point_cloud(
+    depth_img,
+    rgb_img,
+    mask_img,
+    fx,
+    fy,
+    cx,
+    cy,
+    nb_neighbors=350,
+    std_ratio=0.5,
+    outlier_method="statistical",
+    timer=None,
+    frame=None,
+    tray_plane=None,
+    plane_tolerance=2.0
+):
+    """
+    Back-projects the masked pixels of one frame and removes outliers.
+
+    :param depth_img: (H, W) depth image.
+    :param rgb_img: (H, W, 3) BGR image as returned by cv2.imread.
+    :param mask_img: (H, W) mask; pixels where it is 0 are dropped.
+    :param fx, fy, cx, cy: Camera intrinsics in pixels.
+    :param nb_neighbors: Neighbours used by the statistical outlier removal.
+    :param std_ratio: Standard-deviation threshold of the outlier removal.
+    :param outlier_method: "statistical" for Open3D's remove_statistical_outlier
+                           (k-NN), or "grid" for the much faster pixel-window
+                           filter of outlier_filter.py.
+    :param timer: Optional StageTimer; the back-projection and outlier removal
+                  are recorded under 'frame'.
+    :param tray_plane: Optional (a, b, c) tray plane (see tray_plane.py); masked
+                       pixels within 'plane_tolerance' of it are dropped first,
+                       so they neither leak into the cloud nor reach the filters.
+    :param plane_tolerance: Tray distance tolerance (depth units).
+    :return: The cleaned PointSet (float32 XYZ, uint8 RGB).
+    """
+    if timer is None:
+        timer = StageTimer(enabled=False)
+
+    if tray_plane is not None:
+        with timer.stage(frame, "tray_removal") as record:
+            mask_img = remove_tray_pixels(depth_img, mask_img, tray_plane, plane_tolerance, fx, fy, cx, cy)
+            record["points"] = int(np.count_nonzero(mask_img))
+
+    if outlier_method == "grid":
+        # Neighbours are adjacent pixels of the organised depth image, so the
+        # outliers are found on the image before any point is built
+        with timer.stage(frame, "outlier_removal") as record:
+            valid = (mask_img > 0) & (depth_img > 0)
+            inliers = grid_outlier_mask(
+                depth_img, valid, fx, fy, cx, cy,
+                window=window_for_neighbors(nb_neighbors),
+                std_ratio=std_ratio
+            )
+            record["points"] = int(np.count_nonzero(valid))
+
+        with timer.stage(frame, "backprojection") as record:
+            cloud = PointSet.from_depth(depth_img, rgb_img, fx, fy, cx, cy, mask=inliers)
+            record["points"] = len(cloud)
+        return cloud
+    if outlier_method != "statistical":
+        raise ValueError(f"Unknown outlier_method: {outlier_method!r}")
+
+    # ---------------------------------------------------------------------
+    # Build the 3D point cloud (masked)
+    # ---------------------------------------------------------------------
+    # Pixels outside the mask or without a valid depth (Z == 0) are dropped;
+    # the normalized pixel rays are cached per camera setup
+    # (colors are converted BGR -> RGB and kept as uint8)
+    with timer.stage(frame, "backprojection") as record:
+        cloud = PointSet.from_depth(depth_img, rgb_img, fx, fy, cx, cy, mask=mask_img)
+        record["points"] = len(cloud)
+
+    # ---------------------------------------------------------------------
+    # (Optional) Noise/Outlier Removal
+    # ---------------------------------------------------------------------
+    # Using Statistical Outlier Removal with default parameters:
+    #  - nb_neighbors: how many neighbors are considered in analyzing each point
+    #  - std_ratio: the threshold based on standard deviation of average distances
+    # The function returns two outputs:
+    #   pcd_clean, inlier_indices = pcd.remove_statistical_outlier(nb_neighbors, std_ratio)
+    # Only the positions matter, so Open3D gets the points alone and the
+    # inlier indices select the clean subset of the (float32/uint8) arrays.
+    # ---------------------------------------------------------------------
+    with timer.stage(frame, "outlier_removal", points=len(cloud)):
+        _, inlier_indices = cloud.to_open3d(colors=False).remove_statistical_outlier(
             nb_neighbors=nb_neighbors,
             std_ratio=std_ratio
         )
+        cloud_clean = cloud.select(np.asarray(inlier_indices, dtype=np.int64))
+
+    # If you prefer radius-based outlier removal, you could do:
+    # pcd_clean, inlier_indices = pcd.remove_radius_outlier(
+    #     nb_points=16,   # minimum number of neighbors in radius
+    #     radius=0.05     # distance threshold
+    # )
+
+    # We’ll use the clean point cloud going forward
+    return cloud_clean
+
+
+def process_frame(
+    base_name,
+    depth_path,
+    rgb_path,
+    mask_path,
+    out_dir,
+    fx,
+    fy,
+    cx,
+    cy,
+    nb_neighbors=350,
+    std_ratio=0.5,
+    outlier_method="statistical",
+    binary_cache=False,
+    trace=False,
+    qa_dir=None,
+    band_rows=0,
+    tray_plane=None,
+    plane_tolerance=2.0
+):
+    """
+    Builds the masked, cleaned point cloud for one depth/RGB/mask triple
+    and writes it to '<out_dir>/<base_name>_cloud.ply'.
+
+    This is a top-level function so it can be sent to a process pool.
+
+    :param base_name: Frame name shared by the three input files.
+    :param out_dir: Where to save the output PLY file.
+    :param fx, fy, cx, cy: Camera intrinsics in pixels.
+    :param nb_neighbors: Neighbours used by the statistical outlier removal.
+    :param std_ratio: Standard-deviation threshold of the outlier removal.
+    :param outlier_method: "statistical" or "grid" (see build_point_cloud).
+    :param binary_cache: Also write the binary cache (see pointcloud_cache.py)
+                         next to the PLY, for fast loading downstream.
+    :param trace: Record per-stage timings (see stage_timing.py).
+    :param qa_dir: If given, also write a QA image of the cloud here
+                   (see qa_render.py).
+    :param band_rows: If > 0, build the cloud in bands of this many rows with
+                      bounded memory (see tiled_cloud.py); uses the grid
+                      outlier filter and writes only the PLY.
+    :param tray_plane, plane_tolerance: Tray plane removal (see build_point_cloud).
+    :return: Dict with 'base_name', 'ply_path' (None if the frame failed),
+             'num_points', 'seconds' and 'stages' (the stage records, empty
+             unless 'trace' is set).
+    """
+    start = time.perf_counter()
+
+    # ---------------------------------------------------------------------
+    # Load images
+    # ---------------------------------------------------------------------
+    images, stages = load_frame((base_name, depth_path, rgb_path, mask_path), trace)
+
+    if band_rows > 0:
+        result = write_tiled_frame(base_name, images, out_dir, fx, fy, cx, cy, band_rows,
+                                   nb_neighbors=nb_neighbors, std_ratio=std_ratio,
+                                   trace=trace, stages=stages,
+                                   tray_plane=tray_plane, plane_tolerance=plane_tolerance)
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    result, cloud = clean_frame(
+        base_name, images, fx, fy, cx, cy,
+        nb_neighbors=nb_neighbors,
+        std_ratio=std_ratio,
+        outlier_method=outlier_method,
+        trace=trace,
+        stages=stages,
+        tray_plane=tray_plane,
+        plane_tolerance=plane_tolerance
+    )
+    if cloud is None:
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    write_frame(result, cloud, out_dir, binary_cache=binary_cache, trace=trace, qa_dir=qa_dir)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def write_tiled_frame(base_name, images, out_dir, fx, fy, cx, cy, band_rows,
+                      nb_neighbors=350, std_ratio=0.5, trace=False, stages=None,
+                      tray_plane=None, plane_tolerance=2.0):
+    """
+    Banded counterpart of clean_frame + write_frame: streams the cloud of
+    the decoded images into '<out_dir>/<base_name>_cloud.ply' band by band.
+
+    :return: Result dict as in process_frame (without 'seconds').
+    """
+    timer = StageTimer(enabled=trace)
+    timer.extend(stages)
+    result = {"base_name": base_name, "ply_path": None, "num_points": 0, "seconds": 0.0,
+              "stages": timer.records}
+
+    depth_img, rgb_img, mask_img = images
+    if depth_img is None or rgb_img is None or mask_img is None:
+        print(f"[WARNING] Failed to read one or more files for {base_name}")
+        return result
+
+    # Tray removal is done band by band, so memory stays bounded
+    ply_output_path = os.path.join(out_dir, base_name + "_cloud.ply")
+    tiled = build_tiled_cloud(
+        depth_img, rgb_img, mask_img, ply_output_path,
+        fx, fy, cx, cy,
+        band_rows=band_rows,
+        nb_neighbors=nb_neighbors,
+        std_ratio=std_ratio,
+        tray_plane=tray_plane,
+        plane_tolerance=plane_tolerance,
+        timer=timer,
+        frame=base_name
+    )
+    result["num_points"] = tiled["num_points"]
+    result["ply_path"] = ply_output_path
+    return result
+
+
+def load_frame(frame, trace=False):
+    """
+    Reads the images of one (base_name, depth_path, rgb_path, mask_path)
+    frame (the prefetch target).
+
+    :return: Tuple (images, stage records); see frame_io.read_frame.
+    """
+    timer = StageTimer(enabled=trace)
+    with timer.stage(frame[0], "read"):
+        images = read_frame(*frame[1:])
+    return images, timer.records
+
+
+def clean_frame(
+    base_name,
+    images,
+    fx,
+    fy,
+    cx,
+    cy,
+    nb_neighbors=350,
+    std_ratio=0.5,
+    outlier_method="statistical",
+    trace=False,
+    stages=None,
+    tray_plane=None,
+    plane_tolerance=2.0
+):
+    """
+    Compute part of 'process_frame': builds the cleaned cloud from the
+    decoded images, without touching the disk.
+
+    :param images: Tuple (depth, rgb, mask) from frame_io.read_frame.
+    :param stages: Stage records collected so far (e.g. of the read).
+    :return: Tuple (result dict as in process_frame, without 'ply_path';
+             cleaned PointSet, or None if an image could not be read).
+    """
+    timer = StageTimer(enabled=trace)
+    timer.extend(stages)
+    result = {"base_name": base_name, "ply_path": None, "num_points": 0, "seconds": 0.0,
+              "stages": timer.records}
+
+    depth_img, rgb_img, mask_img = images
+    if depth_img is None or rgb_img is None or mask_img is None:
+        print(f"[WARNING] Failed to read one or more files for {base_name}")
+        return result, None
+
+    cloud = build_point_cloud(
+        depth_img, rgb_img, mask_img,
+        fx, fy, cx, cy,
+        nb_neighbors=nb_neighbors,
+        std_ratio=std_ratio,
+        outlier_method=outlier_method,
+        timer=timer,
+        frame=base_name,
+        tray_plane=tray_plane,
+        plane_tolerance=plane_tolerance
+    )
+    result["num_points"] = len(cloud)
+    return result, cloud
+
+
+def write_frame(result, cloud, out_dir, binary_cache=False, trace=False, qa_dir=None):
+    """
+    Write part of 'process_frame': saves '<out_dir>/<base_name>_cloud.ply'
+    (and the binary cache and QA image) and fills in result['ply_path'].
+
+    :return: The updated result dict.
+    """
+    base_name = result["base_name"]
+    timer = StageTimer(enabled=trace)
+
+    ply_output_path = os.path.join(out_dir, base_name + "_cloud.ply")
+    with timer.stage(base_name, "write_ply", points=len(cloud)):
+        write_ply_arrays(ply_output_path, cloud.points, cloud.colors)
+
+    if binary_cache:
+        with timer.stage(base_name, "write_cache", points=len(cloud)):
+            write_cache(cache_path_for(ply_output_path), cloud.points, cloud.colors)
+
+    if qa_dir is not None:
+        with timer.stage(base_name, "render_qa", points=len(cloud)):
+            render_qa(cloud.points, cloud.colors, qa_path_for(qa_dir, ply_output_path),
+                      title=base_name + "_cloud")
+
+    result["stages"].extend(timer.records)
+    result["ply_path"] = ply_output_path
+    return result
+
+
+def run_overlapped(frames, out_dir, fx, fy, cx, cy, on_result, ahead=4, trace=False,
+                   binary_cache=False, qa_dir=None, **clean_kwargs):
+    """
+    Serial 'process_frame' over 'frames' with overlapped I/O: the next 'ahead'
+    frames are decoded on reader threads and the PLYs are written on a writer
+    thread while the current frame is cleaned. Writes the same files as
+    'process_frame'.
 
-        # If you prefer radius-based outlier removal, you could do:
-        # pcd_clean, inlier_indices = pcd.remove_radius_outlier(
-        #     nb_points=16,   # minimum number of neighbors in radius
-        #     radius=0.05     # distance threshold
-        # )
+    :param on_result: Called in this thread with every result dict, in frame
+                      order, once the frame's files are on disk.
+    :param ahead: Number of frames decoded ahead (and writes queued behind).
+    :param clean_kwargs: Keyword arguments forwarded to 'clean_frame'.
+    """
+    pending = deque()
 
-        # We’ll use the clean point cloud going forward
-        pcd = pcd_clean
+    def drain(block):
+        while pending and (block or pending[0].done()):
+            on_result(pending.popleft().result())
 
-        # ---------------------------------------------------------------------
-        # Write to disk
-        # ---------------------------------------------------------------------
-        ply_output_path = os.path.join(out_dir, base_name + "_cloud.ply")
-        o3d.io.write_point_cloud(ply_output_path, pcd)
-        print(f"[INFO] Saved cleaned point cloud: {ply_output_path}")
+    def write_and_time(result, cloud, start):
+        write_frame(result, cloud, out_dir, binary_cache=binary_cache, trace=trace, qa_dir=qa_dir)
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    with BackgroundWriter(max_pending=ahead) as writer:
+        for frame, (images, stages) in prefetched(frames, lambda f: load_frame(f, trace), ahead):
+            start = time.perf_counter()
+            result, cloud = clean_frame(frame[0], images, fx, fy, cx, cy,
+                                        trace=trace, stages=stages, **clean_kwargs)
+            if cloud is None:
+                drain(block=True)
+                on_result(result)
+                continue
+            pending.append(writer.submit(write_and_time, result, cloud, start))
+            drain(block=False)
+        drain(block=True)
+
+
+def frame_outputs(out_dir, base_name, binary_cache=False, qa_dir=None, **frame_kwargs):
+    """
+    Files 'process_frame' writes for one frame.
+    """
+    ply_path = os.path.join(out_dir, base_name + "_cloud.ply")
+    outputs = [ply_path]
+    if binary_cache:
+        outputs.append(cache_path_for(ply_path))
+    if qa_dir is not None:
+        outputs.append(qa_path_for(qa_dir, ply_path))
+    return outputs
+
+
+def run_batch(frames, out_dir, fx, fy, cx, cy, workers=1, cache=None, timer=None, prefetch=0,
+              **frame_kwargs):
+    """
+    Runs 'process_frame' over every frame, either serially (workers=1) or
+    on a process pool with 'workers' processes. PLYs are written by the
+    workers as soon as each frame finishes, so output streams into
+    'out_dir' in completion order; the file contents do not depend on
+    the number of workers.
+
+    :param frames: List of (base_name, depth_path, rgb_path, mask_path) tuples.
+    :param workers: Number of worker processes.
+    :param cache: Optional ResultCache. Frames whose input files and parameters
+                  are unchanged since the cloud was written are skipped.
+    :param timer: Optional StageTimer; the stage records of every frame,
+                  including those run by pool workers, are added to it.
+    :param prefetch: With workers=1, decode this many frames ahead and write
+                     behind on threads (see run_overlapped); 0 runs every
+                     frame start to finish.
+    :param frame_kwargs: Extra keyword arguments forwarded to 'process_frame'.
+    :return: List of per-frame result dicts, in completion order (frames
+             reused from the cache are not included).
+    """
+    results = []
+    batch_start = time.perf_counter()
+
+    # Frames whose inputs and parameters match the cache are already done
+    keys = {}
+    todo = []
+    for frame in frames:
+        base_name = frame[0]
+        if cache is not None:
+            params = dict(frame_kwargs, fx=fx, fy=fy, cx=cx, cy=cy)
+            keys[base_name] = cache.key(frame[1:], params)
+            outputs = frame_outputs(out_dir, base_name, **frame_kwargs)
+            if cache.lookup(base_name, keys[base_name], outputs) is not None:
+                continue
+        todo.append(frame)
+
+    if len(todo) < len(frames):
+        print(f"[INFO] Reusing {len(frames) - len(todo)} cached point clouds")
+
+    # Tracing does not change the outputs, so it is not part of the cache key
+    trace = timer is not None and timer.enabled
+
+    def report(result):
+        results.append(result)
+        if timer is not None:
+            timer.extend(result["stages"])
+        if result["ply_path"] is not None:
+            print(f"[INFO] Saved cleaned point cloud: {result['ply_path']} "
+                  f"({result['num_points']} points, {result['seconds']:.2f} s) "
+                  f"[{len(results)}/{len(todo)}]")
+            if cache is not None:
+                cache.store(result["base_name"], keys[result["base_name"]], result["ply_path"])
+
+    try:
+        if workers <= 1 and prefetch > 0 and not frame_kwargs.get("band_rows"):
+            run_overlapped(todo, out_dir, fx, fy, cx, cy, report,
+                           ahead=prefetch, trace=trace, **frame_kwargs)
+        elif workers <= 1:
+            for frame in todo:
+                report(process_frame(*frame, out_dir, fx, fy, cx, cy, trace=trace, **frame_kwargs))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(process_frame, *frame, out_dir, fx, fy, cx, cy, trace=trace, **frame_kwargs)
+                    for frame in todo
+                ]
+                for future in as_completed(futures):
+                    report(future.result())
+    finally:
+        # Keep whatever finished, even if the batch was interrupted
+        if cache is not None:
+            cache.save()
+
+    elapsed = time.perf_counter() - batch_start
+    print(f"[INFO] Processed {len(results)} frames in {elapsed:.2f} s "
+          f"with {workers} worker(s)")
+    return results
+
+
+def watch_folders(
+    rgb_dir,
+    depth_dir,
+    mask_dir,
+    out_dir,
+    fx,
+    fy,
+    cx,
+    cy,
+    workers=1,
+    cache=None,
+    timer=None,
+    poll_interval=1.0,
+    settle_seconds=1.0,
+    max_idle=None,
+    tray_fit=None,
+    **frame_kwargs
+):
+    """
+    Service mode: polls the three input folders and processes every frame as
+    soon as its depth image, RGB image and mask all exist and have stopped
+    changing (same size and mtime on two consecutive polls, and untouched
+    for 'settle_seconds'), so half-written files are never read.
+
+    Finished frames are recorded in 'cache' and the manifest is saved after
+    every frame, so it doubles as the ledger: after a restart the frames
+    already done are skipped and watching resumes with the new ones. A frame
+    that fails (unreadable, or raises) is reported and retried once its
+    files change; the service keeps running.
+
+    :param workers: Number of worker processes (1 = process in this process).
+    :param cache: Optional ResultCache used as the processed-frame ledger.
+    :param timer: Optional StageTimer (see run_batch).
+    :param poll_interval: Seconds between two scans of the folders.
+    :param settle_seconds: Minimum age of the newest input file of a frame.
+    :param max_idle: Stop after this many seconds without new or running
+                     frames (None = run until interrupted with Ctrl+C).
+    :param tray_fit: Keyword arguments of tray_plane.cached_tray_plane()
+                     (cache_path, setup, refit, fit settings). The tray plane
+                     is then read from the cache or fitted on the first
+                     settled frame (the folders are usually empty when the
+                     service starts) and passed on as 'tray_plane'.
+    :param frame_kwargs: Extra keyword arguments forwarded to 'process_frame'.
+    :return: List of per-frame result dicts, in completion order.
+    """
+    results = []
+    params = dict(frame_kwargs, fx=fx, fy=fy, cx=cx, cy=cy)
+    trace = timer is not None and timer.enabled
+
+    done = set()      # frames handled in this session (or found in the ledger)
+    last_seen = {}    # base_name -> input file signature at the previous poll
+    submitted = {}    # base_name -> signature it was processed with
+    failed = {}       # base_name -> signature that failed; retried once it changes
+    running = {}      # future -> (frame, key)
+
+    def finish(frame, key, result):
+        results.append(result)
+        if timer is not None:
+            timer.extend(result["stages"])
+        if result["ply_path"] is None:
+            done.discard(frame[0])
+            failed[frame[0]] = submitted[frame[0]]
+            return
+        print(f"[INFO] Saved cleaned point cloud: {result['ply_path']} "
+              f"({result['num_points']} points, {result['seconds']:.2f} s)")
+        if cache is not None:
+            cache.store(frame[0], key, result["ply_path"])
+            cache.save()
+
+    def collect(frame, key, get_result):
+        # A frame that raises (e.g. a mask of another resolution) must not stop the service
+        try:
+            result = get_result()
+        except Exception as error:
+            print(f"[WARNING] Failed to process {frame[0]}: {error!r}; retrying once its files change")
+            done.discard(frame[0])
+            failed[frame[0]] = submitted[frame[0]]
+            return
+        finish(frame, key, result)
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    idle_since = time.monotonic()
+    print(f"[INFO] Watching {depth_dir} (Ctrl+C to stop)")
+
+    try:
+        while True:
+            now = time.time()
+            for frame in find_frames(rgb_dir, depth_dir, mask_dir, warn=False):
+                base_name = frame[0]
+                if base_name in done:
+                    continue
+                try:
+                    stats = [os.stat(path) for path in frame[1:]]
+                except FileNotFoundError:
+                    continue
+
+                signature = tuple((st.st_size, st.st_mtime_ns) for st in stats)
+                previous = last_seen.get(base_name)
+                last_seen[base_name] = signature
+                if signature == failed.get(base_name):
+                    continue
+                # Still being written (or just appeared): wait for the next poll
+                if signature != previous or now - max(st.st_mtime for st in stats) < settle_seconds:
+                    continue
+
+                done.add(base_name)
+                submitted[base_name] = signature
+                idle_since = time.monotonic()
+
+                if tray_fit is not None and frame_kwargs.get("tray_plane") is None:
+                    try:
+                        tray_plane = cached_tray_plane(frames=[frame], fx=fx, fy=fy, cx=cx, cy=cy, **tray_fit)
+                    except ValueError as error:
+                        print(f"[WARNING] Cannot fit the tray plane on {base_name}: {error}; "
+                              f"retrying once its files change")
+                        done.discard(base_name)
+                        failed[base_name] = signature
+                        continue
+                    frame_kwargs["tray_plane"] = tray_plane.tolist()
+                    params = dict(frame_kwargs, fx=fx, fy=fy, cx=cx, cy=cy)
+
+                key = None
+                if cache is not None:
+                    key = cache.key(frame[1:], params)
+                    outputs = frame_outputs(out_dir, base_name, **frame_kwargs)
+                    if cache.lookup(base_name, key, outputs) is not None:
+                        continue
+
+                if executor is None:
+                    collect(frame, key, lambda: process_frame(*frame, out_dir, fx, fy, cx, cy,
+                                                              trace=trace, **frame_kwargs))
+                else:
+                    future = executor.submit(process_frame, *frame, out_dir, fx, fy, cx, cy,
+                                             trace=trace, **frame_kwargs)
+                    running[future] = (frame, key)
+
+            # Wait for the next poll, but pick up finished frames right away
+            if running:
+                finished, _ = wait(list(running), timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    collect(*running.pop(future), future.result)
+                idle_since = time.monotonic()
+            else:
+                if max_idle is not None and time.monotonic() - idle_since >= max_idle:
+                    break
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("[INFO] Stopping; waiting for the frames in progress")
+    finally:
+        if executor is not None:
+            for future in as_completed(list(running)):
+                collect(*running.pop(future), future.result)
+            executor.shutdown()
+        if cache is not None:
+            cache.save()
+
+    print(f"[INFO] Processed {len(results)} frames while watching")
+    return results
+
+
+def main():
+    # -------------------------------------------------------------------------
+    # Change these to match your actual directories
+    # -------------------------------------------------------------------------
+    rgb_dir   = r"A:\22May\RGB"          # folder with your RGB images "A:\9march\validation_data_all_RGB"
+    depth_dir = r"A:\22May\depth"        # folder with your depth images  "A:\9march\depth_images"
+    mask_dir  = r"A:\22May\mask"    # folder with masks generated in Step 1  "A:\9march\masks"
+    out_dir   = r"A:\22May\pointcloud"              # where to save the output PLY files  "A:\9march\pointclouds"
+
+    parser = argparse.ArgumentParser(description="Build masked point clouds from depth/RGB/mask triples.")
+    parser.add_argument("--rgb-dir", default=rgb_dir)
+    parser.add_argument("--depth-dir", default=depth_dir)
+    parser.add_argument("--mask-dir", default=mask_dir)
+    parser.add_argument("--out-dir", default=out_dir)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes (1 = serial).")
+    parser.add_argument("--cache", action="store_true",
+                        help="Also write a binary .pcc cache next to every PLY.")
+    parser.add_argument("--outlier", choices=["statistical", "grid"], default="statistical",
+                        help="Outlier filter: Open3D k-NN statistical (default) or the fast pixel-grid one.")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild every cloud, even if its inputs are unchanged.")
+    parser.add_argument("--trace", default=None,
+                        help="Record per-stage timings and write them here (.csv or .json).")
+    parser.add_argument("--profile", default=None,
+                        help="Write cProfile stats of the main process here (use --workers 1 to see every stage).")
+    parser.add_argument("--prefetch", type=int, default=4,
+                        help="With --workers 1, decode this many frames ahead and write behind on "
+                             "threads (0 = strictly sequential).")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and process new frames as they arrive in the input folders.")
+    parser.add_argument("--poll-interval", type=float, default=1.0,
+                        help="Seconds between two scans of the input folders (--watch).")
+    parser.add_argument("--settle-seconds", type=float, default=1.0,
+                        help="Only read files untouched for this long (--watch).")
+    parser.add_argument("--qa-dir", default=None,
+                        help="Also write a headless QA image (<name>_cloud_qa.png) of every cloud here.")
+    parser.add_argument("--band-rows", type=int, default=0,
+                        help="Build every cloud in bands of this many rows with bounded memory, for very "
+                             "large (stitched) depth maps; implies --outlier grid (0 = whole frames).")
+    parser.add_argument("--tray-plane", action="store_true",
+                        help="Drop masked pixels on the tray plane before filtering; the plane is fitted "
+                             "once per camera setup (RANSAC; with --watch, on the first settled frame) and cached "
+                             "in <out-dir>/.tray_plane.json.")
+    parser.add_argument("--tray-tolerance", type=float, default=2.0,
+                        help="Distance to the tray plane (depth units) below which a pixel is tray.")
+    parser.add_argument("--setup", default=None,
+                        help="Name of the camera setup; each setup gets its own cached tray plane.")
+    parser.add_argument("--refit-tray", action="store_true", help="Fit the tray plane again.")
+    args = parser.parse_args()
+
+    if args.band_rows > 0 and (args.cache or args.qa_dir):
+        parser.error("--band-rows writes only the PLY; it cannot be combined with --cache or --qa-dir")
+
+    # Make sure output directory exists
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    # -------------------------------------------------------------------------
+    # Camera intrinsics for the Left Camera (ignore distortion and depth scale)
+    #     fx = 1912.58
+    #     fy = 1912.58
+    #     cx = 1106.29
+    #     cy =  605.90
+    # -------------------------------------------------------------------------
+    fx = 1906.29        # fx: 1906.29, fy: 1906.29, cx: 1099.99, cy: 619.98
+    fy = 1906.29
+    cx = 1099.99
+    cy =  619.98
+
+    # Content-hashed record of the clouds already in out_dir
+    cache = ResultCache(os.path.join(args.out_dir, ".cloud_cache.json"))
+    if args.force:
+        cache.entries.clear()
+
+    timer = StageTimer(enabled=args.trace is not None)
+
+    frame_kwargs = dict(
+        nb_neighbors=350,
+        std_ratio=0.5,
+        outlier_method=args.outlier,
+        binary_cache=args.cache
+    )
+    if args.band_rows > 0:
+        # Only passed when set, like qa_dir below
+        frame_kwargs.update(outlier_method="grid", band_rows=args.band_rows)
+    tray_fit = None
+    if args.tray_plane:
+        tray_fit = dict(
+            cache_path=os.path.join(args.out_dir, ".tray_plane.json"),
+            setup=args.setup,
+            refit=args.refit_tray,
+            tolerance=args.tray_tolerance
+        )
+        frame_kwargs["plane_tolerance"] = args.tray_tolerance
+    if tray_fit is not None and not args.watch:
+        # The watcher fits it on the first settled frame instead
+        tray_plane = cached_tray_plane(
+            frames=find_frames(args.rgb_dir, args.depth_dir, args.mask_dir, warn=False),
+            fx=fx, fy=fy, cx=cx, cy=cy,
+            **tray_fit
+        )
+        frame_kwargs["tray_plane"] = tray_plane.tolist()
+    if args.qa_dir is not None:
+        # Only passed when set, so the cache keys of runs without QA images do not change
+        os.makedirs(args.qa_dir, exist_ok=True)
+        frame_kwargs["qa_dir"] = args.qa_dir
+
+    with profiled(args.profile):
+        if args.watch:
+            watch_folders(
+                args.rgb_dir,
+                args.depth_dir,
+                args.mask_dir,
+                args.out_dir,
+                fx, fy, cx, cy,
+                workers=args.workers,
+                cache=cache,
+                timer=timer,
+                poll_interval=args.poll_interval,
+                settle_seconds=args.settle_seconds,
+                tray_fit=tray_fit,
+                **frame_kwargs
+            )
+        else:
+            frames = find_frames(args.rgb_dir, args.depth_dir, args.mask_dir)
+            run_batch(
+                frames,
+                args.out_dir,
+                fx, fy, cx, cy,
+                workers=args.workers,
+                cache=cache,
+                timer=timer,
+                prefetch=args.prefetch,
+                **frame_kwargs
+            )
+
+    if args.trace:
+        timer.print_summary()
+        timer.write_trace(args.trace)
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,337 @@
+import os
+import shutil
+import struct
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Binary point-cloud cache (.pcc), written next to the PLY files
+#
+#   offset 0            : 32-byte header  "<8sQI12x"
+#                           magic       b"PNUTPC01"
+#                           num_points  uint64
+#                           flags       uint32 (bit 0: colors present)
+#   offset 32           : xyz block, float32, shape (num_points, 3)
+#   offset 32 + 12 * N  : rgb block, uint8,   shape (num_points, 3) (if present)
+#
+# All values are little-endian, so both blocks can be opened with np.memmap.
+# -----------------------------------------------------------------------------
+CACHE_MAGIC = b"PNUTPC01"
+CACHE_EXTENSION = ".pcc"
+HEADER_FORMAT = "<8sQI12x"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FLAG_COLORS = 1
+
+# PLY property types -> NumPy dtypes (both spellings of the PLY spec)
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+
+
+def cache_path_for(ply_path):
+    """
+    Path of the binary cache that belongs to 'ply_path' (same name, .pcc).
+    """
+    return os.path.splitext(ply_path)[0] + CACHE_EXTENSION
+
+
+def write_cache(cache_path, points, colors=None):
+    """
+    Writes points (and optionally colors) in the binary cache format.
+
+    :param cache_path: Output path (usually cache_path_for(ply_path)).
+    :param points: (N, 3) array of XYZ, stored as float32.
+    :param colors: Optional (N, 3) colors, either uint8 or floats in [0, 1]
+                   (as in pcd.colors); stored as uint8.
+    """
+    points = np.ascontiguousarray(points, dtype="<f4").reshape(-1, 3)
+
+    flags = 0
+    if colors is not None and len(colors) > 0:
+        colors = np.asarray(colors)
+        if colors.dtype != np.uint8:
+            colors = np.clip(np.round(colors * 255.0), 0, 255).astype(np.uint8)
+        colors = np.ascontiguousarray(colors).reshape(-1, 3)
+        if len(colors) != len(points):
+            raise ValueError(f"Got {len(points)} points but {len(colors)} colors")
+        flags |= FLAG_COLORS
+
+    # Write to a temporary file first so readers never see a partial cache
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, CACHE_MAGIC, len(points), flags))
+        f.write(points.tobytes())
+        if flags & FLAG_COLORS:
+            f.write(colors.tobytes())
+    os.replace(tmp_path, cache_path)
+
+
+def read_cache(cache_path):
+    """
+    Opens a binary cache with np.memmap; nothing is parsed or copied.
+
+    :return: Tuple (points, colors): (N, 3) float32 memmap and (N, 3) uint8
+             memmap, or None if the cache has no colors.
+    """
+    with open(cache_path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE:
+        raise ValueError(f"Truncated point-cloud cache: {cache_path}")
+
+    magic, num_points, flags = struct.unpack(HEADER_FORMAT, header)
+    if magic != CACHE_MAGIC:
+        raise ValueError(f"Not a point-cloud cache: {cache_path}")
+
+    if num_points == 0:
+        empty_colors = np.zeros((0, 3), dtype=np.uint8) if flags & FLAG_COLORS else None
+        return np.zeros((0, 3), dtype=np.float32), empty_colors
+
+    points = np.memmap(cache_path, dtype="<f4", mode="r",
+                       offset=HEADER_SIZE, shape=(num_points, 3))
+
+    colors = None
+    if flags & FLAG_COLORS:
+        colors = np.memmap(cache_path, dtype=np.uint8, mode="r",
+                           offset=HEADER_SIZE + points.nbytes, shape=(num_points, 3))
+
+    return points, colors
+
+
+def has_fresh_cache(ply_path):
+    """
+    True if the binary cache of 'ply_path' exists and is not older than the
+    PLY itself (or the PLY is gone).
+    """
+    cache_path = cache_path_for(ply_path)
+    if not os.path.exists(cache_path):
+        return False
+    if not os.path.exists(ply_path):
+        return True
+    return os.path.getmtime(cache_path) >= os.path.getmtime(ply_path)
+
+
+def read_ply_arrays(ply_path):
+    """
+    Reads the vertices of a binary PLY (as written by o3d.io.write_point_cloud)
+    with NumPy only, so headless scripts do not need to import Open3D.
+
+    :return: Tuple (points, colors) as in load_point_arrays(), or None if the
+             file is ASCII or has a layout this reader does not handle.
+    """
+    with open(ply_path, "rb") as f:
+        if f.readline().strip() != b"ply":
+            return None
+        byte_order = None
+        num_vertices = None
+        fields = []
+        in_vertex = False
+        while True:
+            line = f.readline()
+            if not line:
+                return None
+            words = line.decode("ascii", errors="replace").split()
+            if not words or words[0] in ("comment", "obj_info"):
+                continue
+            if words[0] == "end_header":
+                break
+            if words[0] == "format":
+                byte_order = {"binary_little_endian": "<", "binary_big_endian": ">"}.get(words[1])
+            elif words[0] == "element":
+                # Only a leading vertex element is supported (Open3D point clouds)
+                in_vertex = words[1] == "vertex" and num_vertices is None
+                if in_vertex:
+                    num_vertices = int(words[2])
+                elif num_vertices is None:
+                    return None
+            elif words[0] == "property" and in_vertex:
+                if words[1] == "list" or words[1] not in PLY_TYPES:
+                    return None
+                fields.append((words[2], byte_order + PLY_TYPES[words[1]] if byte_order else None))
+        header_size = f.tell()
+
+    names = [name for name, _ in fields]
+    if byte_order is None or num_vertices is None or not {"x", "y", "z"} <= set(names):
+        return None
+
+    vertices = np.fromfile(ply_path, dtype=np.dtype(fields), count=num_vertices, offset=header_size)
+    if len(vertices) != num_vertices:
+        raise ValueError(f"Truncated PLY file: {ply_path}")
+
+    points = np.column_stack([vertices[axis].astype(np.float64) for axis in ("x", "y", "z")])
+    colors = None
+    if {"red", "green", "blue"} <= set(names):
+        colors = np.column_stack([vertices[channel] for channel in ("red", "green", "blue")])
+        if colors.dtype != np.uint8:
+            return None
+    return points, colors
+
+
+def ply_vertex_dtype(colors=True):
+    """
+    NumPy dtype of the vertices written by write_ply_arrays(): float32
+    x, y, z and, with colors, uint8 red, green, blue (little-endian).
+    """
+    fields = [("x", "<f4"), ("y", "<f4"), ("z", "<f4")]
+    if colors:
+        fields += [("red", "u1"), ("green", "u1"), ("blue", "u1")]
+    return np.dtype(fields)
+
+
+def ply_header(num_points, vertex_dtype):
+    """
+    ASCII header of a binary little-endian PLY with 'num_points' vertices.
+    """
+    header = ["ply", "format binary_little_endian 1.0", f"element vertex {num_points}"]
+    header += [f"property {'float' if vertex_dtype[name] == np.dtype('<f4') else 'uchar'} {name}"
+               for name in vertex_dtype.names]
+    header += ["end_header", ""]
+    return "\n".join(header).encode("ascii")
+
+
+def ply_vertices(points, colors=None):
+    """
+    Packs points (and uint8 colors) into the vertex records of ply_vertex_dtype().
+    """
+    points = np.asarray(points).reshape(-1, 3)
+    if colors is not None:
+        colors = np.asarray(colors).reshape(-1, 3)
+        if colors.dtype != np.uint8:
+            raise ValueError(f"Expected uint8 colors, got {colors.dtype}")
+        if len(colors) != len(points):
+            raise ValueError(f"Got {len(points)} points but {len(colors)} colors")
+
+    vertices = np.empty(len(points), dtype=ply_vertex_dtype(colors is not None))
+    for axis, name in enumerate(("x", "y", "z")):
+        vertices[name] = points[:, axis]
+    if colors is not None:
+        for channel, name in enumerate(("red", "green", "blue")):
+            vertices[name] = colors[:, channel]
+    return vertices
+
+
+def write_ply_arrays(ply_path, points, colors=None):
+    """
+    Writes a binary little-endian PLY with NumPy only: float32 x, y, z and,
+    if given, uint8 red, green, blue. Readable by o3d.io.read_point_cloud
+    and read_ply_arrays().
+
+    :param points: (N, 3) array of XYZ, stored as float32.
+    :param colors: Optional (N, 3) uint8 RGB colors.
+    """
+    vertices = ply_vertices(points, colors)
+    with open(ply_path, "wb") as f:
+        f.write(ply_header(len(vertices), vertices.dtype))
+        vertices.tofile(f)
+
+
+class PlyStreamWriter:
+    """
+    Writes a PLY (same file as write_ply_arrays) from chunks of points, so
+    the whole cloud never has to be in memory. The vertex count is only
+    known at the end, so the vertex records go to a temporary file first and
+    are copied behind the header on close().
+
+        with PlyStreamWriter(ply_path) as writer:
+            for points, colors in chunks:
+                writer.append(points, colors)
+
+    'min_bound' / 'max_bound' hold the bounds of the written (float32) points.
+    """
+
+    def __init__(self, ply_path, colors=True):
+        self.ply_path = ply_path
+        self.vertex_dtype = ply_vertex_dtype(colors)
+        self.num_points = 0
+        self.min_bound = None
+        self.max_bound = None
+        self._body_path = ply_path + ".body.tmp"
+        self._body = open(self._body_path, "wb")
+
+    def append(self, points, colors=None):
+        vertices = ply_vertices(points, colors)
+        if vertices.dtype != self.vertex_dtype:
+            raise ValueError("Every chunk must have colors, or none")
+        if len(vertices) == 0:
+            return
+
+        xyz = np.column_stack([vertices[name] for name in ("x", "y", "z")]).astype(np.float64)
+        low, high = xyz.min(axis=0), xyz.max(axis=0)
+        self.min_bound = low if self.min_bound is None else np.minimum(self.min_bound, low)
+        self.max_bound = high if self.max_bound is None else np.maximum(self.max_bound, high)
+
+        vertices.tofile(self._body)
+        self.num_points += len(vertices)
+
+    def close(self):
+        """
+        Writes the PLY (header + vertex records) and removes the temporary file.
+        """
+        if self._body is None:
+            return
+        self._body.close()
+        self._body = None
+
+        tmp_path = self.ply_path + ".tmp"
+        with open(tmp_path, "wb") as f, open(self._body_path, "rb") as body:
+            f.write(ply_header(self.num_points, self.vertex_dtype))
+            shutil.copyfileobj(body, f, 16 * 1024 * 1024)
+        os.remove(self._body_path)
+        os.replace(tmp_path, self.ply_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._body is not None:
+            # Failed half-way: leave no partial PLY behind
+            self._body.close()
+            self._body = None
+            os.remove(self._body_path)
+
+
+def load_point_arrays(ply_path):
+    """
+    Loads a point cloud as NumPy arrays, memory-mapping the binary cache when
+    there is a fresh one and falling back to parsing the PLY otherwise.
+    Open3D is only imported for PLYs that read_ply_arrays() cannot handle.
+
+    :return: Tuple (points, colors): (N, 3) float array and (N, 3) uint8
+             array, or None if the cloud has no colors.
+    """
+    if has_fresh_cache(ply_path):
+        return read_cache(cache_path_for(ply_path))
+
+    arrays = read_ply_arrays(ply_path)
+    if arrays is not None:
+        return arrays
+
+    import open3d as o3d
+    pcd = o3d.io.read_point_cloud(ply_path)
+    points = np.asarray(pcd.points)
+    colors = None
+    if pcd.has_colors():
+        colors = np.clip(np.round(np.asarray(pcd.colors) * 255.0), 0, 255).astype(np.uint8)
+    return points, colors
+
+
+def load_point_cloud(ply_path):
+    """
+    Same as o3d.io.read_point_cloud(ply_path), but built from the binary cache
+    when there is a fresh one.
+    """
+    import open3d as o3d
+
+    if not has_fresh_cache(ply_path):
+        return o3d.io.read_point_cloud(ply_path)
+
+    points, colors = read_cache(cache_path_for(ply_path))
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(np.asarray(points, dtype=np.float64))
+    if colors is not None:
+        pcd.colors = o3d.utility.Vector3dVector(np.asarray(colors, dtype=np.float64) / 255.0)
+    return pcd
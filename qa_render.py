@@ -0,0 +1,214 @@
+import os
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from pointcloud_cache import load_point_arrays
+
+# -----------------------------------------------------------------------------
+# Headless QA images of point clouds.
+#
+# Unlike the interactive viewers (Open3D windows, plt.show()), nothing here
+# needs a display: the projections are binned straight from the NumPy point
+# arrays into images and written with cv2.imwrite, so the renderer runs on
+# servers, in worker processes and on the writer thread of pointcloud.py.
+# No 3D scatter is drawn; the side view only paints a decimated subset.
+# -----------------------------------------------------------------------------
+
+
+def decimate(points, max_points, colors=None):
+    """
+    Evenly strided subset of at most 'max_points' points (deterministic,
+    keeps the spatial spread of the cloud).
+
+    :return: Tuple (points, colors) of the subset (colors None if not given).
+    """
+    step = max(1, int(np.ceil(len(points) / max(max_points, 1))))
+    return points[::step], (colors[::step] if colors is not None else None)
+
+
+def top_down_maps(points, bins=256):
+    """
+    Top-down (X, Y) projections of a cloud: nearest depth and point count
+    per cell, with one bincount / minimum.at over the points.
+
+    :param points: (N, 3) array of points (camera frame, Z = depth).
+    :param bins: Number of cells along the longer of X and Y.
+    :return: Tuple (depth_map, density_map, extent): (rows, cols) float64
+             arrays (NaN / 0 where empty) and the imshow extent
+             (x_min, x_max, y_max, y_min).
+    """
+    points = np.asarray(points, dtype=np.float64)
+    x_min, y_min = points[:, 0].min(), points[:, 1].min()
+    x_max, y_max = points[:, 0].max(), points[:, 1].max()
+    cell = max(x_max - x_min, y_max - y_min, 1e-9) / bins
+
+    cols = int((x_max - x_min) / cell) + 1
+    rows = int((y_max - y_min) / cell) + 1
+    col = np.minimum(((points[:, 0] - x_min) / cell).astype(np.int64), cols - 1)
+    row = np.minimum(((points[:, 1] - y_min) / cell).astype(np.int64), rows - 1)
+    flat = row * cols + col
+
+    density_map = np.bincount(flat, minlength=rows * cols).reshape(rows, cols).astype(np.float64)
+    depth_map = np.full(rows * cols, np.inf)
+    np.minimum.at(depth_map, flat, points[:, 2])
+    depth_map[np.isinf(depth_map)] = np.nan
+
+    return depth_map.reshape(rows, cols), density_map, (x_min, x_max, y_max, y_min)
+
+
+def colorize(values, colormap, empty=None):
+    """
+    Maps a 2D array to a BGR image with an OpenCV colormap, stretching
+    [min, max] of the finite values to the full range.
+
+    :param empty: Optional (rows, cols) boolean array of cells painted gray.
+    :return: (rows, cols, 3) uint8 BGR image.
+    """
+    finite = np.isfinite(values)
+    if empty is None:
+        empty = ~finite
+    scaled = np.zeros(values.shape, dtype=np.uint8)
+    if finite.any():
+        lo, hi = values[finite].min(), values[finite].max()
+        scaled[finite] = np.round((values[finite] - lo) * (255.0 / max(hi - lo, 1e-12))).astype(np.uint8)
+    image = cv2.applyColorMap(scaled, colormap)
+    image[empty] = 64
+    return image
+
+
+def side_view(points, colors, cell, x_min, cols):
+    """
+    Side projection (X vs. depth, nearest point up) of the points, painted
+    with their colors (white without colors) on a black background.
+    """
+    z_min = points[:, 2].min()
+    rows = int((points[:, 2].max() - z_min) / cell) + 1
+    col = np.clip(((points[:, 0] - x_min) / cell).astype(np.int64), 0, cols - 1)
+    row = np.minimum(((points[:, 2] - z_min) / cell).astype(np.int64), rows - 1)
+
+    image = np.zeros((rows, cols, 3), dtype=np.uint8)
+    image[row, col] = colors[:, ::-1] if colors is not None else 255
+    return image
+
+
+def render_qa(points, colors, png_path, title=None, max_points=200000, bins=256):
+    """
+    Writes a QA image of one cloud: top-down depth heatmap, top-down point
+    density heatmap and a decimated side view, side by side.
+
+    The panels are rasterised from the arrays (bincount / minimum.at into a
+    grid, OpenCV colormaps), so an image costs a few milliseconds.
+
+    :param points: (N, 3) array of points.
+    :param colors: (N, 3) uint8 RGB colors or None.
+    :param png_path: Output PNG.
+    :param title: Caption (e.g. the frame name).
+    :param max_points: Points drawn in the side view.
+    :param bins: Panel resolution along the longer of X and Y.
+    :return: png_path.
+    """
+    caption = f"{title} ({len(points)} points)" if title else f"{len(points)} points"
+    if len(points) == 0:
+        panels = [np.full((bins, bins, 3), 64, dtype=np.uint8)]
+        labels = ["empty cloud"]
+    else:
+        points = np.asarray(points, dtype=np.float64)
+        depth_map, density_map, extent = top_down_maps(points, bins)
+        cell = max(extent[1] - extent[0], extent[2] - extent[3], 1e-9) / bins
+
+        side_points, side_colors = decimate(points, max_points, colors)
+        panels = [
+            colorize(depth_map, cv2.COLORMAP_VIRIDIS),
+            colorize(np.log1p(density_map), cv2.COLORMAP_MAGMA, empty=density_map == 0),
+            side_view(side_points, side_colors, cell, extent[0], depth_map.shape[1])
+        ]
+        labels = [
+            f"depth {np.nanmin(depth_map):.1f}-{np.nanmax(depth_map):.1f}",
+            f"density max {int(density_map.max())}/cell",
+            "side view (X vs. depth)"
+        ]
+
+    # Pad to a common height and put a caption strip above each panel
+    height = max(panel.shape[0] for panel in panels)
+    strips = []
+    for panel, label in zip(panels, labels):
+        framed = np.zeros((height + 20, panel.shape[1] + 4, 3), dtype=np.uint8)
+        framed[20:20 + panel.shape[0], 2:2 + panel.shape[1]] = panel
+        cv2.putText(framed, label, (4, 14), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1, cv2.LINE_AA)
+        strips.append(framed)
+    body = np.hstack(strips)
+
+    header = np.zeros((24, body.shape[1], 3), dtype=np.uint8)
+    cv2.putText(header, caption, (4, 17), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+    cv2.imwrite(png_path, np.vstack((header, body)))
+    return png_path
+
+
+def render_ply_qa(ply_path, png_path, **render_kwargs):
+    """
+    QA image of a saved cloud (reads the binary cache when present). This is
+    a top-level function so it can be sent to a process pool.
+    """
+    points, colors = load_point_arrays(ply_path)
+    title = os.path.splitext(os.path.basename(ply_path))[0]
+    return render_qa(points, colors, png_path, title=title, **render_kwargs)
+
+
+def qa_path_for(qa_dir, ply_path):
+    """
+    '<qa_dir>/<cloud name>_qa.png'.
+    """
+    return os.path.join(qa_dir, os.path.splitext(os.path.basename(ply_path))[0] + "_qa.png")
+
+
+def render_batch(ply_paths, qa_dir, workers=1, **render_kwargs):
+    """
+    QA images of many clouds, rendered in parallel on 'workers' processes.
+
+    :return: List of the written PNG paths, in completion order.
+    """
+    os.makedirs(qa_dir, exist_ok=True)
+    written = []
+
+    if workers <= 1:
+        for ply_path in ply_paths:
+            written.append(render_ply_qa(ply_path, qa_path_for(qa_dir, ply_path), **render_kwargs))
+            print(f"[INFO] Saved QA image: {written[-1]} [{len(written)}/{len(ply_paths)}]")
+        return written
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(render_ply_qa, ply_path, qa_path_for(qa_dir, ply_path), **render_kwargs)
+            for ply_path in ply_paths
+        ]
+        for future in as_completed(futures):
+            written.append(future.result())
+            print(f"[INFO] Saved QA image: {written[-1]} [{len(written)}/{len(ply_paths)}]")
+    return written
+
+
+def main():
+    # Change these paths as needed
+    ply_dir = r"A:\22May\pointcloud"
+    qa_dir  = r"A:\22May\qa"
+
+    parser = argparse.ArgumentParser(description="Headless QA images (depth/density heatmaps) of point clouds.")
+    parser.add_argument("--ply-dir", default=ply_dir)
+    parser.add_argument("--qa-dir", default=qa_dir)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (1 = serial).")
+    parser.add_argument("--max-points", type=int, default=200000, help="Points drawn in the side view.")
+    parser.add_argument("--bins", type=int, default=256, help="Heatmap resolution along the longer side.")
+    args = parser.parse_args()
+
+    ply_paths = sorted(glob.glob(os.path.join(args.ply_dir, "*.ply")))
+    render_batch(ply_paths, args.qa_dir, workers=args.workers,
+                 max_points=args.max_points, bins=args.bins)
+
+
+if __name__ == "__main__":
+    main()
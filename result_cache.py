@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+
+
+class ResultCache:
+    """
+    Content-hashed record of what a pipeline stage has already produced.
+
+    Every entry stores the key it was computed with: a hash of the stage's
+    input files plus its parameters. When a stage is re-run, entries whose key
+    still matches are reused and everything else is recomputed, so changing a
+    parameter or an input file only redoes the affected work.
+
+    The record is a JSON manifest next to the stage's output. File digests are
+    memoized by (size, mtime) so unchanged inputs are not re-read on every run.
+    """
+
+    def __init__(self, manifest_path):
+        """
+        :param manifest_path: JSON file that holds the record (created on save()).
+        """
+        self.manifest_path = manifest_path
+        self.entries = {}
+        self.files = {}
+
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r") as f:
+                    manifest = json.load(f)
+                self.entries = manifest.get("entries", {})
+                self.files = manifest.get("files", {})
+            except (OSError, ValueError):
+                print(f"[WARNING] Ignoring unreadable cache manifest: {manifest_path}")
+
+    def file_digest(self, path):
+        """
+        SHA-256 of a file's contents (memoized by size and mtime).
+        """
+        stat = os.stat(path)
+        abs_path = os.path.abspath(path)
+        memo = self.files.get(abs_path)
+        if memo and memo["size"] == stat.st_size and memo["mtime_ns"] == stat.st_mtime_ns:
+            return memo["sha256"]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+        self.files[abs_path] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest.hexdigest()
+        }
+        return digest.hexdigest()
+
+    def key(self, input_paths=(), params=None):
+        """
+        Cache key of one unit of work.
+
+        :param input_paths: Files the work reads; their contents are hashed.
+        :param params: JSON-serialisable parameters of the work.
+        :return: Hex digest string.
+        """
+        digest = hashlib.sha256()
+        for path in input_paths:
+            digest.update(self.file_digest(path).encode())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def lookup(self, name, key, output_paths=()):
+        """
+        Stored value of entry 'name' if it was computed with 'key' and all of
+        'output_paths' still exist; None otherwise.
+        """
+        entry = self.entries.get(name)
+        if entry is None or entry["key"] != key:
+            return None
+        if not all(os.path.exists(path) for path in output_paths):
+            return None
+        return entry["value"]
+
+    def store(self, name, key, value=True):
+        """
+        Records that entry 'name' was computed with 'key' (value must be
+        JSON-serialisable).
+        """
+        self.entries[name] = {"key": key, "value": value}
+
+    def save(self):
+        """
+        Writes the manifest (atomically, via a temporary file).
+        """
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"entries": self.entries, "files": self.files}, f)
+        os.replace(tmp_path, self.manifest_path)
@@ -6,6 +6,9 @@ from matplotlib.cm import ScalarMappable
 import cv2
 import os
 
+from backprojection import depth_to_points
+from point_density import point_cloud_densities
+
 # Paths to files
 binary_mask_path = r"C:\Users\hj46265\Downloads\Peanut\validation\output_masks\26_mask.png"
 depth_map_path = r"C:\Users\hj46265\Downloads\Peanut\validation\Depth 1\26.png"
@@ -22,17 +25,9 @@ assert depth_map is not None and rgb_image is not None, "Files not loaded correc
 # Camera intrinsic parameters
 fx, fy, cx, cy = 1906.29, 1906.29, 1099.99, 619.98
 
-# Generate point cloud data
-points, colors = [], []
-for v in range(depth_map.shape[0]):
-    for u in range(depth_map.shape[1]):
-        if binary_mask[v, u]:
-            Z = depth_map[v, u]
-            if Z > 0:  # Filter out invalid depth
-                X = (u - cx) * Z / fx
-                Y = (v - cy) * Z / fy
-                points.append([X, Y, Z])
-                colors.append(rgb_image[v, u] / 255.0)  # Normalize colors
+# Generate point cloud data (masked pixels with a valid depth only)
+points, colors = depth_to_points(depth_map, rgb_image, fx, fy, cx, cy, mask=binary_mask)
+colors = colors / 255.0  # Normalize colors
 
 # Create Open3D Point Cloud
 pcd = o3d.geometry.PointCloud()
@@ -60,23 +55,13 @@ colors = [(0, 0, 0.5), (0, 1, 0), (1, 1, 0), (1, 0, 0)]
 cmap_name = 'my_density_map'
 custom_cmap = LinearSegmentedColormap.from_list(cmap_name, colors, N=n_bins)
 
-# Voxel downsampling
+# Compute densities: neighbours of every point in the voxel-downsampled cloud,
+# counted in one batched, multi-threaded KD-tree query
 voxel_size = 0.02
-down_pcd = pcd.voxel_down_sample(voxel_size)
-
-# KDTree
-kdtree = o3d.geometry.KDTreeFlann(down_pcd)
-
-# Compute densities
-densities = []
 radius = 0.35
-volume_of_sphere = (4.0 / 3.0) * np.pi * (radius ** 3)
-for i in range(len(pcd.points)):
-    [k, idx, _] = kdtree.search_radius_vector_3d(pcd.points[i], radius)
-    densities.append(k / volume_of_sphere)
+densities_array = point_cloud_densities(pcd, radius, voxel_size=voxel_size)
 
 # Update point cloud colors for density visualization
-densities_array = np.array(densities)
 colors = custom_cmap(densities_array / np.max(densities_array))
 pcd.colors = o3d.utility.Vector3dVector(colors[:, :3])
 
@@ -0,0 +1,291 @@
+import os
+import glob
+import argparse
+
+import numpy as np
+
+from pointcloud_cache import load_point_arrays
+from voxel_count import voxel_indices, voxel_origin
+
+# -----------------------------------------------------------------------------
+# Persistent sparse voxel occupancy.
+#
+# A scan is stored as the sorted array of the int64 keys of its occupied
+# voxels on a fixed grid (origin + voxel size). Each key packs (i, j, k) in
+# 21 bits per axis (offset by 2^20), so keys do not depend on the bounds of
+# the scan and any two scans on the same grid can be combined directly:
+# union is a linear merge of the sorted arrays, intersection and difference
+# a binary search of one in the other, with no revoxelization.
+#
+# For the counts to match voxel_count.count_occupied_voxels() a set can be
+# built on the cloud's own origin; to compare scans (several views of one
+# sample, before / after drying), build them all on one shared origin.
+# -----------------------------------------------------------------------------
+AXIS_BITS = 21
+AXIS_OFFSET = 1 << (AXIS_BITS - 1)
+AXIS_MASK = (1 << AXIS_BITS) - 1
+
+
+def pack_indices(indices):
+    """
+    Packs (N, 3) voxel indices in [-2^20, 2^20) into int64 keys that keep
+    the (i, j, k) lexicographic order.
+    """
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    if len(indices) and (indices.min() < -AXIS_OFFSET or indices.max() >= AXIS_OFFSET):
+        raise ValueError(
+            f"Voxel indices outside [-{AXIS_OFFSET}, {AXIS_OFFSET}); "
+            f"use a larger voxel size or an origin closer to the points"
+        )
+    shifted = indices + AXIS_OFFSET
+    return (shifted[:, 0] << (2 * AXIS_BITS)) | (shifted[:, 1] << AXIS_BITS) | shifted[:, 2]
+
+
+def unpack_keys(keys):
+    """
+    Inverse of pack_indices(): (N, 3) int64 voxel indices.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    return np.column_stack((
+        (keys >> (2 * AXIS_BITS)) & AXIS_MASK,
+        (keys >> AXIS_BITS) & AXIS_MASK,
+        keys & AXIS_MASK
+    )) - AXIS_OFFSET
+
+
+def merge_sorted_keys(key_arrays):
+    """
+    Sorted union of sorted, unique key arrays. The stable sort (timsort)
+    finds the sorted runs and merges them in linear time; duplicates are then
+    dropped by comparing neighbours.
+    """
+    keys = np.concatenate(key_arrays)
+    keys.sort(kind="stable")
+    if len(keys) == 0:
+        return keys
+    first = np.empty(len(keys), dtype=bool)
+    first[0] = True
+    np.not_equal(keys[1:], keys[:-1], out=first[1:])
+    return keys[first]
+
+
+class SparseVoxelSet:
+    """
+    Occupied voxels of a scan: sorted, unique int64 keys on a grid given by
+    'voxel_size' and 'origin'. 8 bytes per occupied voxel.
+
+        before = SparseVoxelSet.from_ply("3_before.ply", 2.0, origin=(0, 0, 0))
+        after  = SparseVoxelSet.from_ply("3_after.ply",  2.0, origin=(0, 0, 0))
+        shrinkage = len(before - after) * before.voxel_volume
+
+    Sets on different grids cannot be combined (ValueError).
+    """
+
+    __slots__ = ("keys", "voxel_size", "origin")
+
+    def __init__(self, keys, voxel_size, origin=(0.0, 0.0, 0.0), assume_sorted=False):
+        """
+        :param keys: int64 keys from pack_indices().
+        :param voxel_size: Edge length of a voxel.
+        :param origin: (3,) grid origin.
+        :param assume_sorted: 'keys' is already sorted and unique.
+        """
+        keys = np.asarray(keys, dtype=np.int64).ravel()
+        self.keys = keys if assume_sorted else np.unique(keys)
+        self.voxel_size = float(voxel_size)
+        self.origin = np.asarray(origin, dtype=np.float64).reshape(3)
+
+    @classmethod
+    def from_points(cls, points, voxel_size, origin=None, half_voxel_margin=False):
+        """
+        Voxelizes a point array.
+
+        :param origin: Shared grid origin; if None, the cloud's own origin
+                       (see voxel_count.voxel_origin), which gives the count
+                       of count_occupied_voxels().
+        :param half_voxel_margin: See voxel_count.voxel_origin() (origin=None only).
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        if origin is None:
+            origin = voxel_origin(points, voxel_size, half_voxel_margin) if len(points) else np.zeros(3)
+        keys = pack_indices(voxel_indices(points, voxel_size, origin))
+        return cls(keys, voxel_size, origin)
+
+    @classmethod
+    def from_ply(cls, ply_path, voxel_size, origin=None, half_voxel_margin=False):
+        """
+        Voxelizes a saved cloud (read through pointcloud_cache.load_point_arrays).
+        """
+        points, _ = load_point_arrays(ply_path)
+        return cls.from_points(points, voxel_size, origin, half_voxel_margin)
+
+    @classmethod
+    def load(cls, npz_path):
+        """
+        Reads a set written by save().
+        """
+        with np.load(npz_path) as data:
+            keys = np.cumsum(data["key_deltas"], dtype=np.int64)
+            return cls(keys, float(data["voxel_size"]), data["origin"], assume_sorted=True)
+
+    def save(self, npz_path):
+        """
+        Writes the set as a compressed .npz. The sorted keys are stored as
+        deltas, which are small and compress well.
+        """
+        deltas = np.diff(self.keys, prepend=np.int64(0))
+        np.savez_compressed(npz_path, key_deltas=deltas, voxel_size=self.voxel_size, origin=self.origin)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def voxel_volume(self):
+        """
+        Volume of one voxel, in cubic point units.
+        """
+        return self.voxel_size ** 3
+
+    def indices(self):
+        """
+        (N, 3) int64 voxel indices, in key order.
+        """
+        return unpack_keys(self.keys)
+
+    def centers(self):
+        """
+        (N, 3) float64 voxel centers.
+        """
+        return self.origin + (self.indices() + 0.5) * self.voxel_size
+
+    def contains(self, points):
+        """
+        (N,) boolean: does the voxel of each point belong to the set.
+        """
+        keys = pack_indices(voxel_indices(points, self.voxel_size, self.origin))
+        if len(self.keys) == 0:
+            return np.zeros(len(keys), dtype=bool)
+        position = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return self.keys[position] == keys
+
+    def _check_grid(self, other):
+        if self.voxel_size != other.voxel_size or not np.array_equal(self.origin, other.origin):
+            raise ValueError(
+                f"Voxel sets are on different grids (voxel size {self.voxel_size} vs "
+                f"{other.voxel_size}, origin {self.origin} vs {other.origin})"
+            )
+
+    def _with_keys(self, keys):
+        return SparseVoxelSet(keys, self.voxel_size, self.origin, assume_sorted=True)
+
+    def isin(self, other):
+        """
+        (N,) boolean: is each voxel of this set also in 'other'. A binary
+        search of the sorted keys, no sort.
+        """
+        self._check_grid(other)
+        if len(other.keys) == 0:
+            return np.zeros(len(self.keys), dtype=bool)
+        position = np.minimum(np.searchsorted(other.keys, self.keys), len(other.keys) - 1)
+        return other.keys[position] == self.keys
+
+    def union(self, other):
+        self._check_grid(other)
+        return self._with_keys(merge_sorted_keys([self.keys, other.keys]))
+
+    def intersection(self, other):
+        return self._with_keys(self.keys[self.isin(other)])
+
+    def difference(self, other):
+        return self._with_keys(self.keys[~self.isin(other)])
+
+    def symmetric_difference(self, other):
+        return self._with_keys(merge_sorted_keys([
+            self.keys[~self.isin(other)], other.keys[~other.isin(self)]
+        ]))
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
+
+    def __eq__(self, other):
+        if not isinstance(other, SparseVoxelSet):
+            return NotImplemented
+        return (self.voxel_size == other.voxel_size and np.array_equal(self.origin, other.origin)
+                and np.array_equal(self.keys, other.keys))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"SparseVoxelSet({len(self)} voxels, voxel_size={self.voxel_size}, origin={self.origin.tolist()})"
+
+
+def union_all(voxel_sets):
+    """
+    Union of many sets on one grid (e.g. the views of a sample) in one merge.
+    """
+    voxel_sets = list(voxel_sets)
+    for other in voxel_sets[1:]:
+        voxel_sets[0]._check_grid(other)
+    return voxel_sets[0]._with_keys(merge_sorted_keys([voxel_set.keys for voxel_set in voxel_sets]))
+
+
+def compare(before, after):
+    """
+    Voxel counts of two scans and of their overlap.
+
+    :return: Dict with 'before', 'after', 'union', 'intersection',
+             'only_before', 'only_after' (voxels) and 'iou'.
+    """
+    union = len(before | after)
+    intersection = len(before & after)
+    return {
+        "before": len(before),
+        "after": len(after),
+        "union": union,
+        "intersection": intersection,
+        "only_before": len(before) - intersection,
+        "only_after": len(after) - intersection,
+        "iou": intersection / union if union else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sparse voxel sets of point clouds: build, save and compare.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Voxelize every PLY of a folder into '<name>.npz'.")
+    build.add_argument("--ply-dir", required=True)
+    build.add_argument("--out-dir", required=True)
+    build.add_argument("--voxel-size", type=float, default=10.0)
+    build.add_argument("--origin", type=float, nargs=3, default=[0.0, 0.0, 0.0],
+                       help="Grid origin shared by all the sets, so they can be compared.")
+
+    comp = subparsers.add_parser("compare", help="Compare two saved sets (e.g. before / after drying).")
+    comp.add_argument("before")
+    comp.add_argument("after")
+    comp.add_argument("--volume-per-voxel", type=float, default=None,
+                      help="ml per voxel, to also print the volumes.")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        os.makedirs(args.out_dir, exist_ok=True)
+        for ply_path in sorted(glob.glob(os.path.join(args.ply_dir, "*.ply"))):
+            voxel_set = SparseVoxelSet.from_ply(ply_path, args.voxel_size, origin=args.origin)
+            npz_path = os.path.join(args.out_dir, os.path.splitext(os.path.basename(ply_path))[0] + ".npz")
+            voxel_set.save(npz_path)
+            print(f"[INFO] {ply_path} -> {len(voxel_set)} voxels -> {npz_path}")
+    else:
+        result = compare(SparseVoxelSet.load(args.before), SparseVoxelSet.load(args.after))
+        for name, value in result.items():
+            if name == "iou":
+                print(f"{name:>13}: {value:.4f}")
+            elif args.volume_per_voxel is not None:
+                print(f"{name:>13}: {value} voxels ({value * args.volume_per_voxel:.3f} ml)")
+            else:
+                print(f"{name:>13}: {value} voxels")
+
+
+if __name__ == "__main__":
+    main()
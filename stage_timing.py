@@ -0,0 +1,161 @@
+import os
+import sys
+import csv
+import json
+import time
+import cProfile
+from contextlib import contextmanager
+
+# -----------------------------------------------------------------------------
+# Per-stage instrumentation: wall time, point count and memory of every stage
+# of every frame, collected as plain dicts so worker processes can send their
+# records back to the parent with the frame results.
+# -----------------------------------------------------------------------------
+TRACE_FIELDS = ["frame", "stage", "seconds", "points", "rss_mb", "pid"]
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB, or None if it cannot be
+    measured on this platform.
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS reports bytes
+        return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024.0 * 1024.0)
+    except ImportError:
+        return None
+
+
+def current_rss_mb():
+    """
+    Current resident set size in MB (psutil), falling back to the peak.
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024.0 * 1024.0)
+    except ImportError:
+        return peak_rss_mb()
+
+
+class StageTimer:
+    """
+    Collects one record per (frame, stage):
+
+        with timer.stage("12", "outlier_removal") as record:
+            pcd = ...
+            record["points"] = len(pcd.points)
+
+    A disabled timer records nothing, so the instrumented code paths cost
+    nothing extra when tracing is off.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.records = []
+
+    @contextmanager
+    def stage(self, frame, name, points=None):
+        """
+        Times the enclosed block. The yielded dict can be updated (e.g. with
+        'points') before the block ends.
+        """
+        record = {"frame": frame, "stage": name, "points": points}
+        if not self.enabled:
+            yield record
+            return
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            record["rss_mb"] = current_rss_mb()
+            record["pid"] = os.getpid()
+            self.records.append(record)
+
+    def extend(self, records):
+        """
+        Adds records collected elsewhere (e.g. returned by a worker process).
+        """
+        if self.enabled and records:
+            self.records.extend(records)
+
+    def summary(self):
+        """
+        Per-stage totals, in the order the stages first ran.
+
+        :return: Dict {stage: {'calls', 'total_s', 'mean_s', 'max_s', 'points',
+                 'points_per_s', 'max_rss_mb'}}.
+        """
+        stages = {}
+        for record in self.records:
+            stats = stages.setdefault(record["stage"], {
+                "calls": 0, "total_s": 0.0, "max_s": 0.0, "points": 0, "max_rss_mb": None
+            })
+            stats["calls"] += 1
+            stats["total_s"] += record["seconds"]
+            stats["max_s"] = max(stats["max_s"], record["seconds"])
+            stats["points"] += record["points"] or 0
+            if record["rss_mb"] is not None:
+                stats["max_rss_mb"] = max(stats["max_rss_mb"] or 0.0, record["rss_mb"])
+
+        for stats in stages.values():
+            stats["mean_s"] = stats["total_s"] / stats["calls"]
+            stats["points_per_s"] = stats["points"] / stats["total_s"] if stats["total_s"] > 0 else None
+        return stages
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+        total = sum(stats["total_s"] for stats in summary.values())
+        print("\n=== Stage timings ===")
+        for name, stats in summary.items():
+            share = 100.0 * stats["total_s"] / total if total > 0 else 0.0
+            print(f"{name:>16}: {stats['total_s']:8.2f} s total, {stats['mean_s']:.3f} s/call "
+                  f"x {stats['calls']} ({share:.0f} %)"
+                  + (f", {stats['points_per_s']:,.0f} points/s" if stats["points_per_s"] else ""))
+
+    def write_trace(self, path):
+        """
+        Writes the records to 'path': JSON (records + summary) if it ends in
+        .json, CSV (one row per record) otherwise.
+        """
+        if path.lower().endswith(".json"):
+            with open(path, "w") as f:
+                json.dump({"records": self.records, "summary": self.summary()}, f, indent=2)
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=TRACE_FIELDS)
+                writer.writeheader()
+                writer.writerows(self.records)
+        print(f"[INFO] Stage trace saved to {path}")
+
+
+@contextmanager
+def profiled(path=None):
+    """
+    Runs the enclosed block under cProfile and dumps the stats to 'path'
+    (view with 'python -m pstats <path>' or snakeviz). Does nothing if 'path'
+    is None. Only this process is profiled, not pool workers.
+    """
+    if path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"[INFO] Profile saved to {path}")
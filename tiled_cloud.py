@@ -0,0 +1,327 @@
+import os
+import argparse
+
+import cv2
+import numpy as np
+
+from outlier_filter import neighbor_distances, window_for_neighbors
+from pointcloud_cache import PlyStreamWriter, ply_vertex_dtype
+from stage_timing import StageTimer
+from tray_plane import ray_heights
+from voxel_count import count_occupied_voxels_streamed
+
+# -----------------------------------------------------------------------------
+# Out-of-core point clouds for very large (e.g. stitched multi-camera) depth
+# maps.
+#
+# The frame is processed in bands of rows. Each band is back-projected and
+# cleaned with the pixel-window outlier filter of outlier_filter.py, its
+# points are appended to the output PLY, and nothing of the band is kept.
+# Peak memory is set by the band height, not by the number of points: the
+# whole-frame path holds the float64 Open3D cloud (48 bytes per point) plus
+# the k-NN structures, while here only the images themselves (2 + 3 + 1
+# bytes per pixel, or nothing for .npy inputs, which are memory-mapped) and
+# one band of work arrays are resident.
+#
+# The grid filter's thresholds are global (mean + std_ratio * std over every
+# point), so the bands are swept three times: pass-1 distance statistics,
+# pass-2 distance statistics, and the final inlier test. A band borrows
+# 2 * (window // 2) overlap rows on each side, enough for its pass-2
+# distances to see the same pass-1 inliers as in the whole frame, so the
+# tiled cloud has the same points as grid_outlier_mask() on the full image.
+#
+# Tray plane removal (tray_plane.py) is applied per band as well, on the
+# band's own rays, so no full-frame ray grid or mask is ever allocated.
+# -----------------------------------------------------------------------------
+
+
+def open_image(path, flags=cv2.IMREAD_UNCHANGED):
+    """
+    Opens an input image for banded reading: '.npy' arrays are memory-mapped
+    (rows are read from disk as the bands need them), other formats are
+    decoded with cv2.imread.
+
+    :return: Array-like of shape (H, W) or (H, W, C), or None if unreadable.
+    """
+    if os.path.splitext(path)[1].lower() == ".npy":
+        return np.load(path, mmap_mode="r")
+    return cv2.imread(path, flags)
+
+
+def band_ranges(height, band_rows):
+    """
+    Row ranges [start, stop) of the bands of an image.
+    """
+    return [(start, min(start + band_rows, height)) for start in range(0, height, band_rows)]
+
+
+class RunningMoments:
+    """
+    Count, mean and variance of a stream of values, merged batch by batch
+    (Chan et al.), so global statistics need no copy of the values.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, values):
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        count = len(values)
+        mean = values.mean()
+        delta = mean - self.mean
+        total = self.count + count
+        self.m2 += ((values - mean) ** 2).sum() + delta ** 2 * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+    def threshold(self, std_ratio):
+        """
+        mean + std_ratio * std (None if no value was added), as sor_threshold().
+        """
+        if self.count == 0:
+            return None
+        return self.mean + std_ratio * np.sqrt(self.m2 / self.count)
+
+
+class BandFilter:
+    """
+    The grid outlier filter of one frame, evaluated band by band.
+    """
+
+    def __init__(self, depth_img, mask_img, fx, fy, cx, cy, window=19, std_ratio=0.5,
+                 tray_plane=None, plane_tolerance=2.0):
+        self.depth_img = depth_img
+        self.mask_img = mask_img
+        self.height, self.width = depth_img.shape[:2]
+        self.fx, self.fy, self.cx, self.cy = fx, fy, cx, cy
+        self.window = window
+        self.std_ratio = std_ratio
+        self.halo = window // 2
+        self.tray_plane = tray_plane
+        self.plane_tolerance = plane_tolerance
+
+        # Same float32 rays as backprojection.BackProjector, one row at a time
+        self.ray_x = ((np.arange(self.width) - cx) / fx).astype(np.float32)
+
+    def rays_y(self, start, stop):
+        return ((np.arange(start, stop) - self.cy) / self.fy).astype(np.float32)
+
+    def valid(self, start, stop):
+        """
+        Depth of rows [start, stop) and the (stop - start, W) boolean array
+        of their masked pixels with depth, off the tray plane if one is set
+        (same pixels as tray_plane.remove_tray_pixels()).
+        """
+        depth = np.asarray(self.depth_img[start:stop])
+        valid = (np.asarray(self.mask_img[start:stop]) > 0) & (depth > 0)
+        if self.tray_plane is not None:
+            heights = ray_heights(depth.astype(np.float64), self.ray_x[np.newaxis, :],
+                                  self.rays_y(start, stop)[:, np.newaxis], self.tray_plane)
+            valid &= np.abs(heights) > self.plane_tolerance
+        return depth, valid
+
+    def distances(self, start, stop, threshold_1=None):
+        """
+        Grid-filter distances of the valid pixels of rows [start, stop):
+        pass-1 distances, or pass-2 distances if the pass-1 threshold is given.
+
+        :return: Tuple (distances, inner): distances of the valid pixels of
+                 the band in row-major order and the (stop - start, W)
+                 boolean array of those pixels.
+        """
+        span = self.halo if threshold_1 is None else 2 * self.halo
+        low, high = max(0, start - span), min(self.height, stop + span)
+
+        depth, valid = self.valid(low, high)
+        inner = valid[start - low:stop - low]
+        if not inner.any():
+            return np.zeros(0), inner
+
+        z = np.where(valid, depth, 0).astype(np.float64)
+        xyz = [self.ray_x[np.newaxis, :] * z, self.rays_y(low, high)[:, np.newaxis] * z, z]
+
+        # Centre the coordinates first to keep the sums well conditioned
+        weight = valid.astype(np.float64)
+        for axis in range(3):
+            xyz[axis] -= xyz[axis][valid].mean()
+            xyz[axis] *= weight
+
+        distances = neighbor_distances(xyz, valid, weight, self.window)
+        if threshold_1 is not None:
+            weight[valid] = distances <= threshold_1
+            distances = neighbor_distances(xyz, valid, weight, self.window)
+
+        # Keep the band's own rows; the overlap rows belong to the neighbours
+        in_band = np.zeros_like(valid)
+        in_band[start - low:stop - low] = True
+        return distances[in_band[valid]], inner
+
+    def thresholds(self, bands):
+        """
+        Global pass-1 and pass-2 thresholds (None if there are no points).
+        """
+        moments = RunningMoments()
+        for start, stop in bands:
+            moments.add(self.distances(start, stop)[0])
+        threshold_1 = moments.threshold(self.std_ratio)
+        if threshold_1 is None:
+            return None, None
+
+        moments = RunningMoments()
+        for start, stop in bands:
+            moments.add(self.distances(start, stop, threshold_1)[0])
+        return threshold_1, moments.threshold(self.std_ratio)
+
+    def inliers(self, start, stop, threshold_1, threshold_2):
+        """
+        (stop - start, W) boolean array of the inlier pixels of a band.
+        """
+        distances, inner = self.distances(start, stop, threshold_1)
+        inliers = np.zeros_like(inner)
+        inliers[inner] = distances <= threshold_2
+        return inliers
+
+
+def build_tiled_cloud(
+    depth_img,
+    rgb_img,
+    mask_img,
+    ply_path,
+    fx,
+    fy,
+    cx,
+    cy,
+    band_rows=256,
+    nb_neighbors=350,
+    std_ratio=0.5,
+    voxel_size=None,
+    half_voxel_margin=False,
+    tray_plane=None,
+    plane_tolerance=2.0,
+    timer=None,
+    frame=None
+):
+    """
+    Writes the grid-filtered cloud of a frame to 'ply_path', band by band.
+    Same points and colors as build_point_cloud(..., outlier_method="grid")
+    and the same file as PointSet.save().
+
+    :param depth_img, rgb_img, mask_img: Images (or memmaps, see open_image);
+                                         rgb_img is BGR, as from cv2.imread.
+    :param fx, fy, cx, cy: Camera intrinsics in pixels.
+    :param band_rows: Rows per band.
+    :param nb_neighbors, std_ratio: Outlier filter settings, as in build_point_cloud.
+    :param voxel_size: If given, also count the occupied voxels of the cloud
+                       (read back from the PLY in chunks).
+    :param half_voxel_margin: See voxel_count.voxel_origin().
+    :param tray_plane, plane_tolerance: Tray plane removal, as in build_point_cloud
+                                        (applied band by band).
+    :param timer: Optional StageTimer; the passes are recorded under 'frame'.
+    :return: Dict with 'num_points', 'num_voxels' (None without voxel_size)
+             and 'bands'.
+    """
+    if band_rows <= 0:
+        raise ValueError(f"band_rows must be positive, got {band_rows}")
+    if timer is None:
+        timer = StageTimer(enabled=False)
+
+    band_filter = BandFilter(depth_img, mask_img, fx, fy, cx, cy,
+                             window=window_for_neighbors(nb_neighbors), std_ratio=std_ratio,
+                             tray_plane=tray_plane, plane_tolerance=plane_tolerance)
+    bands = band_ranges(band_filter.height, band_rows)
+
+    with timer.stage(frame, "outlier_thresholds"):
+        threshold_1, threshold_2 = band_filter.thresholds(bands)
+
+    with timer.stage(frame, "tiled_cloud") as record, PlyStreamWriter(ply_path) as writer:
+        for start, stop in bands if threshold_2 is not None else []:
+            inliers = band_filter.inliers(start, stop, threshold_1, threshold_2)
+            z = np.asarray(depth_img[start:stop])[inliers].astype(np.float32)
+            rows, cols = np.nonzero(inliers)
+            points = np.column_stack((
+                band_filter.ray_x[cols] * z,
+                band_filter.rays_y(start, stop)[rows] * z,
+                z
+            ))
+            colors = np.asarray(rgb_img[start:stop])[inliers][:, ::-1]
+            writer.append(points, colors)
+        record["points"] = writer.num_points
+
+    num_voxels = None
+    if voxel_size is not None:
+        with timer.stage(frame, "voxel_count", points=writer.num_points):
+            num_voxels = 0
+            if writer.num_points > 0:
+                num_voxels = count_occupied_voxels_streamed(
+                    ply_point_chunks(ply_path, writer.num_points),
+                    voxel_size, writer.min_bound, writer.max_bound,
+                    half_voxel_margin=half_voxel_margin
+                )
+
+    return {"num_points": writer.num_points, "num_voxels": num_voxels, "bands": len(bands)}
+
+
+def ply_point_chunks(ply_path, num_points, chunk_points=1 << 20):
+    """
+    Yields the (N_c, 3) float32 points of a PLY written by PlyStreamWriter,
+    a chunk at a time, through a memory map.
+    """
+    dtype = ply_vertex_dtype(colors=True)
+    with open(ply_path, "rb") as f:
+        while f.readline().strip() != b"end_header":
+            pass
+        offset = f.tell()
+
+    vertices = np.memmap(ply_path, dtype=dtype, mode="r", offset=offset, shape=(num_points,))
+    for start in range(0, num_points, chunk_points):
+        chunk = vertices[start:start + chunk_points]
+        yield np.column_stack((chunk["x"], chunk["y"], chunk["z"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Masked, grid-filtered point cloud of one very large depth map, built in row bands."
+    )
+    parser.add_argument("--depth", required=True, help="Depth image (.png/.tif, or .npy to memory-map it).")
+    parser.add_argument("--rgb", required=True, help="BGR color image (or .npy).")
+    parser.add_argument("--mask", required=True, help="Mask image (or .npy).")
+    parser.add_argument("--out", required=True, help="Output PLY.")
+    parser.add_argument("--band-rows", type=int, default=256)
+    parser.add_argument("--voxel-size", type=float, default=None,
+                        help="Also count the occupied voxels at this voxel size.")
+    parser.add_argument("--trace", default=None,
+                        help="Record per-stage timings and write them here (.csv or .json).")
+    args = parser.parse_args()
+    if args.band_rows <= 0:
+        parser.error("--band-rows must be positive")
+
+    # Camera intrinsics (same as pointcloud.py)
+    fx, fy, cx, cy = 1906.29, 1906.29, 1099.99, 619.98
+
+    depth_img = open_image(args.depth, cv2.IMREAD_ANYDEPTH)
+    rgb_img   = open_image(args.rgb,   cv2.IMREAD_COLOR)
+    mask_img  = open_image(args.mask,  cv2.IMREAD_GRAYSCALE)
+    if depth_img is None or rgb_img is None or mask_img is None:
+        raise ValueError("Failed to read one or more input images")
+
+    timer = StageTimer(enabled=args.trace is not None)
+    frame = os.path.splitext(os.path.basename(args.out))[0]
+    result = build_tiled_cloud(depth_img, rgb_img, mask_img, args.out, fx, fy, cx, cy,
+                               band_rows=args.band_rows, voxel_size=args.voxel_size,
+                               timer=timer, frame=frame)
+
+    print(f"[INFO] Saved {result['num_points']} points in {result['bands']} bands: {args.out}")
+    if result["num_voxels"] is not None:
+        print(f"[INFO] Occupied voxels (voxel size {args.voxel_size}): {result['num_voxels']}")
+
+    if args.trace:
+        timer.print_summary()
+        timer.write_trace(args.trace)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import os
+
+import numpy as np
+
+from backprojection import get_backprojector
+from frame_io import read_frame
+from result_cache import ResultCache
+
+# -----------------------------------------------------------------------------
+# Tray plane removal.
+#
+# The tray is described like in depth_volume.py, as an inverse-depth plane
+#
+#     1 / Z = a * rx + b * ry + c     <=>     a * X + b * Y + c * Z = 1
+#
+# with (rx, ry) the normalized ray of a pixel, so a plane fitted here can
+# also be passed as the 'reference' of depth_volume.estimate_volume(). Its
+# 3D normal is (a, b, c), and the height of a pixel above the tray is
+#
+#     (1 - Z * (a * rx + b * ry + c)) / |(a, b, c)|
+#
+# which is one multiply-add per masked pixel, evaluated on the image before
+# any point is built or filtered.
+#
+# The plane is fitted once per camera setup with RANSAC on a random
+# subsample of the tray (unmasked) pixels of one frame, and kept in a
+# ResultCache manifest keyed on the intrinsics and the setup name.
+# -----------------------------------------------------------------------------
+
+
+def ray_heights(z, ray_x, ray_y, plane):
+    """
+    Signed height above the plane (depth units; positive towards the camera)
+    of depths 'z' along the rays (ray_x, ray_y). The arrays only need to
+    broadcast, so a band of rows can pass its 1D rays.
+
+    :param plane: (a, b, c) inverse-depth plane.
+    :return: float64 array of the broadcast shape.
+    """
+    a, b, c = np.asarray(plane, dtype=np.float64)
+    inv_depth = a * ray_x + b * ray_y + c
+    return (1.0 - z * inv_depth) / np.sqrt(a * a + b * b + c * c)
+
+
+def pixel_heights(depth_img, pixels, plane, projector):
+    """
+    ray_heights() of the given pixels of a depth image.
+
+    :param pixels: (H, W) boolean array of the pixels to evaluate.
+    :param plane: (a, b, c) inverse-depth plane.
+    :return: 1D float64 array, in row-major pixel order.
+    """
+    z = depth_img[pixels].astype(np.float64)
+    return ray_heights(z, projector.ray_x[pixels], projector.ray_y[pixels], plane)
+
+
+def fit_tray_plane(depth_img, support, fx, fy, cx, cy, sample_size=20000, iterations=256,
+                   tolerance=2.0, seed=0):
+    """
+    RANSAC fit of the tray plane to the 'support' pixels (e.g. everything
+    outside the mask) of a depth image.
+
+    All the candidate planes are solved at once (one batched 3x3 solve) and
+    scored at once against a random subsample of the support, so the fit
+    costs a few matrix products. The best candidate is refined by a least-
+    squares fit to its inliers.
+
+    :param depth_img: (H, W) depth image.
+    :param support: (H, W) boolean array of the pixels that show the tray.
+    :param fx, fy, cx, cy: Camera intrinsics in pixels.
+    :param sample_size: Number of support pixels the fit looks at.
+    :param iterations: Number of RANSAC candidates.
+    :param tolerance: Inlier distance to the plane (depth units).
+    :param seed: Seed of the random sampling, so the fit is reproducible.
+    :return: (3,) array (a, b, c) of the inverse-depth plane.
+    """
+    height, width = depth_img.shape
+    projector = get_backprojector(fx, fy, cx, cy, width, height)
+
+    pixels = support & (depth_img > 0)
+    if np.count_nonzero(pixels) < 3:
+        raise ValueError("Not enough tray pixels to fit the tray plane")
+
+    # Only the sampled pixels are back-projected
+    rng = np.random.default_rng(seed)
+    indices = np.flatnonzero(pixels)
+    if len(indices) > sample_size:
+        indices = indices[rng.choice(len(indices), sample_size, replace=False)]
+    z = depth_img.ravel()[indices].astype(np.float64)
+    points = np.column_stack((projector.ray_x.ravel()[indices] * z, projector.ray_y.ravel()[indices] * z, z))
+
+    # Candidates: a * X + b * Y + c * Z = 1 through three random points each
+    triples = points[rng.integers(0, len(points), size=(iterations, 3))]
+    valid = np.abs(np.linalg.det(triples)) > 1e-12
+    candidates = np.linalg.solve(triples[valid], np.ones((np.count_nonzero(valid), 3, 1)))[:, :, 0]
+    if len(candidates) == 0:
+        raise ValueError("Tray pixels are degenerate (all on one line)")
+
+    # Distances of every sampled point to every candidate, in one product
+    norms = np.linalg.norm(candidates, axis=1)
+    distances = np.abs(points @ candidates.T - 1.0) / norms
+    inliers = distances[:, np.argmax((distances <= tolerance).sum(axis=0))] <= tolerance
+
+    plane, *_ = np.linalg.lstsq(points[inliers], np.ones(np.count_nonzero(inliers)), rcond=None)
+    return plane
+
+
+def remove_tray_pixels(depth_img, mask_img, plane, tolerance, fx, fy, cx, cy):
+    """
+    The mask without the pixels within 'tolerance' of the tray plane (and
+    without pixels of no depth).
+
+    :param mask_img: (H, W) mask; non-zero pixels are material.
+    :param plane: (a, b, c) inverse-depth plane (see fit_tray_plane).
+    :param tolerance: Distance to the plane below which a pixel is tray (depth units).
+    :return: (H, W) boolean mask.
+    """
+    height, width = depth_img.shape
+    projector = get_backprojector(fx, fy, cx, cy, width, height)
+
+    pixels = (mask_img > 0) & (depth_img > 0)
+    pixels[pixels] = np.abs(pixel_heights(depth_img, pixels, plane, projector)) > tolerance
+    return pixels
+
+
+def cached_tray_plane(cache_path, frames, fx, fy, cx, cy, setup=None, refit=False, **fit_kwargs):
+    """
+    Tray plane of a camera setup: read from the cache manifest, or fitted
+    on the first readable frame (tray = the pixels outside its mask) and
+    stored there.
+
+    :param cache_path: ResultCache manifest (e.g. '<out_dir>/.tray_plane.json').
+    :param frames: (base_name, depth_path, rgb_path, mask_path) tuples to fit on.
+    :param setup: Optional name of the camera setup (rig, tray position), part
+                  of the key together with the intrinsics.
+    :param refit: Fit again even if the setup has a cached plane.
+    :param fit_kwargs: Keyword arguments forwarded to fit_tray_plane().
+    :return: (3,) array (a, b, c).
+    """
+    cache = ResultCache(cache_path)
+    key = cache.key(params=dict(fit_kwargs, fx=fx, fy=fy, cx=cx, cy=cy, setup=setup))
+    name = "tray_plane" if setup is None else f"tray_plane|{setup}"
+    plane = None if refit else cache.lookup(name, key)
+    if plane is not None:
+        return np.asarray(plane["plane"])
+
+    for base_name, depth_path, rgb_path, mask_path in frames:
+        depth_img, _, mask_img = read_frame(depth_path, rgb_path, mask_path)
+        if depth_img is None or mask_img is None:
+            continue
+        plane = fit_tray_plane(depth_img, mask_img == 0, fx, fy, cx, cy, **fit_kwargs)
+        cache.store(name, key, {"plane": plane.tolist(), "frame": base_name})
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        cache.save()
+        print(f"[INFO] Fitted the tray plane on frame {base_name}: {plane.tolist()}")
+        return plane
+
+    raise ValueError("No frame to fit the tray plane on")
@@ -1,12 +1,14 @@
 import open3d as o3d
 
+from pointcloud_cache import load_point_cloud
+
 def visualize_voxel_grid(ply_file_path, voxel_size=10):
     """
     Loads a .ply point cloud, voxelizes it with the given voxel_size,
     and visualizes the resulting voxel grid in an interactive Open3D window.
     """
-    # 1) Read the point cloud from file
-    pcd = o3d.io.read_point_cloud(ply_file_path)
+    # 1) Read the point cloud from file (or its binary cache, if present)
+    pcd = load_point_cloud(ply_file_path)
     print(f"Loaded point cloud: {ply_file_path}")
     print(f"Number of points: {len(pcd.points)}")
 
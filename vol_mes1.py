@@ -1,35 +1,46 @@
-import open3d as o3d
+import os
 
-# Load the new point cloud from the PLY file
-new_point_cloud = o3d.io.read_point_cloud(r"A:\9march\pointclouds\1_cloud.ply") #"C:\Users\hj46265\Downloads\Peanut\validation\PLY_Output\1.ply
+from pointcloud_cache import load_point_arrays
+from voxel_calibration import apply_calibration, load_calibration
+from voxel_count import count_occupied_voxels
+
+# Load the new point cloud from the PLY file (or its binary cache, if present).
+# Headless: neither this nor the voxel count below needs Open3D.
+ply_path = r"A:\9march\pointclouds\1_cloud.ply" #"C:\Users\hj46265\Downloads\Peanut\validation\PLY_Output\1.ply
+new_points, _ = load_point_arrays(ply_path)
 
 # Check if the new point cloud is empty
-if new_point_cloud.is_empty():
+if len(new_points) == 0:
     raise ValueError("The new point cloud is empty or not loaded correctly.")
 
 # Define the same voxel size used previously
 voxel_size = 0.002
 
-# Voxelize the new point cloud
-new_voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(new_point_cloud, voxel_size)
-
-# Ensure the new voxel grid is not empty
-new_voxels = new_voxel_grid.get_voxels()
-if len(new_voxels) == 0:
-    raise ValueError("The new voxel grid is empty. Try increasing the voxel size.")
-
 # Calculate the total number of occupied voxels in the new point cloud
-num_new_voxels = len(new_voxels)
+# (same count as len(VoxelGrid.create_from_point_cloud(pcd, voxel_size).get_voxels()))
+num_new_voxels = count_occupied_voxels(new_points, voxel_size, half_voxel_margin=True)
+
+# Calibration saved by "python voxel_calibration.py calibrate ..." (same voxel size)
+calibration_file = r"A:\9march\voxel_calibration.json"
 
-# Volume of one voxel in ml (previously calculated)
-volume_per_voxel_ml = 0.000380
+if os.path.isfile(calibration_file):
+    calibration = load_calibration(calibration_file)
+    if calibration["voxel_size"] != voxel_size:
+        raise ValueError(f"Calibration was fitted with voxel size {calibration['voxel_size']}, not {voxel_size}")
+    total_volume_new_point_cloud_ml = float(apply_calibration(calibration, num_new_voxels))
+else:
+    # Volume of one voxel in ml (previously calculated)
+    volume_per_voxel_ml = 0.000380
 
-# Calculate the total volume of the new point cloud in ml
-total_volume_new_point_cloud_ml = num_new_voxels * volume_per_voxel_ml
+    # Calculate the total volume of the new point cloud in ml
+    total_volume_new_point_cloud_ml = num_new_voxels * volume_per_voxel_ml
 
 # Print the results
 print(f"Total number of voxels in the new point cloud: {num_new_voxels}")
 print(f"Total volume of the new point cloud (ml): {total_volume_new_point_cloud_ml:.6f}")
 
-# Visualization
+# Visualization (imports Open3D)
+#import open3d as o3d
+#from pointcloud_cache import load_point_cloud
+#new_voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(load_point_cloud(ply_path), voxel_size)
 #o3d.visualization.draw_geometries([new_voxel_grid])
\ No newline at end of file
@@ -1,24 +1,33 @@
-import open3d as o3d
+import os
 
-# Load the point cloud
-point_cloud = o3d.io.read_point_cloud(r"A:\9march\pointclouds\1_cloud.ply")   #C:\Users\hj46265\Downloads\Peanut\validation\masks\point_cloud1.ply
+from sparse_voxels import SparseVoxelSet
 
-# Check if the point cloud is empty
-if point_cloud.is_empty():
-    raise ValueError("The point cloud is empty or not loaded correctly.")
+# Load the point cloud (or its binary cache, if present); headless, no Open3D
+ply_path = r"A:\9march\pointclouds\1_cloud.ply"   #C:\Users\hj46265\Downloads\Peanut\validation\masks\point_cloud1.ply
 
 # voxel size
 voxel_size = 0.002
 
 # Voxelize the point cloud
-voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(point_cloud, voxel_size)
+# (same voxels as o3d.geometry.VoxelGrid.create_from_point_cloud(point_cloud, voxel_size))
+voxel_set = SparseVoxelSet.from_ply(ply_path, voxel_size, half_voxel_margin=True)
+
+# Check if the point cloud is empty
+if len(voxel_set) == 0:
+    raise ValueError("The point cloud is empty or not loaded correctly.")
+
+# Keep the occupied voxels for later comparisons (other views, after drying):
+# "python sparse_voxels.py compare 1_cloud_voxels.npz <other>.npz"
+voxel_set.save(os.path.splitext(ply_path)[0] + "_voxels.npz")
 
-# Visualize the voxel grid
+# Visualize the voxel grid (imports Open3D)
+#import open3d as o3d
+#voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(o3d.io.read_point_cloud(ply_path), voxel_size)
 #o3d.visualization.draw_geometries([voxel_grid], window_name="Voxelized Point Cloud")
 
 
 # Calculate the total number of occupied voxels
-num_voxels = len(voxel_grid.get_voxels())
+num_voxels = len(voxel_set)
 
 # Manually measured volume in milliliters
 manual_volume_ml = 115  # in milliliters
@@ -0,0 +1,257 @@
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from pointcloud_cache import load_point_arrays
+from voxel_count import count_occupied_voxels
+
+# -----------------------------------------------------------------------------
+# Voxel-count -> volume calibration
+#
+#   "mean_ratio": ml/voxel = mean of (manual volume / voxel count), as vol_mes.py
+#   "ratio":      ml/voxel = least-squares slope through the origin
+#   "linear":     volume   = slope * voxel count + intercept
+# -----------------------------------------------------------------------------
+MODELS = ("mean_ratio", "ratio", "linear")
+
+
+def _count_one(args):
+    # Top-level so it can be sent to a process pool
+    ply_path, voxel_size, half_voxel_margin = args
+    points, _ = load_point_arrays(ply_path)
+    return count_occupied_voxels(points, voxel_size, half_voxel_margin=half_voxel_margin)
+
+
+def compute_voxel_counts(ply_paths, voxel_size, half_voxel_margin=True, workers=None):
+    """
+    Occupied-voxel counts of many clouds, computed in parallel.
+
+    :param ply_paths: Dict {image: ply_path}.
+    :param voxel_size: Voxel size, in the units of the point clouds.
+    :param half_voxel_margin: Grid convention (see voxel_count.voxel_origin);
+                              True matches VoxelGrid.create_from_point_cloud.
+    :param workers: Number of worker processes (None = all cores, 1 = serial).
+    :return: DataFrame with columns 'Image' and 'Num Voxels'.
+    """
+    images = list(ply_paths)
+    jobs = [(ply_paths[image], voxel_size, half_voxel_margin) for image in images]
+
+    if workers == 1:
+        counts = [_count_one(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            counts = list(pool.map(_count_one, jobs, chunksize=8))
+
+    return pd.DataFrame({"Image": images, "Num Voxels": counts})
+
+
+def load_calibration_table(
+    excel_path,
+    ply_folder,
+    voxel_size,
+    ply_pattern="{image}.ply",
+    num_images=None,
+    half_voxel_margin=True,
+    workers=None
+):
+    """
+    Joins the manual volumes of 'excel_path' to the voxel counts of the
+    matching clouds in one indexed merge.
+
+    :param excel_path: Excel file with columns "Image" and "Volume (ml)".
+    :param ply_folder: Folder with the point clouds.
+    :param ply_pattern: File name of an image's cloud, formatted with 'image'.
+    :param num_images: Only use the first N images (sorted by "Image").
+    :return: DataFrame with 'Image', 'Volume (ml)' and 'Num Voxels'; images
+             without a cloud or without occupied voxels are dropped.
+    """
+    df = pd.read_excel(excel_path)  # expects columns "Image" and "Volume (ml)"
+
+    # One row per image (the first one, as vol_mes.py did), sorted by image
+    df = df.drop_duplicates(subset="Image").sort_values(by="Image")
+    if num_images is not None:
+        df = df.head(num_images)
+
+    ply_paths = {}
+    for image in df["Image"]:
+        ply_path = os.path.join(ply_folder, ply_pattern.format(image=image))
+        if os.path.isfile(ply_path):
+            ply_paths[image] = ply_path
+        else:
+            print(f"PLY not found for image {image}, skipping.")
+
+    counts = compute_voxel_counts(ply_paths, voxel_size, half_voxel_margin, workers)
+    table = df[["Image", "Volume (ml)"]].merge(counts, on="Image", how="inner")
+
+    empty = table["Num Voxels"] == 0
+    for image in table.loc[empty, "Image"]:
+        print(f"No occupied voxels for {image}, skipping.")
+    return table.loc[~empty].reset_index(drop=True)
+
+
+def fit_model(num_voxels, volumes, model="mean_ratio"):
+    """
+    Fits volume = slope * num_voxels (+ intercept for "linear").
+
+    :return: Tuple (slope, intercept).
+    """
+    num_voxels = np.asarray(num_voxels, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+
+    if model == "mean_ratio":
+        return float(np.mean(volumes / num_voxels)), 0.0
+    if model == "ratio":
+        return float(np.dot(num_voxels, volumes) / np.dot(num_voxels, num_voxels)), 0.0
+    if model == "linear":
+        slope, intercept = np.polyfit(num_voxels, volumes, 1)
+        return float(slope), float(intercept)
+    raise ValueError(f"Unknown model {model!r}; expected one of {MODELS}")
+
+
+def error_metrics(predicted, actual):
+    """
+    MAE, RMSE (ml) and MAPE (%) of predicted vs. actual volumes.
+    """
+    predicted = np.asarray(predicted, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    errors = predicted - actual
+    return {
+        "mae_ml": float(np.mean(np.abs(errors))),
+        "rmse_ml": float(np.sqrt(np.mean(errors ** 2))),
+        "mape_pct": float(np.mean(np.abs(errors) / np.abs(actual)) * 100.0),
+    }
+
+
+def cross_validate(table, model="mean_ratio", folds=5, seed=0):
+    """
+    K-fold cross-validation of a model on a calibration table.
+
+    :return: Dict of error metrics over all held-out predictions.
+    """
+    num_voxels = table["Num Voxels"].to_numpy(dtype=np.float64)
+    volumes = table["Volume (ml)"].to_numpy(dtype=np.float64)
+    if len(table) < 2:
+        raise ValueError("Cross-validation needs at least 2 images")
+
+    folds = min(folds, len(table))
+    fold_of = np.random.default_rng(seed).permutation(len(table)) % folds
+
+    predicted = np.empty(len(table))
+    for fold in range(folds):
+        test = fold_of == fold
+        slope, intercept = fit_model(num_voxels[~test], volumes[~test], model)
+        predicted[test] = slope * num_voxels[test] + intercept
+
+    return error_metrics(predicted, volumes)
+
+
+def calibrate(table, voxel_size, model="mean_ratio", folds=5, half_voxel_margin=True):
+    """
+    Fits a model on the whole table and cross-validates it.
+
+    :return: Calibration dict (JSON-serialisable), usable with predict_volumes().
+    """
+    slope, intercept = fit_model(table["Num Voxels"], table["Volume (ml)"], model)
+    calibration = {
+        "model": model,
+        "slope_ml_per_voxel": slope,
+        "intercept_ml": intercept,
+        "voxel_size": voxel_size,
+        "half_voxel_margin": half_voxel_margin,
+        "num_images": int(len(table)),
+    }
+    if len(table) >= 2 and folds >= 2:
+        calibration["cross_validation"] = dict(cross_validate(table, model, folds), folds=folds)
+    return calibration
+
+
+def save_calibration(calibration, path):
+    with open(path, "w") as f:
+        json.dump(calibration, f, indent=2)
+
+
+def load_calibration(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def apply_calibration(calibration, num_voxels):
+    """
+    Volume(s) in ml for the given voxel count(s).
+    """
+    return calibration["slope_ml_per_voxel"] * np.asarray(num_voxels) + calibration["intercept_ml"]
+
+
+def predict_volumes(calibration, ply_paths, workers=None):
+    """
+    Applies a calibration in bulk to new clouds.
+
+    :param ply_paths: Dict {image: ply_path}.
+    :return: DataFrame with 'Image', 'Num Voxels' and 'Predicted Volume (ml)'.
+    """
+    counts = compute_voxel_counts(
+        ply_paths,
+        calibration["voxel_size"],
+        calibration["half_voxel_margin"],
+        workers
+    )
+    counts["Predicted Volume (ml)"] = apply_calibration(calibration, counts["Num Voxels"])
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate and apply voxel-count -> volume models.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    cal = subparsers.add_parser("calibrate", help="Fit a model on a validation set.")
+    cal.add_argument("excel", help='Excel file with columns "Image" and "Volume (ml)".')
+    cal.add_argument("ply_folder")
+    cal.add_argument("output", help="Calibration JSON to write.")
+    cal.add_argument("--voxel-size", type=float, default=0.00025)
+    cal.add_argument("--model", choices=MODELS, default="mean_ratio")
+    cal.add_argument("--folds", type=int, default=5)
+    cal.add_argument("--ply-pattern", default="{image}.ply")
+    cal.add_argument("--num-images", type=int, default=None)
+    cal.add_argument("--workers", type=int, default=None)
+
+    pred = subparsers.add_parser("predict", help="Apply a calibration to new clouds.")
+    pred.add_argument("calibration", help="Calibration JSON from 'calibrate'.")
+    pred.add_argument("plys", nargs="+", help="PLY files to predict volumes for.")
+    pred.add_argument("--output-csv", default=None)
+    pred.add_argument("--workers", type=int, default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        table = load_calibration_table(
+            args.excel, args.ply_folder, args.voxel_size,
+            ply_pattern=args.ply_pattern,
+            num_images=args.num_images,
+            workers=args.workers
+        )
+        calibration = calibrate(table, args.voxel_size, args.model, args.folds)
+        save_calibration(calibration, args.output)
+        print(f"[INFO] {args.model}: {calibration['slope_ml_per_voxel']:.6f} ml/voxel, "
+              f"intercept {calibration['intercept_ml']:.3f} ml ({calibration['num_images']} images)")
+        if "cross_validation" in calibration:
+            cv = calibration["cross_validation"]
+            print(f"[INFO] {cv['folds']}-fold CV: MAE {cv['mae_ml']:.3f} ml, "
+                  f"RMSE {cv['rmse_ml']:.3f} ml, MAPE {cv['mape_pct']:.1f} %")
+        print(f"[INFO] Calibration saved to {args.output}")
+    else:
+        calibration = load_calibration(args.calibration)
+        ply_paths = {os.path.splitext(os.path.basename(path))[0]: path for path in args.plys}
+        results = predict_volumes(calibration, ply_paths, args.workers)
+        if args.output_csv:
+            results.to_csv(args.output_csv, index=False)
+            print(f"[INFO] Results saved to {args.output_csv}")
+        else:
+            print(results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import numpy as np
+
+
+def voxel_origin(points, voxel_size, half_voxel_margin=False):
+    """
+    Grid origin used to voxelize 'points'.
+
+    :param points: (N, 3) array of points.
+    :param voxel_size: Edge length of a voxel.
+    :param half_voxel_margin: If False, the origin is the minimum bound of the
+        points, as in VoxelGrid.create_from_point_cloud_within_bounds(pcd,
+        voxel_size, pcd.get_min_bound(), pcd.get_max_bound()).
+        If True, it is moved half a voxel further out, as in
+        VoxelGrid.create_from_point_cloud(pcd, voxel_size).
+    :return: (3,) float64 origin.
+    """
+    origin = np.asarray(points, dtype=np.float64).min(axis=0)
+    if half_voxel_margin:
+        origin = origin - voxel_size / 2.0
+    return origin
+
+
+def voxel_indices(points, voxel_size, origin):
+    """
+    Integer (i, j, k) voxel index of every point: floor((p - origin) / voxel_size).
+
+    :return: (N, 3) int64 array.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    return np.floor((points - origin) / voxel_size).astype(np.int64)
+
+
+def pack_voxel_keys(indices):
+    """
+    Packs (N, D) integer voxel indices into one int64 key per row, so that
+    equal keys mean equal voxels. Each column is shifted to start at 0 and
+    the columns are combined in mixed radix.
+
+    :param indices: (N, D) integer array (e.g. (i, j, k) or (frame, i, j, k)).
+    :return: (N,) int64 array of keys.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if len(indices) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    mins = indices.min(axis=0)
+    dims = indices.max(axis=0) - mins + 1
+
+    # Python ints so the overflow check itself cannot overflow
+    if np.prod([int(d) for d in dims]) >= 2 ** 63:
+        raise ValueError(
+            f"Voxel grid of {tuple(int(d) for d in dims)} cells is too large for "
+            f"int64 keys; use a larger voxel size"
+        )
+
+    keys = np.zeros(len(indices), dtype=np.int64)
+    for axis in range(indices.shape[1]):
+        keys *= dims[axis]
+        keys += indices[:, axis] - mins[axis]
+    return keys
+
+
+def count_unique(keys):
+    """
+    Number of distinct values in 'keys' (sort once, count the changes).
+    """
+    if len(keys) == 0:
+        return 0
+    keys = np.sort(keys)
+    return int(np.count_nonzero(keys[1:] != keys[:-1])) + 1
+
+
+def count_occupied_voxels(points, voxel_size, origin=None, half_voxel_margin=False):
+    """
+    Number of occupied voxels of a point cloud, computed directly on the point
+    array with floor-division and unique-hashing of the voxel indices; no
+    VoxelGrid or Voxel objects are created.
+
+    With the default origin this gives the same count as
+    len(VoxelGrid.create_from_point_cloud_within_bounds(pcd, voxel_size,
+    min_bound, max_bound).get_voxels()); with half_voxel_margin=True it gives
+    the count of len(VoxelGrid.create_from_point_cloud(pcd, voxel_size).get_voxels()).
+
+    :param points: (N, 3) array of points (e.g. np.asarray(pcd.points)).
+    :param voxel_size: Edge length of a voxel (same units as the points).
+    :param origin: Optional explicit grid origin; overrides half_voxel_margin.
+    :param half_voxel_margin: See voxel_origin().
+    :return: Number of occupied voxels (int).
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) == 0:
+        return 0
+
+    if origin is None:
+        origin = voxel_origin(points, voxel_size, half_voxel_margin)
+
+    return count_unique(pack_voxel_keys(voxel_indices(points, voxel_size, origin)))
+
+
+def sweep_voxel_sizes(points, voxel_sizes, half_voxel_margin=False):
+    """
+    Occupied-voxel counts of one cloud for a whole list of voxel sizes.
+
+    The points are converted and their bounds computed once; each size then
+    only costs one floor-division and one unique count over the array.
+
+    :param points: (N, 3) array of points.
+    :param voxel_sizes: Iterable of voxel sizes to evaluate.
+    :param half_voxel_margin: See voxel_origin().
+    :return: Dict {voxel_size: num_voxels}, in the order of 'voxel_sizes'.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    counts = {}
+    if len(points) == 0:
+        return {voxel_size: 0 for voxel_size in voxel_sizes}
+
+    min_bound = points.min(axis=0)
+    for voxel_size in voxel_sizes:
+        origin = min_bound - voxel_size / 2.0 if half_voxel_margin else min_bound
+        counts[voxel_size] = count_occupied_voxels(points, voxel_size, origin=origin)
+    return counts
+
+
+def count_occupied_voxels_batch(point_arrays, voxel_size, half_voxel_margin=False):
+    """
+    Occupied-voxel counts of many clouds in one vectorised pass.
+
+    The clouds are concatenated with a frame id per point; every frame keeps
+    its own grid origin (as if voxelized alone), the (frame, i, j, k) indices
+    are packed into one int64 key and the keys of all frames are sorted together.
+    Because the frame id is the most significant digit, the sorted keys come
+    out grouped by frame, so each frame's count is the number of key changes
+    inside its block. Gives the same counts as count_occupied_voxels() per
+    cloud, without a Python loop over the points of each frame.
+
+    :param point_arrays: List of (N_f, 3) point arrays (may be empty).
+    :param voxel_size: Edge length of a voxel (same units as the points).
+    :param half_voxel_margin: See voxel_origin().
+    :return: (F,) int64 array of counts, in the order of 'point_arrays'.
+    """
+    point_arrays = [np.asarray(points, dtype=np.float64).reshape(-1, 3) for points in point_arrays]
+    lengths = np.array([len(points) for points in point_arrays], dtype=np.int64)
+    if lengths.sum() == 0:
+        return np.zeros(len(point_arrays), dtype=np.int64)
+
+    return _count_grouped_blocks(np.concatenate(point_arrays), lengths, voxel_size, half_voxel_margin)
+
+
+def count_occupied_voxels_grouped(points, group_ids, voxel_size, half_voxel_margin=False):
+    """
+    Occupied-voxel counts of the groups of one cloud (e.g. the instances of
+    a label mask), each voxelized on its own grid as if it were a separate
+    cloud. One stable sort by group, then the same single pass as
+    count_occupied_voxels_batch().
+
+    :param points: (N, 3) array of points.
+    :param group_ids: (N,) integer group id of every point.
+    :param voxel_size: Edge length of a voxel (same units as the points).
+    :param half_voxel_margin: See voxel_origin().
+    :return: Tuple (ids, counts, num_points): sorted unique group ids and
+             their occupied-voxel and point counts.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    ids, inverse, lengths = np.unique(np.asarray(group_ids).ravel(), return_inverse=True, return_counts=True)
+    if len(ids) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return ids, empty, empty
+
+    order = np.argsort(inverse, kind="stable")
+    counts = _count_grouped_blocks(points[order], lengths.astype(np.int64), voxel_size, half_voxel_margin)
+    return ids, counts, lengths
+
+
+def _count_grouped_blocks(points, lengths, voxel_size, half_voxel_margin):
+    # 'points' is a float64 array (modified in place) holding the groups as
+    # consecutive blocks of 'lengths' points
+    counts = np.zeros(len(lengths), dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    nonempty = lengths > 0
+
+    # Per-group origin (min bound), repeated for the points of each group
+    origins = np.zeros((len(lengths), 3))
+    origins[nonempty] = np.minimum.reduceat(points, starts[nonempty], axis=0)
+    if half_voxel_margin:
+        origins -= voxel_size / 2.0
+    points -= np.repeat(origins, lengths, axis=0)
+    points /= voxel_size
+
+    # Key = group * stride + packed (i, j, k), the group being the top digit
+    keys = pack_voxel_keys(np.floor(points).astype(np.int64))
+    stride = int(keys.max()) + 1
+    if stride * len(lengths) >= 2 ** 63:
+        raise ValueError("Too many voxels for int64 keys; use a larger voxel size or smaller batches")
+    keys += np.repeat(np.arange(len(lengths), dtype=np.int64) * stride, lengths)
+    keys.sort()
+
+    first = np.empty(len(keys), dtype=bool)
+    first[0] = True
+    np.not_equal(keys[1:], keys[:-1], out=first[1:])
+    counts[nonempty] = np.add.reduceat(first, starts[nonempty], dtype=np.int64)
+    return counts
+
+
+def count_occupied_voxels_streamed(chunks, voxel_size, min_bound, max_bound, half_voxel_margin=False):
+    """
+    Occupied-voxel count of a cloud that is only available in chunks (e.g.
+    read back from disk), with memory bounded by the number of occupied
+    voxels rather than of points.
+
+    The bounds of the whole cloud must be known up front (e.g. from
+    pointcloud_cache.PlyStreamWriter): they fix the grid origin and the
+    packing of the (i, j, k) keys, so every chunk is keyed on the same grid
+    and the per-chunk unique keys are merged into one sorted set. Gives the
+    same count as count_occupied_voxels() on the concatenated points.
+
+    :param chunks: Iterable of (N_c, 3) point arrays.
+    :param voxel_size: Edge length of a voxel (same units as the points).
+    :param min_bound, max_bound: (3,) bounds of all the points.
+    :param half_voxel_margin: See voxel_origin().
+    :return: Number of occupied voxels (int).
+    """
+    min_bound = np.asarray(min_bound, dtype=np.float64)
+    origin = voxel_origin(min_bound[np.newaxis], voxel_size, half_voxel_margin)
+    dims = np.floor((np.asarray(max_bound, dtype=np.float64) - origin) / voxel_size).astype(np.int64) + 1
+    if np.prod([int(d) for d in dims]) >= 2 ** 63:
+        raise ValueError(
+            f"Voxel grid of {tuple(int(d) for d in dims)} cells is too large for "
+            f"int64 keys; use a larger voxel size"
+        )
+
+    occupied = np.zeros(0, dtype=np.int64)
+    for points in chunks:
+        indices = voxel_indices(np.asarray(points).reshape(-1, 3), voxel_size, origin)
+        keys = (indices[:, 0] * dims[1] + indices[:, 1]) * dims[2] + indices[:, 2]
+        occupied = np.union1d(occupied, keys)
+    return len(occupied)